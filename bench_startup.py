@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+起動時間のベンチマーク
+Webサーバー・CLIのモジュールを新しいPythonプロセスでimportする時間を測り、
+重い依存（torch、librosa、TensorFlow等）が起動時に読み込まれていないことを確認する
+
+    python bench_startup.py                # 計測して表示
+    python bench_startup.py --max-seconds 1.5   # 中央値が超えたら終了コード1
+
+重い依存がimportされていた場合も終了コード1（起動時間の劣化を防ぐため）
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# 起動時にimportしてはいけないモジュール（使う処理の中で遅延importする）
+HEAVY_MODULES = ('torch', 'librosa', 'numba', 'tensorflow', 'inaSpeechSegmenter', 'clearvoice', 'parselmouth')
+# 計測するモジュール
+TARGETS = ('voice_changer', 'voice_changer_web')
+
+MEASURE_CODE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, runs: int) -> dict:
+    """moduleを新しいプロセスでruns回importし、時間の中央値と読み込まれた重いモジュールを返す"""
+    times = []
+    heavy = set()
+    code = MEASURE_CODE.format(module=module, heavy=HEAVY_MODULES)
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        if result.returncode != 0:
+            raise RuntimeError(f"{module} のimportに失敗しました:\n{result.stderr}")
+        data = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(data['seconds'])
+        heavy.update(data['heavy'])
+    return {'median': statistics.median(times), 'min': min(times), 'heavy': sorted(heavy)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='起動時間のベンチマーク')
+    parser.add_argument('--runs', type=int, default=5, help='計測回数（デフォルト: 5）')
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help='importの中央値の上限（秒）。超えたら終了コード1')
+    args = parser.parse_args()
+
+    failed = False
+    for module in TARGETS:
+        result = measure(module, args.runs)
+        print(f"{module}: 中央値 {result['median']:.3f}秒（最小 {result['min']:.3f}秒、{args.runs}回）")
+        if result['heavy']:
+            print(f"  NG: 起動時に重いモジュールがimportされています: {', '.join(result['heavy'])}")
+            failed = True
+        if args.max_seconds is not None and result['median'] > args.max_seconds:
+            print(f"  NG: 上限 {args.max_seconds}秒 を超えています")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -19,7 +19,17 @@ import { Progress } from '@/components/ui/progress'
 import { Tooltip, TooltipContent, TooltipProvider, TooltipTrigger } from '@/components/ui/tooltip'
 import { Header } from '@/components/layout/header'
 import { Main } from '@/components/layout/main'
-import { uploadForEditor, applyManualPitch, getAudioUrl, getVideoUrl, getDownloadUrl, getStatus, pollStatus, type ProcessedSegment, type StatusResponse } from '@/lib/api'
+import { uploadForEditor, applyManualPitch, getAudioUrl, getVideoUrl, getDownloadUrl, getStatus, getPeaks, getRegionPreviewUrl, pollStatus, type ProcessedSegment, type StatusResponse } from '@/lib/api'
+
+// Draw the waveform from precomputed peaks when the backend has them,
+// so the audio is streamed for playback instead of downloaded and decoded up front
+async function loadWaveform(ws: WaveSurfer, taskId: string) {
+  const peaks = await getPeaks(taskId)
+  if (peaks) {
+    return ws.load(getAudioUrl(taskId), [peaks.data], peaks.duration)
+  }
+  return ws.load(getAudioUrl(taskId))
+}
 
 interface RegionData {
   id: string
@@ -85,7 +95,6 @@ export function WaveformEditor() {
       barGap: 1,
       barRadius: 2,
       normalize: true,
-      backend: 'WebAudio',
     })
 
     const regionsPlugin = ws.registerPlugin(RegionsPlugin.create())
@@ -162,7 +171,7 @@ export function WaveformEditor() {
     // Load audio if taskId is provided
     if (taskId) {
       setIsLoading(true)
-      ws.load(getAudioUrl(taskId))
+      loadWaveform(ws, taskId)
 
       // Fetch processed segments from backend
       getStatus(taskId).then((status) => {
@@ -184,7 +193,7 @@ export function WaveformEditor() {
     if (!wavesurferRef.current) return
 
     setIsLoading(true)
-    wavesurferRef.current.load(getAudioUrl(newTaskId))
+    loadWaveform(wavesurferRef.current, newTaskId)
 
     // Clear existing regions (but keep applied regions for display)
     regionsRef.current?.clearRegions()
@@ -355,6 +364,17 @@ export function WaveformEditor() {
     }
   }
 
+  // Audition the selected region with the current settings without applying it
+  const previewAudioRef = useRef<HTMLAudioElement | null>(null)
+  const handlePreviewPitch = () => {
+    if (!selection || !taskId) return
+    const semitones = direction === 'down' ? -Math.abs(shift) : Math.abs(shift)
+    previewAudioRef.current?.pause()
+    const audio = new Audio(getRegionPreviewUrl(taskId, selection.start, selection.end, semitones))
+    previewAudioRef.current = audio
+    audio.play().catch(() => toast.error('試聴に失敗しました'))
+  }
+
   // Apply pitch shift immediately to the selected region
   const handleApplyPitch = async () => {
     if (!selection) {
@@ -419,7 +439,7 @@ export function WaveformEditor() {
 
       // Reload the processed audio without clearing applied regions
       if (wavesurferRef.current) {
-        wavesurferRef.current.load(getAudioUrl(response.task_id))
+        loadWaveform(wavesurferRef.current, response.task_id)
       }
 
       // Clear selection
@@ -889,6 +909,10 @@ export function WaveformEditor() {
                           長さ: {(selection.end - selection.start).toFixed(2)}秒 · {direction === 'down' ? '下げる' : '上げる'} {shift}半音
                         </div>
                       </div>
+                      <Button variant="outline" onClick={handlePreviewPitch} disabled={isProcessing}>
+                        <Play className="mr-2 h-4 w-4" />
+                        試聴
+                      </Button>
                       <Button onClick={handleApplyPitch} disabled={isProcessing}>
                         {isProcessing ? (
                           <Loader2 className="mr-2 h-4 w-4 animate-spin" />
@@ -21,6 +21,7 @@ export function VoiceChanger() {
   const [mode, setMode] = useState<'ai' | 'simple' | 'precision'>('ai')
   const [pitchShift, setPitchShift] = useState(-3)
   const [doubleCheck, setDoubleCheck] = useState(true)
+  const [pitchEngine, setPitchEngine] = useState<'pyin' | 'yin'>('pyin')
   const [state, setState] = useState<ProcessingState>('idle')
   const [progress, setProgress] = useState(0)
   const [message, setMessage] = useState('')
@@ -34,7 +35,7 @@ export function VoiceChanger() {
   const copyLogs = useCallback(() => {
     const logText = logs.map((log) => `[${log.type || 'info'}] ${log.message}`).join('\n')
     const modeNames = { ai: 'AI声質判定', simple: '簡易ピッチ検出', precision: '高精度（話者分離+CNN）' }
-    const fullText = `=== 処理ログ ===\nファイル: ${file?.name || '不明'}\nモード: ${modeNames[mode]}\nピッチシフト: ${pitchShift}半音\nダブルチェック: ${doubleCheck ? '有効' : '無効'}\n\n${logText}`
+    const fullText = `=== 処理ログ ===\nファイル: ${file?.name || '不明'}\nモード: ${modeNames[mode]}\nピッチシフト: ${pitchShift}半音\nダブルチェック: ${doubleCheck ? '有効' : '無効'}\nピッチ推定エンジン: ${pitchEngine}\n\n${logText}`
     navigator.clipboard.writeText(fullText).then(() => {
       setLogsCopied(true)
       toast.success('ログをコピーしました')
@@ -42,7 +43,7 @@ export function VoiceChanger() {
     }).catch(() => {
       toast.error('コピーに失敗しました')
     })
-  }, [logs, file, mode, pitchShift, doubleCheck])
+  }, [logs, file, mode, pitchShift, doubleCheck, pitchEngine])
 
   const handleDragOver = useCallback((e: React.DragEvent) => {
     e.preventDefault()
@@ -87,6 +88,7 @@ export function VoiceChanger() {
         mode,
         pitchShift,
         doubleCheck,
+        pitchEngine,
         onProgress: (p) => {
           setProgress(p)
           setMessage(`アップロード中: ${p}%`)
@@ -278,6 +280,26 @@ export function VoiceChanger() {
                   </div>
                 )}
 
+                {mode === 'simple' && (
+                  <div className="space-y-3">
+                    <Label>ピッチ推定エンジン</Label>
+                    <RadioGroup value={pitchEngine} onValueChange={(v) => setPitchEngine(v as 'pyin' | 'yin')}>
+                      <div className="flex items-center space-x-2">
+                        <RadioGroupItem value="pyin" id="engine-pyin" />
+                        <Label htmlFor="engine-pyin" className="cursor-pointer">
+                          pYIN（精度重視）
+                        </Label>
+                      </div>
+                      <div className="flex items-center space-x-2">
+                        <RadioGroupItem value="yin" id="engine-yin" />
+                        <Label htmlFor="engine-yin" className="cursor-pointer">
+                          YIN（高速、長い動画向け）
+                        </Label>
+                      </div>
+                    </RadioGroup>
+                  </div>
+                )}
+
                 <Button
                   className="w-full"
                   size="lg"
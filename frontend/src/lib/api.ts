@@ -33,6 +33,21 @@ export interface StatusResponse {
   output_audio?: string
   logs?: LogEntry[]
   processed_segments?: ProcessedSegment[]
+  // Set while the job waits in the server's job queue
+  queued?: boolean
+  queue_position?: number
+  // Id of the newest log entry included; pass it back as `since` to get only newer entries
+  log_cursor?: number
+}
+
+export interface PeaksResponse {
+  sample_rate: number
+  samples_per_bin: number
+  levels: number[]
+  length: number
+  duration: number
+  // Interleaved [min, max, min, max, ...] in -1..1
+  data: number[]
 }
 
 export interface Region {
@@ -63,6 +78,7 @@ export async function uploadFile(
     mode?: 'ai' | 'simple' | 'precision'
     pitchShift?: number
     doubleCheck?: boolean
+    pitchEngine?: 'pyin' | 'yin'
     onProgress?: (progress: number) => void
   } = {}
 ): Promise<UploadResponse> {
@@ -78,6 +94,8 @@ export async function uploadFile(
   formData.append('mode', backendMode)
   formData.append('pitch', String(options.pitchShift || -3))
   formData.append('double_check', options.doubleCheck ? '1' : '0')
+  // Pitch engine for simple mode: 'pyin' (accurate) or 'yin' (fast)
+  formData.append('pitch_engine', options.pitchEngine || 'pyin')
 
   const response = await api.post<UploadResponse>('/upload', formData, {
     headers: {
@@ -114,8 +132,10 @@ export async function uploadForEditor(
   return response.data
 }
 
-export async function getStatus(taskId: string): Promise<StatusResponse> {
-  const response = await api.get<StatusResponse>(`/status/${taskId}`)
+export async function getStatus(taskId: string, since?: number): Promise<StatusResponse> {
+  const response = await api.get<StatusResponse>(`/status/${taskId}`, {
+    params: since ? { since } : undefined,
+  })
   return response.data
 }
 
@@ -126,6 +146,12 @@ export async function applyManualPitch(
   return response.data
 }
 
+// Re-run only pitch shifting and muxing for a finished task, reusing its detected regions/stems
+export async function rerender(taskId: string, pitchShift: number): Promise<UploadResponse> {
+  const response = await api.post<UploadResponse>(`/rerender/${taskId}`, { pitch: pitchShift })
+  return response.data
+}
+
 export function getDownloadUrl(taskId: string, type: 'video' | 'audio' = 'video'): string {
   return `/download/${taskId}?type=${type}`
 }
@@ -134,34 +160,90 @@ export function getAudioUrl(taskId: string): string {
   return `/audio/${taskId}`
 }
 
+// Precomputed waveform peaks; null when the task has none (e.g. editor uploads)
+export async function getPeaks(taskId: string, level?: number): Promise<PeaksResponse | null> {
+  try {
+    const response = await api.get<PeaksResponse>(`/peaks/${taskId}`, {
+      params: level ? { level } : undefined,
+    })
+    return response.data
+  } catch {
+    return null
+  }
+}
+
+// Short clip of [start, end] shifted by `semitones`, rendered on demand for auditioning before applying
+export function getRegionPreviewUrl(taskId: string, start: number, end: number, semitones: number): string {
+  const params = new URLSearchParams({
+    task_id: taskId,
+    start: start.toFixed(3),
+    end: end.toFixed(3),
+    semitones: String(semitones),
+  })
+  return `/preview?${params}`
+}
+
 export function getVideoUrl(taskId: string): string {
   return `/video/${taskId}`
 }
 
-// Polling helper
+// Status updates: streamed from `/events` (Server-Sent Events) when available, otherwise polled.
+// The server only sends log entries newer than the cursor, so they are accumulated here and
+// onProgress always receives the full log list.
 export async function pollStatus(
   taskId: string,
   onProgress: (status: StatusResponse) => void,
   intervalMs = 1000
 ): Promise<StatusResponse> {
   return new Promise((resolve, reject) => {
+    let logs: LogEntry[] = []
+    let cursor = 0
+    let source: EventSource | null = null
+
+    // Returns true once the task has finished
+    const handle = (delta: StatusResponse): boolean => {
+      logs = logs.concat(delta.logs || [])
+      cursor = delta.log_cursor ?? cursor
+      const status = { ...delta, logs }
+      onProgress(status)
+
+      if (status.status === 'completed' || status.status === 'complete') {
+        resolve(status)
+        return true
+      }
+      if (status.status === 'error') {
+        reject(new Error(status.message || status.step || 'エラーが発生しました'))
+        return true
+      }
+      return false
+    }
+
     const poll = async () => {
       try {
-        const status = await getStatus(taskId)
-        onProgress(status)
-
-        if (status.status === 'completed' || status.status === 'complete') {
-          resolve(status)
-        } else if (status.status === 'error') {
-          reject(new Error(status.message || status.step || 'エラーが発生しました'))
-        } else {
+        if (!handle(await getStatus(taskId, cursor))) {
           setTimeout(poll, intervalMs)
         }
       } catch (error) {
         reject(error)
       }
     }
-    poll()
+
+    if (typeof EventSource === 'undefined') {
+      poll()
+      return
+    }
+
+    source = new EventSource(`/events/${taskId}`)
+    source.onmessage = (event) => {
+      if (handle(JSON.parse(event.data) as StatusResponse)) {
+        source?.close()
+      }
+    }
+    source.onerror = () => {
+      // The stream was dropped (or the server closed it): continue from the cursor by polling
+      source?.close()
+      poll()
+    }
   })
 }
 
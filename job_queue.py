@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+処理ジョブのキュー
+重い処理（CNN判定・話者分離）と軽い処理（解析・手動編集）をレーンに分け、
+レーンごとに同時実行数を制限する。待ち行列は優先度順（同じ優先度なら先着順）
+
+ジョブはレーンごとのワーカープロセスで実行する（librosa等のPythonループがGILを握っても
+Webサーバー側が止まらないように）。ジョブからの進捗・ログはイベントキューで親プロセスへ送る
+"""
+
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# レーンごとの同時実行数（環境変数で変更可）
+HEAVY_JOB_WORKERS = int(os.environ.get('VOICE_CHANGER_HEAVY_JOBS', 1))
+LIGHT_JOB_WORKERS = int(os.environ.get('VOICE_CHANGER_LIGHT_JOBS', 2))
+# レーンごとの待ち行列の上限（これを超える投入は受け付けない）
+MAX_QUEUED_JOBS = int(os.environ.get('VOICE_CHANGER_MAX_QUEUED', 20))
+# 0ならワーカープロセスを使わずスレッドで実行する（デバッグ用）
+USE_JOB_PROCESSES = os.environ.get('VOICE_CHANGER_JOB_PROCESSES', '1') != '0'
+
+
+def _init_process_worker(event_queue, initializer) -> None:
+    """ワーカープロセスの初期化（イベントキューを渡し、モデルの事前読み込み等を行う）"""
+    if initializer:
+        initializer(event_queue)
+
+
+class QueueFullError(Exception):
+    """待ち行列が満杯でジョブを受け付けられない"""
+
+
+class JobQueue:
+    """
+    レーンごとに固定数のワーカーで実行するジョブキュー
+
+    レーンごとにディスパッチ用のスレッドと同数のワーカープロセス（プール）を持つ。
+    スレッド・プロセスは最初のsubmitで起動する（ワーカープロセスがこのモジュールを
+    importしたときに再帰的に起動しないように）
+
+    Args:
+        lanes: {レーン名: 同時実行数}
+        max_queued: レーンごとの待ち行列の上限
+        event_handler: ワーカープロセスから送られたイベントを親プロセスで処理する関数
+        worker_initializers: {レーン名: 初期化関数(event_queue)}。ワーカープロセスの起動時に呼ぶ
+        use_processes: Falseならワーカープロセスを使わず、ディスパッチ用スレッドで直接実行する
+    """
+
+    def __init__(self, lanes: dict, max_queued: int = MAX_QUEUED_JOBS, event_handler=None,
+                 worker_initializers: dict = None, use_processes: bool = USE_JOB_PROCESSES):
+        self.max_queued = max_queued
+        self.use_processes = use_processes
+        self._event_handler = event_handler
+        self._worker_initializers = worker_initializers or {}
+        self._cond = threading.Condition()
+        self._queues = {lane: [] for lane in lanes}
+        self._running = {lane: set() for lane in lanes}
+        self._workers = dict(lanes)
+        self._pools = {}
+        self._event_queue = None
+        self._seq = itertools.count()
+        self._started = False
+
+    def _start(self) -> None:
+        """ディスパッチ用スレッドとイベント受信スレッドを起動する（_condを保持して呼ぶ）"""
+        if self._started:
+            return
+        self._started = True
+        if self.use_processes:
+            self._event_queue = multiprocessing.get_context('spawn').Queue()
+            threading.Thread(target=self._receive_events, name="job-events", daemon=True).start()
+        for lane, workers in self._workers.items():
+            for i in range(max(1, workers)):
+                thread = threading.Thread(target=self._worker, args=(lane,),
+                                          name=f"job-{lane}-{i}", daemon=True)
+                thread.start()
+
+    def _receive_events(self) -> None:
+        while True:
+            event = self._event_queue.get()
+            try:
+                if self._event_handler:
+                    self._event_handler(event)
+            except Exception:
+                traceback.print_exc()
+
+    def _pool(self, lane: str) -> ProcessPoolExecutor:
+        with self._cond:
+            pool = self._pools.get(lane)
+            if pool is None:
+                pool = ProcessPoolExecutor(
+                    max_workers=max(1, self._workers[lane]),
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_process_worker,
+                    initargs=(self._event_queue, self._worker_initializers.get(lane))
+                )
+                self._pools[lane] = pool
+            return pool
+
+    def _discard_pool(self, lane: str) -> None:
+        """ワーカープロセスが異常終了したプールを捨てる（次のジョブで作り直す）"""
+        with self._cond:
+            pool = self._pools.pop(lane, None)
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def submit(self, job_id: str, target, args: tuple = (), lane: str = 'light', priority: int = 0,
+               on_start=None, on_error=None) -> int:
+        """
+        ジョブを待ち行列に入れる
+
+        priorityが小さいほど先に実行する。満杯ならQueueFullError。
+        ワーカープロセスで実行する場合、targetとargsはpickle可能である必要がある
+
+        Args:
+            on_start: 実行開始時に親プロセスで呼ぶ関数（引数なし）
+            on_error: ジョブが例外なしに終われなかった場合（プロセスの異常終了など）に
+                      親プロセスで呼ぶ関数(exception)
+
+        Returns:
+            待ち行列での順番（1始まり）
+        """
+        with self._cond:
+            self._start()
+            queue = self._queues[lane]
+            if len(queue) >= self.max_queued:
+                raise QueueFullError(f"処理待ちが多いため受け付けできません（待ち: {len(queue)}件）。しばらくしてから再度お試しください")
+            heapq.heappush(queue, (priority, next(self._seq), job_id, target, args, on_start, on_error))
+            self._cond.notify_all()
+            return self._position(job_id)
+
+    def _position(self, job_id: str):
+        for queue in self._queues.values():
+            for index, entry in enumerate(sorted(queue)):
+                if entry[2] == job_id:
+                    return index + 1
+        return None
+
+    def position(self, job_id: str):
+        """待ち行列での順番（1始まり）。実行中・終了済みならNone"""
+        with self._cond:
+            return self._position(job_id)
+
+    def stats(self) -> dict:
+        """レーンごとの待ち件数・実行中件数・同時実行数"""
+        with self._cond:
+            return {
+                lane: {
+                    'queued': len(self._queues[lane]),
+                    'running': len(self._running[lane]),
+                    'workers': self._workers[lane]
+                }
+                for lane in self._queues
+            }
+
+    def _worker(self, lane: str) -> None:
+        while True:
+            with self._cond:
+                while not self._queues[lane]:
+                    self._cond.wait()
+                _, _, job_id, target, args, on_start, on_error = heapq.heappop(self._queues[lane])
+                self._running[lane].add(job_id)
+            try:
+                if on_start:
+                    on_start()
+                if self.use_processes:
+                    self._pool(lane).submit(target, *args).result()
+                else:
+                    target(*args)
+            except Exception as e:
+                # 通常はジョブ側でエラー状態を記録する。ここではワーカーを止めないことだけを保証する
+                traceback.print_exc()
+                if isinstance(e, BrokenProcessPool):
+                    self._discard_pool(lane)
+                if on_error:
+                    try:
+                        on_error(e)
+                    except Exception:
+                        traceback.print_exc()
+            finally:
+                with self._cond:
+                    self._running[lane].discard(job_id)
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+モデルサーバー
+CNN性別判定（inaSpeechSegmenter）と話者分離（ClearVoice）のモデルを常駐プロセスで先に読み込んでおき、
+ジョブのプロセスからの推論要求をソケット（Unixドメインソケット、WindowsではNamed Pipe）で受け付ける。
+モデルごとに1つの推論スレッドを持ち、要求を届いた順に処理する。
+CNN判定は少し待って届いた要求（長い音声のチャンクや、他のジョブからの要求）をまとめ、
+1回の推論で判定する。話者分離は1件ずつ処理する
+
+Webサーバーが起動時に start() で立ち上げ、接続先を環境変数でジョブのプロセスに渡す。
+サーバーが無い・使えない場合、呼び出し側はこれまで通りプロセス内でモデルを読み込む
+"""
+
+import os
+import queue
+import threading
+import time
+import traceback
+import multiprocessing
+from multiprocessing.connection import Client, Listener
+
+# 0ならモデルサーバーを起動しない（各ジョブのプロセスでモデルを読み込む）
+USE_MODEL_SERVER = os.environ.get('VOICE_CHANGER_USE_MODEL_SERVER', '1') != '0'
+# 接続先と認証キー（start()が設定し、あとから起動するワーカープロセスに引き継がれる）
+ADDRESS_ENV = 'VOICE_CHANGER_MODEL_SERVER_ADDRESS'
+AUTHKEY_ENV = 'VOICE_CHANGER_MODEL_SERVER_KEY'
+# 読み込むモデル（読み込み順）
+MODEL_NAMES = ('ina', 'clearvoice')
+# まとめて推論する要求
+BATCH_OPS = ('segment_ina',)
+# 要求を集める時間（秒）。最初の要求からこの間に届いた要求を1回の推論にまとめる
+BATCH_WINDOW = 0.05
+# 1回の推論にまとめる音声の長さの上限（秒）。推論の入力のメモリはこれに比例する
+BATCH_MAX_SECONDS = 900.0
+
+_local = threading.local()
+
+
+class ModelServerError(Exception):
+    """モデルサーバーでの推論に失敗した"""
+
+
+class ModelServerUnavailable(ModelServerError):
+    """モデルサーバーに接続できない、またはモデルを読み込めていない（呼び出し側で読み込んで処理する）"""
+
+
+# このプロセスで使えないと分かったモデル（以降は問い合わせずにプロセス内で読み込む）
+_unavailable = set()
+
+
+# ===== サーバー側（常駐プロセス） =====
+
+def _load_model(name: str):
+    import voice_changer
+    if name == 'ina':
+        return voice_changer.get_ina_segmenter()
+    return voice_changer.get_clearvoice_separator()
+
+
+def _run_requests(model, op: str, args_list: list) -> list:
+    """同じ種類の要求をまとめて処理し、要求ごとの結果を返す"""
+    if op == 'segment_ina':
+        import voice_changer
+        return voice_changer.segment_ina_batch(model, args_list)
+    if op == 'separate':
+        for input_path, output_dir in args_list:
+            model(input_path=input_path, online_write=True, output_path=output_dir)
+        return [None] * len(args_list)
+    raise ValueError(f"不明な要求: {op}")
+
+
+def _request_seconds(request) -> float:
+    """要求の音声の長さ（秒）。CNN判定の要求は(y, offset)"""
+    import voice_changer
+    op, args, _ = request
+    return len(args[0]) / voice_changer.INA_SR if op == 'segment_ina' else 0.0
+
+
+class _ModelSlot:
+    """1つのモデルと、その要求の待ち行列・推論スレッド"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.requests = queue.Queue()
+        self.state = 'cold'
+        self.error = None
+        self.load_seconds = None
+        self.served = 0
+        self.batches = 0
+
+    def info(self) -> dict:
+        return {
+            'state': self.state,
+            'error': self.error,
+            'load_seconds': self.load_seconds,
+            'pending': self.requests.qsize(),
+            'requests': self.served,
+            'batches': self.batches
+        }
+
+    def run(self, loaded: threading.Event) -> None:
+        # 前のモデルの読み込みが終わってから読み込む（同時に読み込んでメモリを使い切らないように）
+        model = None
+        self.state = 'loading'
+        started = time.time()
+        try:
+            model = _load_model(self.name)
+            self.state = 'warm'
+            self.load_seconds = round(time.time() - started, 2)
+        except Exception as e:
+            self.state = 'unavailable'
+            self.error = str(e)
+        finally:
+            loaded.set()
+
+        carry = None
+        while True:
+            request = carry or self.requests.get()
+            carry = None
+            if model is None:
+                request[2](('unavailable', f"{self.name}は使用できません: {self.error}"))
+                continue
+            batch = [request]
+            if request[0] in BATCH_OPS:
+                seconds = _request_seconds(request)
+                deadline = time.time() + BATCH_WINDOW
+                while seconds < BATCH_MAX_SECONDS:
+                    try:
+                        following = self.requests.get(timeout=max(0.0, deadline - time.time()))
+                    except queue.Empty:
+                        break
+                    following_seconds = _request_seconds(following)
+                    if following[0] != request[0] or seconds + following_seconds > BATCH_MAX_SECONDS:
+                        # 次の推論の先頭にする
+                        carry = following
+                        break
+                    batch.append(following)
+                    seconds += following_seconds
+            self._serve(model, request[0], batch)
+
+    def _serve(self, model, op: str, batch: list) -> None:
+        """まとめた要求を処理し、それぞれに結果を返す"""
+        try:
+            results = _run_requests(model, op, [args for _, args, _ in batch])
+        except Exception as e:
+            traceback.print_exc()
+            if len(batch) > 1:
+                # どの要求で失敗したか分からないため、1件ずつやり直す
+                for request in batch:
+                    self._serve(model, op, [request])
+                return
+            batch[0][2](('error', str(e)))
+            self.served += 1
+            return
+        self.batches += 1
+        self.served += len(batch)
+        for (_, _, reply), result in zip(batch, results):
+            reply(('ok', result))
+
+
+def _handle_connection(conn, slots: dict, started: float) -> None:
+    """1つの接続からの要求を順に処理する（接続ごとのスレッド）"""
+    try:
+        while True:
+            try:
+                model, op, args = conn.recv()
+            except EOFError:
+                break
+            if op == 'status':
+                conn.send(('ok', {
+                    'pid': os.getpid(),
+                    'uptime': round(time.time() - started, 1),
+                    'models': {name: slot.info() for name, slot in slots.items()}
+                }))
+                continue
+            slot = slots.get(model)
+            if slot is None:
+                conn.send(('error', f"不明なモデル: {model}"))
+                continue
+            done = threading.Event()
+            result = []
+            slot.requests.put((op, args, lambda value: (result.append(value), done.set())))
+            done.wait()
+            conn.send(result[0])
+    except Exception:
+        traceback.print_exc()
+    finally:
+        conn.close()
+
+
+def serve(address_conn, authkey: bytes) -> None:
+    """常駐プロセスの本体。接続先を親に送ってから、モデルを読み込みつつ要求を受け付ける"""
+    listener = Listener(authkey=authkey)
+    address_conn.send(listener.address)
+    address_conn.close()
+
+    started = time.time()
+    slots = {name: _ModelSlot(name) for name in MODEL_NAMES}
+
+    def load_in_order():
+        for slot in slots.values():
+            loaded = threading.Event()
+            threading.Thread(target=slot.run, args=(loaded,), name=f"model-{slot.name}", daemon=True).start()
+            loaded.wait()
+    threading.Thread(target=load_in_order, name="model-loader", daemon=True).start()
+
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception:
+            # 認証に失敗した接続などは無視する
+            continue
+        threading.Thread(target=_handle_connection, args=(conn, slots, started), daemon=True).start()
+
+
+class ModelServer:
+    """Webサーバー側からモデルサーバーのプロセスを起動・監視する"""
+
+    def __init__(self):
+        self.process = None
+        self.address = None
+
+    def start(self) -> None:
+        """常駐プロセスを起動し、接続先を環境変数に設定する（以降に起動するプロセスが使う）"""
+        if self.process is not None and self.process.is_alive():
+            return
+        context = multiprocessing.get_context('spawn')
+        authkey = os.urandom(16)
+        parent_conn, child_conn = context.Pipe()
+        self.process = context.Process(target=serve, args=(child_conn, authkey),
+                                       name="model-server", daemon=True)
+        self.process.start()
+        self.address = parent_conn.recv()
+        parent_conn.close()
+        os.environ[ADDRESS_ENV] = self.address
+        os.environ[AUTHKEY_ENV] = authkey.hex()
+        print(f"[MODELS] モデルサーバーを起動しました（pid={self.process.pid}）")
+
+    def status(self) -> dict:
+        """モデルごとの状態（cold/loading/warm/unavailable）"""
+        if self.process is None or not self.process.is_alive():
+            return {'running': False, 'models': {name: {'state': 'cold'} for name in MODEL_NAMES}}
+        try:
+            info = call(None, 'status', timeout=2.0)
+        except ModelServerError as e:
+            return {'running': False, 'error': str(e),
+                    'models': {name: {'state': 'cold'} for name in MODEL_NAMES}}
+        return {'running': True, **info}
+
+
+# ===== クライアント側（ジョブのプロセス） =====
+
+def _connection():
+    """スレッドごとの接続（同じプロセスの並列な要求が互いを待たないように）"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        address = os.environ.get(ADDRESS_ENV)
+        if not address:
+            raise ModelServerUnavailable("モデルサーバーが起動していません")
+        try:
+            conn = Client(address, authkey=bytes.fromhex(os.environ.get(AUTHKEY_ENV, '')))
+        except Exception as e:
+            raise ModelServerUnavailable(f"モデルサーバーに接続できません: {e}")
+        _local.conn = conn
+    return conn
+
+
+def _drop_connection() -> None:
+    conn = getattr(_local, 'conn', None)
+    _local.conn = None
+    if conn is not None:
+        try:
+            conn.close()
+        except:
+            pass
+
+
+def call(model, op: str, *args, timeout: float = None):
+    """モデルサーバーに要求を送り、結果を待つ"""
+    conn = _connection()
+    try:
+        conn.send((model, op, args))
+        if timeout is not None and not conn.poll(timeout):
+            # 応答の順序がずれるため、この接続は使わない
+            _drop_connection()
+            raise ModelServerUnavailable("モデルサーバーの応答がありません")
+        status, value = conn.recv()
+    except (EOFError, OSError) as e:
+        _drop_connection()
+        raise ModelServerUnavailable(f"モデルサーバーとの通信に失敗しました: {e}")
+    if status == 'unavailable':
+        raise ModelServerUnavailable(value)
+    if status != 'ok':
+        raise ModelServerError(value)
+    return value
+
+
+def is_enabled(model: str) -> bool:
+    """
+    モデルサーバーにmodelの推論を依頼するか（問い合わせはしない）
+    サーバーが起動していて、このプロセスでまだ使えないと分かっていなければTrue
+    """
+    return bool(os.environ.get(ADDRESS_ENV)) and model not in _unavailable
+
+
+def _call_model(model: str, op: str, *args):
+    """推論を依頼する。使えなければ以降このプロセスでは依頼しない（ModelServerUnavailable）"""
+    try:
+        return call(model, op, *args)
+    except ModelServerUnavailable:
+        _unavailable.add(model)
+        raise
+
+
+def segment_ina(y, offset: float = 0.0) -> list:
+    """
+    16kHzモノラルの配列をモデルサーバーのinaSpeechSegmenterで判定する
+    同時に届いた他の要求とまとめて推論されるため、複数のチャンクは並行に送るとよい
+    """
+    return _call_model('ina', 'segment_ina', y, offset)
+
+
+def separate(input_path: str, output_dir: str) -> None:
+    """モデルサーバーのClearVoiceで話者を分離する（output_dirに書き出す）"""
+    _call_model('clearvoice', 'separate', input_path, output_dir)
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+処理タスクの状態ストア（SQLite）
+タスクの状態・ログ・生成ファイルのパスをSQLiteに保存し、よく参照するタスクだけをメモリに置く。
+再起動後も状態を引けるようにし、終了したタスクは一定時間で削除してメモリ・DBが増え続けないようにする
+"""
+
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 終了したタスクを保持する時間（環境変数で変更可）
+TASK_TTL_SECONDS = float(os.environ.get('VOICE_CHANGER_TASK_TTL_HOURS', 72)) * 3600
+# メモリに置くタスク数
+TASK_CACHE_SIZE = int(os.environ.get('VOICE_CHANGER_TASK_CACHE', 256))
+# 期限切れタスクの削除を行う間隔（秒）
+EVICT_INTERVAL = 600.0
+
+# 処理が終わった状態（TTLで削除する対象）
+FINISHED_STATUSES = ('complete', 'error', 'separated')
+# 実行中の状態（再起動時に中断扱いにする）
+RUNNING_STATUSES = ('processing', 'analyzing', 'separating')
+# 生成ファイルとして索引するフィールド
+ARTIFACT_KEYS = ('input', 'output', 'processed_audio', 'speaker_dir', 'peaks', 'preview', 'render_plan')
+# TTLでタスクを削除するときに一緒に消すファイル（出力の動画・音声はダウンロード用に残す）
+# 他のタスクがまだ参照しているファイルは消さない。入力はアップロード用フォルダのものだけ消す
+EXPIRED_ARTIFACT_KEYS = ('input', 'speaker_dir', 'peaks', 'preview', 'render_plan')
+# ファイル名に含まれるタスクIDの先頭8文字（例: name_1a2b3c4d_processed.mp4, name_manual_1a2b3c4d.wav）
+ARTIFACT_NAME_PATTERN = re.compile(r'_([0-9a-f]{8})(?:_processed)?\.(\w+)$')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    status TEXT,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_status_updated ON tasks (status, updated_at);
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id TEXT NOT NULL,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS logs_task ON logs (task_id, id);
+CREATE TABLE IF NOT EXISTS artifacts (
+    task_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    PRIMARY KEY (task_id, kind)
+);
+'''
+
+
+def _stat(path: str):
+    """(サイズ, 更新時刻)。ファイルがなければ (None, None)"""
+    try:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime
+    except OSError:
+        return None, None
+
+
+class TaskStore:
+    """
+    SQLiteに保存するタスク状態ストア
+
+    task_id → 状態（dict、ログを除く）を保持する。ログは別テーブルに1行ずつ追記し、
+    生成ファイルは (task_id, 種類) → パス・サイズ・更新時刻 の索引から引く（タスク終了時に書き込む）。
+    DBは最初のアクセスで開く（ワーカープロセスがWebモジュールをimportしても開かないように）。
+    開いたときに実行中のまま残っていたタスクは中断扱いにし、生成ファイルの索引を作り直す
+
+    Args:
+        path: DBファイルのパス
+        ttl: 終了したタスクを保持する秒数
+        cache_size: メモリに置くタスク数（LRU）
+        artifact_dirs: {フォルダ: 種類}。索引の作り直しで、状態ストアにないタスクのファイルも
+                       ファイル名のタスクIDの先頭8文字で登録する（種類がNoneなら拡張子で決める）
+    """
+
+    def __init__(self, path: str, ttl: float = TASK_TTL_SECONDS, cache_size: int = TASK_CACHE_SIZE,
+                 artifact_dirs: dict = None):
+        self.path = path
+        self.artifact_dirs = artifact_dirs or {}
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._lock = threading.RLock()
+        # 書き込みのたびに増える番号（/events が変更を待つのに使う）
+        self._changed = threading.Condition(self._lock)
+        self.version = 0
+        self._conn = None
+        self._cache = OrderedDict()
+        self._last_evict = 0.0
+
+    def _db(self) -> sqlite3.Connection:
+        """DB接続（_lockを保持して呼ぶ）"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(artifacts)')}
+            for column, sql_type in (('size', 'INTEGER'), ('mtime', 'REAL')):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE artifacts ADD COLUMN {column} {sql_type}')
+            self._conn = conn
+            self._recover()
+            self._evict_expired()
+            self._rebuild_artifacts()
+        return self._conn
+
+    def _index_artifact(self, task_id: str, kind: str, path: str) -> None:
+        """生成ファイルを索引に登録する（ファイルがまだなければサイズ・更新時刻は空）"""
+        size, mtime = _stat(path)
+        self._conn.execute(
+            'INSERT OR REPLACE INTO artifacts (task_id, kind, path, size, mtime) VALUES (?, ?, ?, ?, ?)',
+            (task_id, kind, path, size, mtime)
+        )
+
+    def _rebuild_artifacts(self) -> None:
+        """
+        起動時に生成ファイルの索引を作り直す
+        登録済みのファイルはサイズ・更新時刻を取り直し（消えていれば削除）、
+        artifact_dirsにある状態ストアにないタスクのファイルを追加する
+        """
+        indexed = 0
+        for task_id, kind, path in self._conn.execute('SELECT task_id, kind, path FROM artifacts').fetchall():
+            size, mtime = _stat(path)
+            if size is None:
+                self._conn.execute('DELETE FROM artifacts WHERE task_id = ? AND kind = ?', (task_id, kind))
+            else:
+                self._conn.execute('UPDATE artifacts SET size = ?, mtime = ? WHERE task_id = ? AND kind = ?',
+                                   (size, mtime, task_id, kind))
+
+        known = {row[0][:8] for row in self._conn.execute('SELECT task_id FROM tasks')}
+        for folder, folder_kind in self.artifact_dirs.items():
+            try:
+                names = sorted(os.listdir(folder))
+            except OSError:
+                continue
+            for name in names:
+                match = ARTIFACT_NAME_PATTERN.search(name)
+                if not match or match.group(1) in known:
+                    continue
+                kind = folder_kind or {'mp4': 'output', 'wav': 'processed_audio'}.get(match.group(2).lower())
+                if kind:
+                    self._index_artifact(match.group(1), kind, os.path.join(folder, name))
+                    indexed += 1
+        self._conn.commit()
+        if indexed:
+            print(f"[TASKS] 状態ストアにないファイルを索引に登録: {indexed}件")
+
+    def _recover(self) -> None:
+        """前回の起動時に実行中だったタスクを中断扱いにする"""
+        placeholders = ','.join('?' * len(RUNNING_STATUSES))
+        rows = self._conn.execute(
+            f'SELECT task_id, data FROM tasks WHERE status IN ({placeholders})', RUNNING_STATUSES
+        ).fetchall()
+        for task_id, data in rows:
+            task = json.loads(data)
+            task.update(status='error', queued=False, message='サーバーの再起動により処理が中断されました')
+            self._write(task_id, task)
+        if rows:
+            self._conn.commit()
+            print(f"[TASKS] 中断されたタスク: {len(rows)}件")
+
+    def _cache_put(self, task_id: str, task: dict) -> None:
+        self._cache[task_id] = task
+        self._cache.move_to_end(task_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _load(self, task_id: str):
+        """タスクの状態（メモリになければDBから読む）。なければNone（_lockを保持して呼ぶ）"""
+        task = self._cache.get(task_id)
+        if task is not None:
+            self._cache.move_to_end(task_id)
+            return task
+        row = self._db().execute('SELECT data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        if row is None:
+            return None
+        task = json.loads(row[0])
+        self._cache_put(task_id, task)
+        return task
+
+    def _write(self, task_id: str, task: dict, created: bool = False, previous: dict = None) -> None:
+        """
+        状態と生成ファイルの索引を書き込む（コミットは呼び出し側）
+        索引はパスが変わったときと、タスクが終了したとき（サイズ・更新時刻を確定）に更新する
+        """
+        now = time.time()
+        data = json.dumps(task, ensure_ascii=False)
+        if created:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO tasks (task_id, status, data, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (task_id, task.get('status'), data, now, now)
+            )
+        else:
+            self._conn.execute(
+                'UPDATE tasks SET status = ?, data = ?, updated_at = ? WHERE task_id = ?',
+                (task.get('status'), data, now, task_id)
+            )
+        previous = previous or {}
+        finished = task.get('status') in FINISHED_STATUSES and previous.get('status') != task.get('status')
+        for kind in ARTIFACT_KEYS:
+            if task.get(kind) and (finished or task[kind] != previous.get(kind)):
+                self._index_artifact(task_id, kind, task[kind])
+        self._cache_put(task_id, task)
+
+    def _notify(self) -> None:
+        """変更を待っているスレッドを起こす（_lockを保持して呼ぶ）"""
+        self.version += 1
+        self._changed.notify_all()
+
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        """versionから変更があるまで（最大timeout秒）待ち、現在のversionを返す"""
+        with self._changed:
+            if self.version == version:
+                self._changed.wait(timeout)
+            return self.version
+
+    def create(self, task_id: str, task: dict) -> None:
+        """タスクを登録する（task内の'logs'はログテーブルへ移す）"""
+        task = dict(task)
+        logs = task.pop('logs', [])
+        with self._lock:
+            db = self._db()
+            self._delete(task_id)
+            # 索引の作り直しでファイル名から登録されていた分（このタスクのファイル）は不要になる
+            db.execute('DELETE FROM artifacts WHERE task_id = ?', (task_id[:8],))
+            self._write(task_id, task, created=True)
+            db.executemany('INSERT INTO logs (task_id, entry) VALUES (?, ?)',
+                           [(task_id, json.dumps(entry, ensure_ascii=False)) for entry in logs])
+            db.commit()
+            self._notify()
+            if time.time() - self._last_evict > EVICT_INTERVAL:
+                self._evict_expired()
+
+    def update(self, task_id: str, fields: dict) -> bool:
+        """タスクの状態を部分更新する。タスクがなければFalse"""
+        with self._lock:
+            task = self._load(task_id)
+            if task is None:
+                return False
+            self._write(task_id, dict(task, **fields), previous=task)
+            self._conn.commit()
+            self._notify()
+            return True
+
+    def append_log(self, task_id: str, entry) -> bool:
+        """ログを1件追記する。タスクがなければFalse"""
+        with self._lock:
+            if self._load(task_id) is None:
+                return False
+            self._conn.execute('INSERT INTO logs (task_id, entry) VALUES (?, ?)',
+                               (task_id, json.dumps(entry, ensure_ascii=False)))
+            self._conn.commit()
+            self._notify()
+            return True
+
+    def log_rows(self, task_id: str, since: int = 0) -> list:
+        """タスクのログ [(ログID, 内容), ...]（古い順）。sinceより後のIDのみ"""
+        with self._lock:
+            rows = self._db().execute('SELECT id, entry FROM logs WHERE task_id = ? AND id > ? ORDER BY id',
+                                      (task_id, since)).fetchall()
+        return [(log_id, json.loads(entry)) for log_id, entry in rows]
+
+    def logs(self, task_id: str) -> list:
+        """タスクのログ（古い順）"""
+        return [entry for _, entry in self.log_rows(task_id)]
+
+    def refresh_artifact(self, task_id: str, kind: str) -> None:
+        """後から作ったファイル（書き出し時の結合など）の索引のサイズ・更新時刻を取り直す"""
+        with self._lock:
+            task = self._load(task_id)
+            if task is not None and task.get(kind):
+                self._index_artifact(task_id, kind, task[kind])
+                self._conn.commit()
+
+    def artifact_info(self, task_id: str, kind: str):
+        """
+        生成ファイルの索引 {'path', 'size', 'mtime'}（kind: input / output / processed_audio / speaker_dir / peaks / preview）
+        状態ストアにないタスクはタスクIDの先頭8文字で引く。なければNone
+        """
+        with self._lock:
+            db = self._db()
+            for key in (task_id, task_id[:8]):
+                row = db.execute('SELECT path, size, mtime FROM artifacts WHERE task_id = ? AND kind = ?',
+                                 (key, kind)).fetchone()
+                if row:
+                    return {'path': row[0], 'size': row[1], 'mtime': row[2]}
+        return None
+
+    def artifact(self, task_id: str, kind: str):
+        """生成ファイルのパス。なければNone"""
+        info = self.artifact_info(task_id, kind)
+        return info['path'] if info else None
+
+    def get(self, task_id: str, default=None):
+        """タスクの状態（ログを除くコピー）"""
+        with self._lock:
+            task = self._load(task_id)
+        return dict(task) if task is not None else default
+
+    def __contains__(self, task_id) -> bool:
+        with self._lock:
+            return self._load(task_id) is not None
+
+    def __getitem__(self, task_id: str) -> dict:
+        task = self.get(task_id)
+        if task is None:
+            raise KeyError(task_id)
+        return task
+
+    def _delete(self, task_id: str) -> None:
+        self._cache.pop(task_id, None)
+        for table in ('tasks', 'logs', 'artifacts'):
+            self._conn.execute(f'DELETE FROM {table} WHERE task_id = ?', (task_id,))
+
+    def delete(self, task_id: str) -> None:
+        """タスクを削除する（生成ファイルは消さない）"""
+        with self._lock:
+            self._db()
+            self._delete(task_id)
+            self._conn.commit()
+            self._notify()
+
+    def _removable(self, kind: str, path: str) -> bool:
+        """期限切れで消してよいファイルか（入力はアップロード用フォルダのものだけ）"""
+        if kind not in EXPIRED_ARTIFACT_KEYS:
+            return False
+        if kind == 'input':
+            folder = os.path.dirname(os.path.abspath(path))
+            return any(folder == os.path.abspath(d) for d, k in self.artifact_dirs.items() if k == 'input')
+        return True
+
+    def _evict_expired(self) -> int:
+        """
+        終了してからTTLを過ぎたタスクを削除する（_lockを保持して呼ぶ）
+        索引にある入力・再レンダリング情報・話者分離結果・ピーク・プレビュー等のファイルも、他のタスクが参照していなければ削除する
+        """
+        self._last_evict = time.time()
+        placeholders = ','.join('?' * len(FINISHED_STATUSES))
+        rows = self._conn.execute(
+            f'SELECT task_id FROM tasks WHERE status IN ({placeholders}) AND updated_at < ?',
+            FINISHED_STATUSES + (time.time() - self.ttl,)
+        ).fetchall()
+        paths = set()
+        for (task_id,) in rows:
+            for kind, path in self._conn.execute('SELECT kind, path FROM artifacts WHERE task_id = ?',
+                                                 (task_id,)).fetchall():
+                if self._removable(kind, path):
+                    paths.add(path)
+            self._delete(task_id)
+        removed = 0
+        for path in sorted(paths):
+            if self._conn.execute('SELECT 1 FROM artifacts WHERE path = ? LIMIT 1', (path,)).fetchone():
+                continue
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        if rows:
+            self._conn.commit()
+            print(f"[TASKS] 期限切れのタスクを削除: {len(rows)}件（ファイル {removed}件）")
+        return len(rows)
+
+    def evict_expired(self) -> int:
+        """終了してからTTLを過ぎたタスクとその中間ファイルを削除する。削除したタスクの件数を返す"""
+        with self._lock:
+            self._db()
+            return self._evict_expired()
@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+
+from voice_changer import ArtifactCache
+
+
+def make_cache(tmp_path, max_bytes):
+    source = tmp_path / "input.bin"
+    source.write_bytes(b"input")
+    return ArtifactCache(str(tmp_path / "cache"), str(source), max_bytes=max_bytes)
+
+
+def test_store_files_larger_than_cap_keeps_returned_paths(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=1024)
+    stem = tmp_path / "stem.wav"
+    stem.write_bytes(b"\0" * 4096)
+
+    paths = cache.store_files('clearvoice', {}, [str(stem)])
+
+    assert all(os.path.exists(path) for path in paths)
+    assert cache.load('clearvoice', {}) == paths
+
+
+def test_entries_in_use_by_another_cache_are_not_evicted(tmp_path):
+    held = make_cache(tmp_path, max_bytes=1024)
+    value = held.store('pcm', {'sr': 44100}, np.zeros(1024, dtype=np.float32))
+
+    other = make_cache(tmp_path, max_bytes=1024)
+    other.store('f0', {}, np.zeros(1024, dtype=np.float32))
+    assert np.array_equal(held.load('pcm', {'sr': 44100}), value)
+
+    held.release()
+    other.store('f0', {'engine': 'yin'}, np.zeros(1024, dtype=np.float32))
+    assert held.load('pcm', {'sr': 44100}) is None
+
+
+def test_digest_is_reused_until_the_input_changes(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=1024)
+    source = tmp_path / "input.bin"
+    stat = source.stat()
+
+    source.write_bytes(b"other")
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    # サイズ・更新時刻が同じなら読み直さない
+    assert ArtifactCache.file_digest(str(source)) == cache.digest
+
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert ArtifactCache.file_digest(str(source)) != cache.digest
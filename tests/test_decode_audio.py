@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from voice_changer import count_audio_frames, decode_audio, read_mono_audio
+
+
+@pytest.fixture
+def stereo_wav(tmp_path):
+    """左右で振幅の違う1秒の16kHzステレオ"""
+    t = np.arange(16000) / 16000
+    y = np.stack([0.4 * np.sin(2 * np.pi * 200 * t), 0.2 * np.sin(2 * np.pi * 200 * t)], axis=1)
+    path = tmp_path / "stereo.wav"
+    sf.write(str(path), y, 16000, subtype='FLOAT')
+    return str(path), y.astype(np.float32)
+
+
+def test_decode_matches_file_at_native_rate(stereo_wav):
+    path, y = stereo_wav
+    np.testing.assert_allclose(decode_audio(path, 16000), y.T, atol=1e-6)
+    np.testing.assert_allclose(decode_audio(path, 16000, mono=True), y.mean(axis=1), atol=1e-6)
+
+
+def test_mono_read_agrees_with_decode(stereo_wav):
+    path, y = stereo_wav
+    native = read_mono_audio(path, 16000)
+    resampled = read_mono_audio(path, 44100)
+
+    np.testing.assert_allclose(native, decode_audio(path, 16000, mono=True), atol=1e-6)
+    assert len(resampled) == count_audio_frames(path, 44100) == 44100
+    assert count_audio_frames(path, 16000) == len(native) == 16000
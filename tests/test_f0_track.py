@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from voice_changer import (ANALYSIS_HOP_LENGTH, ANALYSIS_SR, F0_TRACK_BLOCK_FRAMES, compute_f0_track,
+                           compute_f0_track_stream)
+
+
+@pytest.fixture(scope='module')
+def long_voice():
+    """F0トラックの計算ブロックが3つ以上になる長さの、ピッチが変化する有声音"""
+    rng = np.random.default_rng(0)
+    n = int(2.5 * F0_TRACK_BLOCK_FRAMES * ANALYSIS_HOP_LENGTH)
+    t = np.arange(n) / ANALYSIS_SR
+    f0 = 140 + 60 * np.sin(2 * np.pi * t / 20)
+    phase = 2 * np.pi * np.cumsum(f0) / ANALYSIS_SR
+    y = sum(np.sin(k * phase) / k for k in range(1, 8)) * 0.2 * (np.sin(2 * np.pi * t / 3) > -0.5)
+    return (y + 0.01 * rng.standard_normal(n)).astype(np.float32)
+
+
+def blocks_of(y, size):
+    return (y[i:i + size] for i in range(0, len(y), size))
+
+
+def assert_same_track(a, b):
+    np.testing.assert_array_equal(a['f0'], b['f0'])
+    np.testing.assert_array_equal(a['voiced'], b['voiced'])
+    assert a['hop_length'] == b['hop_length'] and a['sr'] == b['sr']
+
+
+def test_parallel_track_matches_serial(long_voice):
+    serial = compute_f0_track(long_voice, ANALYSIS_SR, engine='yin', workers=1)
+    parallel = compute_f0_track(long_voice, ANALYSIS_SR, engine='yin', workers=2)
+
+    assert np.count_nonzero(serial['voiced']) > 0
+    assert_same_track(serial, parallel)
+
+
+def test_stream_track_matches_in_memory(long_voice):
+    in_memory = compute_f0_track(long_voice, ANALYSIS_SR, engine='yin')
+    serial = compute_f0_track_stream(blocks_of(long_voice, 123457), ANALYSIS_SR, engine='yin', workers=1)
+    parallel = compute_f0_track_stream(blocks_of(long_voice, 65536), ANALYSIS_SR, engine='yin', workers=2)
+
+    assert_same_track(in_memory, serial)
+    assert_same_track(in_memory, parallel)
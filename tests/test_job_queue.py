@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+from job_queue import JobQueue, QueueFullError
+
+
+def blocked_queue(max_queued=20):
+    """ワーカー1つのレーンで、最初のジョブが止まっている間に次のジョブを積めるキュー"""
+    queue = JobQueue({'light': 1}, max_queued=max_queued, use_processes=False)
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(10)
+
+    queue.submit('blocker', block)
+    assert started.wait(10)
+    return queue, release
+
+
+def test_jobs_run_in_priority_order():
+    queue, release = blocked_queue()
+    order = []
+    done = threading.Event()
+    queue.submit('late', order.append, ('late',), priority=5)
+    queue.submit('first', order.append, ('first',), priority=0)
+    queue.submit('second', order.append, ('second',), priority=0)
+    queue.submit('last', lambda: (order.append('last'), done.set()), priority=9)
+
+    assert queue.position('first') == 1
+    assert queue.position('last') == 4
+    release.set()
+    assert done.wait(10)
+    assert order == ['first', 'second', 'late', 'last']
+
+
+def test_full_queue_rejects_jobs():
+    queue, release = blocked_queue(max_queued=1)
+    queue.submit('queued', lambda: None)
+
+    with pytest.raises(QueueFullError):
+        queue.submit('rejected', lambda: None)
+    assert queue.stats()['light'] == {'queued': 1, 'running': 1, 'workers': 1}
+    release.set()
@@ -0,0 +1,71 @@
+import threading
+
+import numpy as np
+import pytest
+
+import model_server
+from model_server import ModelServerUnavailable, _ModelSlot
+
+
+@pytest.fixture
+def no_server(monkeypatch):
+    monkeypatch.setattr(model_server, '_unavailable', set())
+    monkeypatch.setattr(model_server._local, 'conn', None, raising=False)
+    return monkeypatch
+
+
+def test_unreachable_server_falls_back_to_local_models(no_server, tmp_path):
+    no_server.delenv(model_server.ADDRESS_ENV, raising=False)
+    assert not model_server.is_enabled('ina')
+
+    no_server.setenv(model_server.ADDRESS_ENV, str(tmp_path / "missing.sock"))
+    no_server.setenv(model_server.AUTHKEY_ENV, '00' * 16)
+    assert model_server.is_enabled('ina')
+    with pytest.raises(ModelServerUnavailable):
+        model_server.segment_ina(np.zeros(16000, dtype=np.float32))
+    # 以降このプロセスでは問い合わせずにプロセス内で読み込む
+    assert not model_server.is_enabled('ina')
+    assert model_server.is_enabled('clearvoice')
+
+
+def run_slot(monkeypatch, run_requests, requests):
+    """待ち行列に積んだ要求をモデルスロットに処理させ、要求ごとの応答を返す"""
+    monkeypatch.setattr(model_server, '_load_model', lambda name: object())
+    monkeypatch.setattr(model_server, '_run_requests', run_requests)
+    slot = _ModelSlot('ina')
+    replies = [None] * len(requests)
+    done = threading.Semaphore(0)
+
+    def reply_to(i):
+        return lambda value: (replies.__setitem__(i, value), done.release())
+    for i, args in enumerate(requests):
+        slot.requests.put(('segment_ina', args, reply_to(i)))
+    threading.Thread(target=slot.run, args=(threading.Event(),), daemon=True).start()
+    for _ in requests:
+        assert done.acquire(timeout=10)
+    return slot, replies
+
+
+def test_queued_requests_are_batched(monkeypatch):
+    calls = []
+
+    def run_requests(model, op, args_list):
+        calls.append(len(args_list))
+        return [[('male', offset, offset + 1.0)] for _, offset in args_list]
+    requests = [(np.zeros(16000, dtype=np.float32), float(i)) for i in range(3)]
+
+    slot, replies = run_slot(monkeypatch, run_requests, requests)
+    assert calls == [3]
+    assert replies == [('ok', [('male', float(i), i + 1.0)]) for i in range(3)]
+    assert slot.info()['batches'] == 1 and slot.info()['requests'] == 3
+
+
+def test_failed_batch_is_retried_per_request(monkeypatch):
+    def run_requests(model, op, args_list):
+        if any(offset == 1.0 for _, offset in args_list):
+            raise RuntimeError("broken chunk")
+        return [[] for _ in args_list]
+    requests = [(np.zeros(16000, dtype=np.float32), float(i)) for i in range(3)]
+
+    _, replies = run_slot(monkeypatch, run_requests, requests)
+    assert replies == [('ok', []), ('error', "broken chunk"), ('ok', [])]
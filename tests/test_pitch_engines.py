@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from voice_changer import (ANALYSIS_SR, PITCH_ENGINES, compare_pitch_engines, compute_f0_track,
+                           pitch_from_track, to_analysis_rate)
+
+SR = 44100
+# 男性・女性の声域にまたがる基本周波数（Hz）
+CORPUS_F0 = (90, 120, 150, 185, 220, 260)
+
+
+def synthetic_voice(f0, seconds=2.0, vibrato=0.02, noise=0.01, seed=0):
+    """倍音を持つ有声音（ビブラート・雑音あり）と、その後の無音"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(SR * seconds)) / SR
+    phase = 2 * np.pi * np.cumsum(f0 * (1 + vibrato * np.sin(2 * np.pi * 5 * t))) / SR
+    y = sum(np.sin(k * phase) / k for k in range(1, 12) if k * f0 < 5000)
+    y = 0.3 * y / np.max(np.abs(y)) + noise * rng.standard_normal(len(t))
+    return np.concatenate([y, np.zeros(SR // 2)]).astype(np.float32)
+
+
+@pytest.fixture(scope='module')
+def corpus():
+    return [(f0, synthetic_voice(f0, seed=i)) for i, f0 in enumerate(CORPUS_F0)]
+
+
+@pytest.mark.parametrize('engine', sorted(PITCH_ENGINES))
+def test_engine_tracks_known_f0(corpus, engine):
+    for f0, y in corpus:
+        y_analysis = to_analysis_rate(y, SR)
+        track = compute_f0_track(y_analysis, ANALYSIS_SR, engine=engine)
+        pitch = pitch_from_track(track, 0, 2 * ANALYSIS_SR)
+        assert pitch > 0, f0
+        assert abs(1200 * np.log2(pitch / f0)) < 50, (f0, pitch)
+        # 末尾の無音は無声
+        assert pitch_from_track(track, int(2.1 * ANALYSIS_SR), int(2.5 * ANALYSIS_SR)) == 0
+
+
+def test_yin_agrees_with_pyin(corpus):
+    y = np.concatenate([y for _, y in corpus])
+    result = compare_pitch_engines(y, SR, engine='yin', reference='pyin')
+
+    assert result['segments'] >= 4 * len(corpus)
+    assert result['agreement'] >= 0.95
+    assert result['median_cents'] < 20
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from voice_changer import PREVIEW_SAMPLE_RATE, render_region_preview
+
+SR = PREVIEW_SAMPLE_RATE
+
+
+@pytest.fixture
+def tone_wav(tmp_path):
+    """2秒のステレオの正弦波"""
+    t = np.arange(2 * SR) / SR
+    y = 0.3 * np.sin(2 * np.pi * 150 * t)
+    path = tmp_path / "tone.wav"
+    sf.write(str(path), np.stack([y, y], axis=1), SR)
+    return str(path)
+
+
+def test_negative_start_is_clamped(tone_wav):
+    clamped = render_region_preview(tone_wav, -1.0, 0.5, -3.0)
+    expected = render_region_preview(tone_wav, 0.0, 0.5, -3.0)
+
+    assert clamped.shape == (2, SR // 2)
+    np.testing.assert_array_equal(clamped, expected)
+
+
+@pytest.mark.parametrize('start, end', [(2.0, 3.0), (5.0, 6.0), (1.0, 1.0)])
+def test_region_outside_audio_is_rejected(tone_wav, start, end):
+    with pytest.raises(ValueError):
+        render_region_preview(tone_wav, start, end, -3.0)
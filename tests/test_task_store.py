@@ -0,0 +1,38 @@
+import os
+
+from task_store import TaskStore
+
+
+def test_running_tasks_are_marked_interrupted_on_reopen(tmp_path):
+    path = str(tmp_path / "tasks.db")
+    store = TaskStore(path)
+    store.create('running', {'status': 'processing', 'logs': ['start']})
+    store.create('done', {'status': 'complete'})
+
+    reopened = TaskStore(path)
+    assert reopened['running']['status'] == 'error'
+    assert reopened['running']['queued'] is False
+    assert reopened['done']['status'] == 'complete'
+    assert reopened.logs('running') == ['start']
+
+
+def test_expired_tasks_and_their_files_are_evicted(tmp_path):
+    uploads = tmp_path / "uploads"
+    uploads.mkdir()
+    upload = uploads / "input.mp4"
+    upload.write_bytes(b"video")
+    preview = tmp_path / "preview.m4a"
+    preview.write_bytes(b"audio")
+    output = tmp_path / "output.mp4"
+    output.write_bytes(b"video")
+
+    store = TaskStore(str(tmp_path / "tasks.db"), ttl=0.0, artifact_dirs={str(uploads): 'input'})
+    store.create('old', {'status': 'complete', 'input': str(upload), 'preview': str(preview),
+                         'output': str(output)})
+    store.create('active', {'status': 'processing', 'input': str(upload)})
+
+    assert store.evict_expired() == 1
+    assert 'old' not in store and 'active' in store
+    # 実行中のタスクが参照している入力と、成果物（出力動画）は残す
+    assert os.path.exists(upload) and os.path.exists(output)
+    assert not os.path.exists(preview)
@@ -5,9 +5,19 @@ ClearVoice-Studioを使用した話者分離 + ピッチシフト
 """
 
 import argparse
+import hashlib
+import json
+import multiprocessing
 import os
+import shutil
 import subprocess
 import tempfile
+import threading
+import time
+import warnings
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
 from pathlib import Path
 
 # ffmpegへのPATHを確保（inaSpeechSegmenter等が必要とする）
@@ -31,7 +41,6 @@ for p in ffmpeg_paths:
         os.environ['PATH'] = p + path_sep + os.environ.get('PATH', '')
 
 import numpy as np
-import librosa
 import soundfile as sf
 
 # グローバルインスタンス（遅延ロード）
@@ -43,12 +52,19 @@ _ina_segmenter = None
 os.environ['TF_USE_LEGACY_KERAS'] = '1'
 
 
+_torch_patched = False
+
+
 def _patch_torch_numpy_compat():
     """
     torch/numpy互換性問題を修正するパッチ
     'expected np.ndarray (got numpy.ndarray)' エラー対策
-    このアプリ内でのみ有効
+    このアプリ内でのみ有効。torchを使うモデルを読み込む直前に呼ぶ（起動時にtorchをimportしないように）
     """
+    global _torch_patched
+    if _torch_patched:
+        return
+    _torch_patched = True
     try:
         import torch
         # torchの内部でnumpy配列チェックを緩和
@@ -61,14 +77,12 @@ def _patch_torch_numpy_compat():
     except ImportError:
         pass
 
-# アプリ起動時にパッチを適用
-_patch_torch_numpy_compat()
-
 
 def get_clearvoice_separator():
     """ClearVoice話者分離モデルを取得（初回のみロード）"""
     global _clearvoice_separator
     if _clearvoice_separator is None:
+        _patch_torch_numpy_compat()
         from clearvoice import ClearVoice
         print("ClearVoice話者分離モデルを初期化中...")
         _clearvoice_separator = ClearVoice(
@@ -97,15 +111,229 @@ def get_ina_segmenter():
     return _ina_segmenter
 
 
-def detect_gender_ina(audio_path: str, progress_callback=None, chunk_duration: float = 300.0) -> list:
+# inaSpeechSegmenterの処理レート
+INA_SR = 16000
+# inaSpeechSegmenterのモデルが必要とする最小フレーム数（短い音声は特徴量を埋める）
+INA_MIN_FRAMES = 68
+
+
+def ina_features(y: np.ndarray):
+    """
+    16kHzモノラルの配列からinaSpeechSegmenterの特徴量（メルスペクトル・対数エネルギー）を求める
+    inaSpeechSegmenter内部の_wav2featsと同じ処理を、WAVファイルを介さずに行う
+
+    Returns:
+        (mspec, loge, difflen)
+    """
+    from inaSpeechSegmenter.sidekit_mfcc import mfcc
+    with warnings.catch_warnings():
+        # 無音部分のlog(0)の警告は無視する（inaSpeechSegmenterと同じ）
+        warnings.filterwarnings('ignore', message='divide by zero encountered in log', category=RuntimeWarning)
+        _, loge, _, mspec = mfcc(y.astype(np.float32), get_mspec=True)
+    difflen = 0
+    if len(loge) < INA_MIN_FRAMES:
+        difflen = INA_MIN_FRAMES - len(loge)
+        mspec = np.concatenate((mspec, np.ones((difflen, mspec.shape[1])) * np.min(mspec)))
+    return mspec, loge, difflen
+
+
+def segment_ina_array(seg, y: np.ndarray, offset: float = 0.0) -> list:
+    """
+    16kHzモノラルの配列をinaSpeechSegmenterで判定する（特徴量抽出と推論の段階に配列を直接渡す）
+
+    Returns:
+        [(label, start, end), ...]  offset秒を足した時刻
+    """
+    if hasattr(seg, 'segment_feats'):
+        mspec, loge, difflen = ina_features(y)
+        return [(label, start, end) for label, start, end in seg.segment_feats(mspec, loge, difflen, offset)]
+
+    # 特徴量の段階を呼べない版では一時WAVを介する
+    with tempfile.TemporaryDirectory() as tmpdir:
+        chunk_path = os.path.join(tmpdir, "chunk.wav")
+        sf.write(chunk_path, y, INA_SR)
+        return [(label, start + offset, end + offset) for label, start, end in seg(chunk_path)]
+
+
+# CNN判定で音声を分割する単位（秒）
+INA_CHUNK_SECONDS = 300.0
+# チャンク境界の重なり（秒）。境界の前後それぞれ半分ずつの余裕を持たせ、切り目は重なりの中央に置く
+INA_CHUNK_OVERLAP = 10.0
+# CNN判定のワーカープロセス数の上限（プロセスごとにモデルを読み込むため）
+INA_MAX_WORKERS = 4
+
+
+def resolve_ina_workers(workers: int = None) -> int:
+    """
+    CNN判定のワーカープロセス数を決める
+    None/0の場合は環境変数 VOICE_CHANGER_INA_WORKERS、なければCPUコア数（INA_MAX_WORKERSまで）を使う
+    """
+    if not workers:
+        workers = (int(os.environ.get('VOICE_CHANGER_INA_WORKERS', 0))
+                   or min(os.cpu_count() or 1, INA_MAX_WORKERS))
+    return max(1, int(workers))
+
+
+def _segment_ina_chunk(y: np.ndarray, offset: float) -> list:
+    """ワーカープロセス用: チャンクをCNN判定する（モデルはプロセスごとに1回だけ読み込む）"""
+    return segment_ina_array(get_ina_segmenter(), y, offset)
+
+
+# モデルサーバーでまとめて推論するときのKerasのバッチサイズ（inaの既定の32より大きくして推論を速くする）
+INA_PREDICT_BATCH_SIZE = 256
+# モデルサーバーに同時に送るチャンク数（次のチャンクのデコード中もサーバーが推論を続けられるように）
+INA_SERVER_IN_FLIGHT = 2
+
+
+class _PredictBatcher:
+    """
+    複数のチャンクの判定を並行に進め、各段階（音声/音楽判定・性別判定）のnn.predictを1回にまとめる
+    判定中のチャンクがすべてpredictに達したら入力を連結して一度に推論し、結果をチャンクごとに分けて返す
+    """
+
+    def __init__(self, active: int, batch_size: int):
+        self.cond = threading.Condition()
+        self.active = active
+        self.batch_size = batch_size
+        self.waiting = []
+        self.calls = 0
+
+    def predict(self, nn, x):
+        entry = {'nn': nn, 'x': x, 'done': False, 'result': None}
+        with self.cond:
+            self.waiting.append(entry)
+            self._flush_if_ready()
+            while not entry['done']:
+                self.cond.wait()
+        if isinstance(entry['result'], Exception):
+            raise entry['result']
+        return entry['result']
+
+    def finished(self) -> None:
+        """チャンクの判定が終わった（以降はこのチャンクを待たない）"""
+        with self.cond:
+            self.active -= 1
+            self._flush_if_ready()
+
+    def _flush_if_ready(self) -> None:
+        # 前処理中のチャンクが残っていれば、そのチャンクがpredictに達するのを待つ
+        if not self.waiting or len(self.waiting) < self.active:
+            return
+        waiting, self.waiting = self.waiting, []
+        groups = {}
+        for entry in waiting:
+            groups.setdefault(id(entry['nn']), []).append(entry)
+        for entries in groups.values():
+            try:
+                x = np.concatenate([entry['x'] for entry in entries])
+                pred = entries[0]['nn'].predict(x, batch_size=self.batch_size, verbose=0)
+                self.calls += 1
+                parts = np.split(pred, np.cumsum([len(entry['x']) for entry in entries])[:-1])
+            except Exception as e:
+                parts = [e] * len(entries)
+            for entry, part in zip(entries, parts):
+                entry['result'] = part
+                entry['done'] = True
+        self.cond.notify_all()
+
+
+class _BatchedModel:
+    """inaのDnnSegmenterが呼ぶnn.predictを_PredictBatcherに回すラッパー"""
+
+    def __init__(self, nn, batcher: _PredictBatcher):
+        self.nn = nn
+        self.batcher = batcher
+
+    def predict(self, x, **kwargs):
+        return self.batcher.predict(self.nn, x)
+
+
+def segment_ina_batch(seg, items: list, batch_size: int = INA_PREDICT_BATCH_SIZE) -> list:
+    """
+    複数のチャンクをまとめてinaSpeechSegmenterで判定する（モデルサーバー用）
+    特徴量抽出・Viterbiなどチャンクごとの処理はスレッドで並行に行い、CNNの推論は段階ごとに1回にまとめる。
+    segのモデルを一時的に差し替えるため、同じsegを他のスレッドから同時に使わないこと
+
+    Args:
+        seg: inaSpeechSegmenterのSegmenter
+        items: [(y, offset), ...]  16kHzモノラルの配列と、その先頭の時刻（秒）
+        batch_size: 推論のバッチサイズ
+
+    Returns:
+        チャンクごとの [(label, start, end), ...] のリスト
+    """
+    batcher = _PredictBatcher(len(items), batch_size)
+    results = [None] * len(items)
+    errors = []
+
+    def run(i):
+        try:
+            results[i] = segment_ina_array(seg, *items[i])
+        except Exception as e:
+            errors.append(e)
+        finally:
+            batcher.finished()
+
+    models = [model for model in (getattr(seg, 'vad', None), getattr(seg, 'gender', None))
+              if hasattr(model, 'nn')]
+    originals = [(model, model.nn) for model in models]
+    for model, nn in originals:
+        model.nn = _BatchedModel(nn, batcher)
+    try:
+        threads = [threading.Thread(target=run, args=(i,), daemon=True) for i in range(1, len(items))]
+        for thread in threads:
+            thread.start()
+        run(0)
+        for thread in threads:
+            thread.join()
+    finally:
+        for model, nn in originals:
+            model.nn = nn
+    if errors:
+        raise errors[0]
+    return results
+
+
+def stitch_chunk_segments(chunks: list) -> list:
+    """
+    重なりのあるチャンクの判定結果をつなぐ
+
+    chunks: [(lower, upper, segments), ...]（時刻順）
+    各チャンクの区間を受け持ち範囲 [lower, upper) に切り詰め（重なりの重複を除く）、
+    切り目で同じラベルが接していれば1区間にまとめる（境界での分断を残さない）
+    """
+    result = []
+    for lower, upper, segments in chunks:
+        seam = bool(result)
+        for label, start, end in segments:
+            start, end = max(start, lower), min(end, upper)
+            if end <= start:
+                continue
+            if seam and result[-1][0] == label and abs(result[-1][2] - start) < 0.05:
+                result[-1] = (label, result[-1][1], end)
+            else:
+                result.append((label, start, end))
+            seam = False
+    return result
+
+
+def detect_gender_ina(audio_path: str, progress_callback=None, chunk_duration: float = INA_CHUNK_SECONDS,
+                      overlap: float = INA_CHUNK_OVERLAP, workers: int = None,
+                      audio: np.ndarray = None) -> list:
     """
     inaSpeechSegmenterを使用してCNNベースの性別判定を行う
-    長い音声ファイルは分割して処理する（メモリ対策）
+    音声は1回のデコードでchunk_durationごとに読み、前のチャンクの末尾overlap秒を付けて配列のまま判定する。
+    モデルサーバーがあればチャンクをサーバーに送り（他のジョブの要求とまとめて推論される）、
+    なければワーカープロセスで並列に判定する。チャンクは重なりの中央で切ってつなぐ
 
     Args:
         audio_path: 音声ファイルのパス
         progress_callback: ログ用コールバック
         chunk_duration: 分割する単位（秒）。デフォルト300秒（5分）
+        overlap: チャンク同士の重なり（秒）
+        workers: モデルサーバーを使わない場合のワーカープロセス数
+                 （None: 環境変数VOICE_CHANGER_INA_WORKERSかCPUコア数、1: 直列）
+        audio: デコード済みの16kHzモノラル音声。指定時はaudio_pathを読まない
 
     Returns:
         list of tuples: [(label, start, end), ...]
@@ -115,50 +343,110 @@ def detect_gender_ina(audio_path: str, progress_callback=None, chunk_duration: f
     log("inaSpeechSegmenter（CNN）で性別を判定中...")
     log(f"音声ファイルパス: {audio_path}")
 
-    # 音声の長さを取得
-    y, sr = librosa.load(audio_path, sr=None, mono=True)
-    total_duration = len(y) / sr
+    if audio is not None:
+        total_duration = len(audio) / INA_SR
+        block_samples = max(1, int(chunk_duration * INA_SR))
+        blocks = (audio[i:i + block_samples] for i in range(0, len(audio), block_samples))
+    else:
+        # 音声の長さを取得（ヘッダのみ。音声全体は読み込まない）
+        total_duration = get_audio_duration(audio_path) or 0.0
+        # inaの処理レート（16kHzモノラル）で1回だけデコードし、チャンクごとに受け取る
+        blocks = iter_audio_blocks(audio_path, INA_SR, mono=True, block_seconds=chunk_duration)
     log(f"音声の長さ: {total_duration:.1f}秒")
 
-    seg = get_ina_segmenter()
-
-    # 長い音声は分割して処理
-    if total_duration > chunk_duration:
-        log(f"長い音声のため {chunk_duration}秒ごとに分割して処理...")
-        result = []
-        num_chunks = int(np.ceil(total_duration / chunk_duration))
-
-        with tempfile.TemporaryDirectory() as tmpdir:
-            for i in range(num_chunks):
-                start_time = i * chunk_duration
-                end_time = min((i + 1) * chunk_duration, total_duration)
+    import model_server
+    num_chunks = max(1, int(np.ceil(total_duration / chunk_duration)))
+    use_server = model_server.is_enabled('ina')
+    workers = 1 if use_server else min(resolve_ina_workers(workers), num_chunks)
+    if num_chunks > 1:
+        mode = "モデルサーバー" if use_server else f"{workers}プロセス"
+        log(f"長い音声のため {chunk_duration}秒ごとに分割して処理（重なり {overlap}秒、{mode}）...")
+
+    seg = None
+    executor = None
+    in_flight = 0
+    if use_server:
+        # モデルサーバーの読み込み済みモデルで判定する（モデルの読み込みを待たない）。
+        # 次のチャンクをデコードしている間もサーバーが推論できるよう、複数のチャンクを並行に送る
+        log("モデルサーバーで判定します")
+        in_flight = INA_SERVER_IN_FLIGHT
+        executor = ThreadPoolExecutor(max_workers=min(in_flight, num_chunks))
+    elif workers > 1:
+        # 複数チャンクはプロセスプールで並列に判定する（spawnで起動。Webサーバーのスレッドからforkしないため）
+        in_flight = workers * 2
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    else:
+        seg = get_ina_segmenter()
 
-                log(f"  チャンク {i+1}/{num_chunks}: {start_time:.0f}秒 - {end_time:.0f}秒")
+    fallback_logged = False
 
-                # チャンクを抽出して一時ファイルに保存
-                start_sample = int(start_time * sr)
-                end_sample = int(end_time * sr)
-                chunk_audio = y[start_sample:end_sample]
+    def segment_local(y, offset):
+        nonlocal seg
+        if seg is None:
+            seg = get_ina_segmenter()
+        return segment_ina_array(seg, y, offset)
 
-                chunk_path = os.path.join(tmpdir, f"chunk_{i}.wav")
-                sf.write(chunk_path, chunk_audio, sr)
+    chunk_results = {}
+    lowers = []
+    pending = []
 
-                try:
-                    # チャンクを処理
-                    chunk_result = seg(chunk_path)
-
-                    # 時間オフセットを追加
-                    for label, start, end in chunk_result:
-                        result.append((label, start + start_time, end + start_time))
-                except Exception as e:
-                    log(f"  チャンク {i+1} でエラー: {str(e)}")
-                    # エラーが発生してもこのチャンクはスキップして続行
-                    continue
+    def collect(i, get_result):
+        try:
+            chunk_results[i] = get_result()
+        except Exception as e:
+            if num_chunks == 1:
+                raise
+            log(f"  チャンク {i+1} でエラー: {str(e)}")
+            # エラーが発生してもこのチャンクはスキップして続行
+            chunk_results[i] = []
+
+    def resolve(i, future, y, offset):
+        def get_result():
+            nonlocal fallback_logged
+            try:
+                return future.result()
+            except model_server.ModelServerUnavailable as e:
+                if not fallback_logged:
+                    log(f"モデルサーバーを使えないため、このプロセスでモデルを読み込みます: {e}")
+                    fallback_logged = True
+                return segment_local(y, offset)
+        collect(i, get_result)
 
+    try:
+        tail = np.zeros(0, dtype=np.float32)
+        for i, block in enumerate(blocks):
+            start_time = i * chunk_duration
+            chunk_audio = np.concatenate([tail, block]) if len(tail) else block
+            offset = start_time - len(tail) / INA_SR
+            # 受け持ち範囲の下端（重なりの中央）
+            lowers.append(start_time - len(tail) / INA_SR / 2)
+            tail = chunk_audio[-int(overlap * INA_SR):] if overlap > 0 else tail
+            if num_chunks > 1:
+                log(f"  チャンク {i+1}/{num_chunks}: {offset:.0f}秒 - {start_time + len(block) / INA_SR:.0f}秒")
+
+            if executor is None or (use_server and not model_server.is_enabled('ina')):
+                collect(i, lambda: segment_local(chunk_audio, offset))
+            elif use_server:
+                # サーバーを使えなかった場合にこのプロセスで判定し直せるよう、音声を持っておく
+                pending.append((i, executor.submit(model_server.segment_ina, chunk_audio, offset),
+                                chunk_audio, offset))
+            else:
+                pending.append((i, executor.submit(_segment_ina_chunk, chunk_audio, offset), None, None))
+            # デコード済みのチャンクを溜め込みすぎない（メモリは同時に処理する数に比例する分だけ）
+            while len(pending) > in_flight:
+                resolve(*pending.pop(0))
+        for item in pending:
+            resolve(*item)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    uppers = lowers[1:] + [float('inf')]
+    result = stitch_chunk_segments([(lowers[i], uppers[i], chunk_results.get(i, []))
+                                    for i in range(len(lowers))])
+
+    if num_chunks > 1:
         log(f"分割処理完了: 合計 {len(result)} 区間")
-    else:
-        # 短い音声はそのまま処理
-        result = seg(audio_path)
 
     # 詳細ログ
     log(f"判定結果: {len(result)}区間検出")
@@ -232,80 +520,74 @@ def postprocess_gender_segments(segments: list, min_duration: float = 0.3) -> li
     return result
 
 
-def detect_gender_for_segment(y: np.ndarray, sr: int) -> dict:
-    """
-    短いセグメント用の軽量な性別判定（ダブルチェック用）
+# 声質の特徴量で共有するSTFTの設定（librosaの各特徴量の既定値と同じ）
+FEATURE_N_FFT = 2048
+FEATURE_HOP_LENGTH = 512
+# F0推定: 正規化自己相関のピークがこれ以上なら有声（Praatの既定値と同じ）
+FEATURE_VOICING_THRESHOLD = 0.45
+# F0推定: 最大振幅に対してこれより小さいフレームは無音とする
+FEATURE_SILENCE_THRESHOLD = 0.03
+# F0推定: 最大ピークのこの割合以上のピークのうち、最も短い周期を選ぶ（オクターブ下の誤りを防ぐ）
+FEATURE_OCTAVE_TOLERANCE = 0.9
 
-    フォルマント比率とスペクトル特徴で簡易判定
 
-    Returns:
-        {'is_male': bool, 'confidence': float}
+def compute_voice_features(y: np.ndarray, sr: int, fmin: float = 50.0, fmax: float = 400.0,
+                           n_mfcc: int = 13) -> dict:
     """
-    if len(y) < sr * 0.1:  # 0.1秒未満は判定不可
-        return {'is_male': True, 'confidence': 0.0}
-
-    male_score = 0.0
-    total_weight = 0.0
-
-    # 1. スペクトル重心（声の明るさ）
-    try:
-        centroid = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
-        mean_centroid = np.mean(centroid[centroid > 0]) if np.any(centroid > 0) else 0
-
-        if mean_centroid > 0:
-            # 男性: 1000-2000Hz, 女性: 2000-3500Hz
-            if mean_centroid < 1800:
-                male_score += 1.0
-            elif mean_centroid < 2500:
-                male_score += 0.5
-            else:
-                male_score += 0.0
-            total_weight += 1.0
-    except:
-        pass
-
-    # 2. スペクトルロールオフ
-    try:
-        rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr, roll_percent=0.85)[0]
-        mean_rolloff = np.mean(rolloff[rolloff > 0]) if np.any(rolloff > 0) else 0
-
-        if mean_rolloff > 0:
-            if mean_rolloff < 3500:
-                male_score += 1.0
-            elif mean_rolloff < 5000:
-                male_score += 0.5
-            else:
-                male_score += 0.0
-            total_weight += 1.0
-    except:
-        pass
-
-    # 3. ピッチ（F0）
-    try:
-        f0, _, _ = librosa.pyin(y, fmin=50, fmax=400, sr=sr)
-        valid_f0 = f0[~np.isnan(f0)]
-        if len(valid_f0) > 0:
-            mean_f0 = np.median(valid_f0)
-            if mean_f0 < 165:
-                male_score += 1.0
-            elif mean_f0 < 200:
-                male_score += 0.5
-            else:
-                male_score += 0.0
-            total_weight += 1.5  # ピッチは重要なので重み大きめ
-    except:
-        pass
+    声質判定用の特徴量をまとめて求める（STFTは1回だけ）
 
-    # 最終スコア
-    if total_weight > 0:
-        final_score = male_score / total_weight
-    else:
-        final_score = 0.5
+    振幅スペクトログラムからスペクトル重心・ロールオフ・MFCCを求め（librosaの各関数と同じ値）、
+    パワースペクトルの逆FFT（自己相関）から窓の自己相関で正規化したピークでF0を求める（pyinより大幅に速い）。
+    STFTは窓長FEATURE_N_FFTのフレームを2倍の長さにゼロ埋めして行う（自己相関が循環して折り返さないように）。
+    その偶数番目のビンは窓長と同じ長さのFFTと一致するので、スペクトルの特徴量はそこから求める
 
-    return {
-        'is_male': final_score >= 0.5,
-        'confidence': abs(final_score - 0.5) * 2
-    }
+    Returns:
+        {'centroid': (frames,), 'rolloff': (frames,), 'mfcc': (n_mfcc, frames), 'f0': (frames,)（無声・無音はnan）}
+    """
+    import librosa
+    y = np.asarray(y, dtype=np.float32)
+    padded_fft = 2 * FEATURE_N_FFT
+    padded_power = np.abs(librosa.stft(y, n_fft=padded_fft, hop_length=FEATURE_HOP_LENGTH,
+                                       win_length=FEATURE_N_FFT)) ** 2
+    power = padded_power[::2]
+    S = np.sqrt(power)
+
+    centroid = librosa.feature.spectral_centroid(S=S, sr=sr, n_fft=FEATURE_N_FFT)[0]
+    rolloff = librosa.feature.spectral_rolloff(S=S, sr=sr, n_fft=FEATURE_N_FFT, roll_percent=0.85)[0]
+    mel = librosa.feature.melspectrogram(S=power, sr=sr, n_fft=FEATURE_N_FFT)
+    mfcc = librosa.feature.mfcc(S=librosa.power_to_db(mel), n_mfcc=n_mfcc)
+
+    # 自己相関 = ゼロ埋めしたフレームのパワースペクトルの逆FFT。窓の自己相関で割って窓による減衰を補正する
+    min_period = max(int(np.floor(sr / fmax)), 1)
+    max_period = min(int(np.ceil(sr / fmin)), FEATURE_N_FFT // 2 - 2)
+    acf = np.fft.irfft(padded_power, n=padded_fft, axis=0)[:max_period + 2]
+    window = librosa.filters.get_window('hann', FEATURE_N_FFT, fftbins=True)
+    window_acf = np.fft.irfft(np.abs(np.fft.rfft(window, n=padded_fft)) ** 2, n=padded_fft)[:max_period + 2]
+    energy = acf[0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nacf = np.nan_to_num((acf / energy) / (window_acf / window_acf[0])[:, None])
+
+    # 探索範囲内の極大のうち、最大値に近い最も短い周期を選ぶ
+    search = nacf[min_period:max_period + 1]
+    is_peak = (search > nacf[min_period - 1:max_period]) & (search >= nacf[min_period + 1:max_period + 2])
+    best = np.where(is_peak, search, -np.inf).max(axis=0)
+    candidates = is_peak & (search >= FEATURE_OCTAVE_TOLERANCE * best)
+    lag = np.argmax(candidates, axis=0) + min_period
+
+    # 放物線補間でサブサンプル精度にする
+    frames = np.arange(nacf.shape[1])
+    left, center, right = nacf[lag - 1, frames], nacf[lag, frames], nacf[lag + 1, frames]
+    curvature = left - 2 * center + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift = np.where(np.abs(curvature) > 1e-12, 0.5 * (left - right) / curvature, 0.0)
+    period = lag + np.clip(shift, -1, 1)
+
+    rms = np.sqrt(np.maximum(energy, 0))
+    voiced = (candidates.any(axis=0) & (best >= FEATURE_VOICING_THRESHOLD)
+              & (rms >= FEATURE_SILENCE_THRESHOLD * max(rms.max(), 1e-12)))
+    f0 = np.where(voiced, sr / period, np.nan)
+
+    return {'centroid': centroid, 'rolloff': rolloff, 'mfcc': mfcc, 'f0': f0}
 
 
 def detect_gender_by_timbre(audio_path: str, progress_callback=None) -> dict:
@@ -333,9 +615,9 @@ def detect_gender_by_timbre(audio_path: str, progress_callback=None) -> dict:
         has_parselmouth = False
         log("警告: parselmouthがインストールされていません。フォルマント分析をスキップします")
 
-    # 音声読み込み
-    sr = 16000  # 16kHzで統一
-    y, _ = librosa.load(audio_path, sr=sr, mono=True)
+    # 音声読み込み（16kHzで統一。話者分離の出力は16kHzなのでそのまま読む）
+    sr = 16000
+    y = read_mono_audio(audio_path, sr)
 
     # 無音チェック
     if np.max(np.abs(y)) < 0.01:
@@ -345,6 +627,13 @@ def detect_gender_by_timbre(audio_path: str, progress_callback=None) -> dict:
     male_score = 0
     total_weight = 0
 
+    # スペクトル重心・ロールオフ・MFCC・ピッチは1回のSTFTからまとめて求める
+    try:
+        voice_features = compute_voice_features(y, sr)
+    except Exception as e:
+        log(f"    特徴量抽出エラー: {e}")
+        voice_features = None
+
     # === 1. フォルマント分析（parselmouth使用） ===
     if has_parselmouth:
         try:
@@ -406,7 +695,7 @@ def detect_gender_by_timbre(audio_path: str, progress_callback=None) -> dict:
     # === 2. MFCC分析 ===
     try:
         log("  MFCC（声道特徴）を分析中...")
-        mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
+        mfccs = voice_features['mfcc']
 
         # MFCC係数の統計
         mfcc_means = np.mean(mfccs, axis=1)
@@ -431,8 +720,7 @@ def detect_gender_by_timbre(audio_path: str, progress_callback=None) -> dict:
     # === 3. スペクトル重心 ===
     try:
         log("  スペクトル重心を分析中...")
-        spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
-        mean_centroid = np.median(spectral_centroid)
+        mean_centroid = np.median(voice_features['centroid'])
 
         features['spectral_centroid'] = mean_centroid
 
@@ -450,8 +738,7 @@ def detect_gender_by_timbre(audio_path: str, progress_callback=None) -> dict:
     # === 4. スペクトルロールオフ ===
     try:
         log("  スペクトルロールオフを分析中...")
-        spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr, roll_percent=0.85)[0]
-        mean_rolloff = np.median(spectral_rolloff)
+        mean_rolloff = np.median(voice_features['rolloff'])
 
         features['spectral_rolloff'] = mean_rolloff
 
@@ -467,7 +754,7 @@ def detect_gender_by_timbre(audio_path: str, progress_callback=None) -> dict:
 
     # === 5. ピッチ（参考情報として追加、重みは低め） ===
     try:
-        f0, voiced_flag, voiced_probs = librosa.pyin(y, fmin=50, fmax=400, sr=sr)
+        f0 = voice_features['f0']
         valid_f0 = f0[~np.isnan(f0)]
         if len(valid_f0) > 0:
             median_pitch = np.median(valid_f0)
@@ -518,10 +805,12 @@ def detect_gender_by_pitch_distribution(audio_path: str, progress_callback=None)
     """
     ピッチ分布から性別を判定（バックアップ用）
     """
+    import librosa
     log = progress_callback or print
     log("ピッチ分布から性別を推定中...")
 
-    y, sr = librosa.load(audio_path, sr=22050)
+    sr = 22050
+    y = read_mono_audio(audio_path, sr)
 
     # ピッチ推定
     pitches, magnitudes = librosa.piptrack(y=y, sr=sr)
@@ -557,25 +846,37 @@ def separate_speakers_clearvoice(audio_path: str, output_dir: str, progress_call
 
     log("ClearVoice話者分離を開始...")
 
-    # 16kHzにリサンプリング（ClearVoiceの要求）
-    log("音声を16kHzにリサンプリング中...")
-    y, sr = librosa.load(audio_path, sr=16000, mono=True)
+    # 16kHzで直接デコード（ClearVoiceの要求）
+    log("音声を16kHzでデコード中...")
+    y = decode_audio(audio_path, 16000, mono=True)
 
-    # 一時ファイルに保存
+    # ClearVoiceは入力をファイルのパスでしか受け取らないため、16kHzの一時WAVに保存する
+    # （元の音声は動画や44.1kHzのWAVなので、そのままは渡せない）
     temp_input = os.path.join(output_dir, "temp_16k.wav")
     sf.write(temp_input, y, 16000)
 
     # ClearVoiceで分離（online_write=Trueでファイルに直接書き出し）
-    global _clearvoice_separator
-    if _clearvoice_separator is None:
-        log("話者分離AIを初期化中（初回のみ、少し時間がかかります）...")
-    else:
-        log("話者分離AIを実行中...")
-    separator = get_clearvoice_separator()
-
-    # 分離実行（ファイルに直接出力）
     # ClearVoiceは output_path/<model_name>/ にファイルを出力する
-    separator(input_path=temp_input, online_write=True, output_path=output_dir)
+    import model_server
+    separated = False
+    if model_server.is_enabled('clearvoice'):
+        # モデルサーバーの読み込み済みモデルで分離する
+        log("話者分離AIを実行中（モデルサーバー）...")
+        try:
+            model_server.separate(temp_input, output_dir)
+            separated = True
+        except model_server.ModelServerUnavailable as e:
+            log(f"モデルサーバーを使えないため、このプロセスでモデルを読み込みます: {e}")
+    if not separated:
+        global _clearvoice_separator
+        if _clearvoice_separator is None:
+            log("話者分離AIを初期化中（初回のみ、少し時間がかかります）...")
+        else:
+            log("話者分離AIを実行中...")
+        separator = get_clearvoice_separator()
+
+        # 分離実行（ファイルに直接出力）
+        separator(input_path=temp_input, online_write=True, output_path=output_dir)
 
     # 出力されたファイルを探す
     separated_files = []
@@ -653,8 +954,8 @@ def separate_speakers_to_files(
     speakers = []
     for i, speaker_file in enumerate(sorted(separated_files)):
         log(f"話者{i+1}のピッチを分析中...")
-        y_speaker, sr_speaker = librosa.load(speaker_file, sr=16000, mono=True)
-        pitch = estimate_pitch_for_speaker(y_speaker, sr_speaker)
+        y_speaker = read_mono_audio(speaker_file, 16000)
+        pitch = estimate_pitch_for_speaker(y_speaker, 16000)
 
         # 出力ファイル名を整理（speaker_0.wav, speaker_1.wav...）
         clean_file = os.path.join(output_dir, f"speaker_{i}.wav")
@@ -694,6 +995,7 @@ def process_with_selected_speakers(
         male_speaker_ids: 男性としてピッチダウンする話者のIDリスト [0, 1, ...]
         pitch_shift_semitones: ピッチシフト量（半音単位）
     """
+    import librosa
     def log(message):
         print(message)
         if progress_callback:
@@ -710,13 +1012,9 @@ def process_with_selected_speakers(
     if not speaker_files:
         raise ValueError("話者ファイルが見つかりません")
 
-    # 2. 元の音声を読み込み（44100Hz）
+    # 2. 元の音声の長さ（44100Hz）。合成の長さに使うだけなので音声は読まない
     original_audio = os.path.join(speaker_dir, "original.wav")
-    log("元音声を読み込み中...")
-    y_original, sr_original = librosa.load(original_audio, sr=44100, mono=False)
-    if y_original.ndim == 1:
-        y_original = np.stack([y_original, y_original])
-    target_len = y_original.shape[1]
+    target_len = count_audio_frames(original_audio, 44100)
 
     # 3. 各話者を処理
     processed_speakers = []
@@ -725,7 +1023,7 @@ def process_with_selected_speakers(
         speaker_path = os.path.join(speaker_dir, speaker_file)
 
         # 16kHz -> 44.1kHzにリサンプリング
-        y_sp_16k, _ = librosa.load(speaker_path, sr=16000, mono=True)
+        y_sp_16k = read_mono_audio(speaker_path, 16000)
         y_sp = librosa.resample(y_sp_16k, orig_sr=16000, target_sr=44100)
 
         if speaker_id in male_speaker_ids:
@@ -758,13 +1056,10 @@ def process_with_selected_speakers(
     # ステレオに変換
     y_stereo = np.stack([y_mixed, y_mixed])
 
-    # 5. 一時ファイルに保存
-    temp_audio = os.path.join(speaker_dir, "processed_audio.wav")
-    sf.write(temp_audio, y_stereo.T, 44100)
-
-    # 6. 動画と合成
+    # 5. 動画と合成（音声は一時ファイルを介さずffmpegへ直接流し込む）
     log("動画と音声を合成中...")
-    merge_audio_video(input_video, temp_audio, output_video)
+    with MuxAudioSink(input_video, output_video, 44100, 2) as sink:
+        sink.write(y_stereo.T)
 
     log("処理完了!")
 
@@ -779,6 +1074,7 @@ def process_with_clearvoice(
     """
     ClearVoice話者分離を使用して男性の声のみピッチを下げる
     """
+    import librosa
     def log(step, message):
         print(message)
         if progress_callback:
@@ -796,25 +1092,23 @@ def process_with_clearvoice(
             log('error', "話者分離に失敗しました")
             return
 
-        # 2. 元の音声を読み込み（44100Hzのまま）
-        log('analyze', "ステップ2: 元音声を読み込み中...")
-        y_original, sr_original = librosa.load(audio_path, sr=44100, mono=False)
-        if y_original.ndim == 1:
-            y_original = np.stack([y_original, y_original])
+        # 2. 元の音声の長さ（44100Hz）。合成の長さに使うだけなので音声は読まない
+        target_len = count_audio_frames(audio_path, 44100)
 
         # 3. 各話者のピッチを分析
         log('analyze', "ステップ3: 各話者のピッチを分析中...")
         speaker_pitches = []
 
         for i, speaker_file in enumerate(separated_files):
-            # 分離された音声を読み込み
-            y_speaker, sr_speaker = librosa.load(speaker_file, sr=16000, mono=True)
+            # 分離された音声を読み込み（ピッチシフトでも使うので1回だけ読む）
+            y_speaker = read_mono_audio(speaker_file, 16000)
 
             # ピッチを推定（長い音声用の関数を使用）
-            pitch = estimate_pitch_for_speaker(y_speaker, sr_speaker)
+            pitch = estimate_pitch_for_speaker(y_speaker, 16000)
 
             speaker_pitches.append({
                 'file': speaker_file,
+                'audio': y_speaker,
                 'pitch': pitch,
                 'is_male': False  # 後で相対比較で決定
             })
@@ -848,13 +1142,12 @@ def process_with_clearvoice(
         # 4. 男性話者の音声をピッチシフト
         log('pitch', "ステップ4: 男性話者の音声をピッチシフト...")
 
-        # 分離された各話者の音声を44100Hzで再読み込み・処理
+        # 分離された各話者の音声を44100Hzにして処理
         processed_speakers = []
 
         for i, sp_info in enumerate(speaker_pitches):
             # 16kHz音声を44100Hzにリサンプリング
-            y_sp_16k, _ = librosa.load(sp_info['file'], sr=16000, mono=True)
-            y_sp = librosa.resample(y_sp_16k, orig_sr=16000, target_sr=44100)
+            y_sp = librosa.resample(sp_info['audio'], orig_sr=16000, target_sr=44100)
 
             if sp_info['is_male']:
                 log('pitch', f"  話者{i+1}（男性）をピッチシフト中...")
@@ -867,10 +1160,6 @@ def process_with_clearvoice(
         # 5. 処理済み音声を合成
         log('merge', "ステップ5: 音声を合成中...")
 
-        # 長さを揃える
-        max_len = max(len(sp) for sp in processed_speakers)
-        target_len = y_original.shape[1]
-
         # 合成
         y_mixed = np.zeros(target_len)
         for sp in processed_speakers:
@@ -894,7 +1183,7 @@ def process_with_clearvoice(
         y_stereo = np.stack([y_mixed, y_mixed])
 
         # 6. 保存
-        sf.write(output_path, y_stereo.T, 44100)
+        write_audio_output(output_path, y_stereo, 44100)
         log('merge', f"処理済み音声を保存: {output_path}")
 
 
@@ -918,12 +1207,20 @@ def detect_gender_for_segment(segment_audio: np.ndarray, sr: int) -> dict:
     male_score = 0
     total_weight = 0
 
+    # ピッチ・スペクトル重心・ロールオフ・MFCCは1回のSTFTからまとめて求める
+    # 失敗した場合はフォルマントだけで判定し、エラーを結果に含める（呼び出し側でログに出す）
+    feature_error = None
+    try:
+        voice_features = compute_voice_features(segment_audio, sr)
+    except Exception as e:
+        voice_features = None
+        feature_error = f"特徴量抽出エラー: {e}"
+        print(f"    {feature_error}")
+
     # === 1. ピッチ（F0）分析 - 重み0.5（参考程度） ===
     # 声質判定ではピッチは補助的。高い声の男性もいる
     try:
-        f0, voiced_flag, voiced_probs = librosa.pyin(
-            segment_audio, fmin=50, fmax=400, sr=sr
-        )
+        f0 = voice_features['f0']
         valid_f0 = f0[~np.isnan(f0)]
         if len(valid_f0) > 3:
             median_pitch = np.median(valid_f0)
@@ -943,8 +1240,7 @@ def detect_gender_for_segment(segment_audio: np.ndarray, sr: int) -> dict:
     # 男性は声道が長いため、スペクトル重心が低い
     # これはピッチに関係なく一定
     try:
-        centroid = librosa.feature.spectral_centroid(y=segment_audio, sr=sr)[0]
-        mean_centroid = np.median(centroid)
+        mean_centroid = np.median(voice_features['centroid'])
         # 閾値を緩和して男性を検出しやすく
         if mean_centroid < 1800:
             centroid_male = 1.0
@@ -962,8 +1258,7 @@ def detect_gender_for_segment(segment_audio: np.ndarray, sr: int) -> dict:
     # === 3. スペクトルロールオフ - 重み1.5（声の倍音構造） ===
     # 男性は高周波成分が少ない
     try:
-        rolloff = librosa.feature.spectral_rolloff(y=segment_audio, sr=sr, roll_percent=0.85)[0]
-        mean_rolloff = np.median(rolloff)
+        mean_rolloff = np.median(voice_features['rolloff'])
         if mean_rolloff < 3500:
             rolloff_male = 1.0
         elif mean_rolloff < 5000:
@@ -980,7 +1275,7 @@ def detect_gender_for_segment(segment_audio: np.ndarray, sr: int) -> dict:
     # === 4. MFCC分析 - 重み1.5（声道の形状） ===
     # MFCCは声道の形状を表す - ピッチに依存しない
     try:
-        mfccs = librosa.feature.mfcc(y=segment_audio, sr=sr, n_mfcc=13)
+        mfccs = voice_features['mfcc']
         mfcc_means = np.mean(mfccs, axis=1)
         # MFCC2: スペクトル傾斜（男性は緩やか=値が低い傾向）
         mfcc2 = mfcc_means[1]
@@ -1045,11 +1340,27 @@ def detect_gender_for_segment(segment_audio: np.ndarray, sr: int) -> dict:
 
     # 閾値を0.45に下げて男性を検出しやすくする
     is_male = final_score >= 0.45
-    return {
+    result = {
         'is_male': is_male,
         'score': final_score,
         'confidence': abs(final_score - 0.5) * 2
     }
+    if feature_error:
+        result['error'] = feature_error
+    return result
+
+
+# ダブルチェックで解析する長さの上限（秒）。長い区間は中央のこの長さで判定する（メモリ・時間を抑える）
+DOUBLE_CHECK_MAX_SECONDS = 30.0
+
+
+def double_check_window(start_sec: float, end_sec: float,
+                        max_seconds: float = DOUBLE_CHECK_MAX_SECONDS) -> tuple:
+    """ダブルチェックで解析する範囲 (start_sec, end_sec)。max_secondsより長い区間は中央を切り出す"""
+    if end_sec - start_sec <= max_seconds:
+        return start_sec, end_sec
+    middle = (start_sec + end_sec) / 2
+    return middle - max_seconds / 2, middle + max_seconds / 2
 
 
 def process_timbre(
@@ -1058,7 +1369,11 @@ def process_timbre(
     pitch_shift_semitones: float = -3.0,
     segment_duration: float = 3.0,
     progress_callback=None,
-    enable_double_check: bool = True
+    enable_double_check: bool = True,
+    streaming: bool = False,
+    audio: np.ndarray = None,
+    cache=None,
+    plan: dict = None
 ) -> list:
     """
     声質版: inaSpeechSegmenter（CNN）による性別判定 + 後処理 + ダブルチェック
@@ -1068,6 +1383,11 @@ def process_timbre(
     2. ダブルチェック: CNNが「男性」と判定した区間を音響特徴で再確認（オプション）
 
     enable_double_check: ダブルチェックを有効にするかどうか
+    streaming: Trueなら音声全体を読み込まず、必要な区間だけ読んでブロックごとに処理する
+    output_path: 出力WAVのパス、またはMuxAudioSink（動画との結合へ直接流し込む）
+    audio: デコード済みの音声 (2, samples)、44100Hz。省略時はaudio_pathからデコードする
+    cache: ArtifactCache。指定時はina判定結果をキャッシュする
+    plan: dictを渡すと再レンダリング用の情報（男性区間）を書き込む
 
     Returns:
         list: 処理された区間のリスト [{'start': float, 'end': float, 'pitch': float}, ...]
@@ -1084,21 +1404,32 @@ def process_timbre(
     log('analyze', f"声質版: CNN判定 + 後処理（ダブルチェック: {dc_status}）...")
 
     # 1. 音声を読み込み
-    log('pitch', "ステップ1: 音声を読み込み中...")
-    y, sr = librosa.load(audio_path, sr=44100, mono=False)
-    if y.ndim == 1:
-        y = np.stack([y, y])
+    sr = 44100
+    if streaming:
+        # 音声全体は読み込まない（ダブルチェックの区間は1回のデコードでまとめて切り出す）
+        log('pitch', "ステップ1: ストリーミングモード（音声はブロックごとに処理します）")
+        n_samples = int((get_audio_duration(audio_path) or 0.0) * sr)
+    else:
+        if audio is None:
+            log('pitch', "ステップ1: 音声を読み込み中...")
+            audio = decode_audio(audio_path, sr)
+        y = audio
+        n_samples = y.shape[1]
 
-    # モノラル版も用意（ダブルチェック用）
-    y_mono = y[0] if y.ndim > 1 else y
+        # モノラル版も用意（ダブルチェック用）。スペクトル重心・ロールオフの閾値は44.1kHzの全帯域で
+        # 決めてあるため、解析用サンプルレートには間引かない
+        y_mono = y[0] if y.ndim > 1 else y
 
-    total_duration = y.shape[1] / sr
+    total_duration = n_samples / sr
     log('pitch', f"音声長: {total_duration:.1f}秒")
 
     # 2. inaSpeechSegmenterで性別判定
     log('analyze', "ステップ2: CNNで性別を判定中（初回は時間がかかります）...")
     try:
-        segments_raw = detect_gender_ina(audio_path, lambda msg: log('analyze', msg))
+        segments_raw = run_cached(cache, 'ina', ina_cache_params(),
+                                  lambda: detect_gender_ina(audio_path, lambda msg: log('analyze', msg)),
+                                  log=lambda msg: log('analyze', msg))
+        segments_raw = [tuple(s) for s in segments_raw]
         log('analyze', f"CNN判定結果: {len(segments_raw)}区間検出")
         # 詳細ログ
         male_count = sum(1 for l, s, e in segments_raw if l == 'male')
@@ -1129,7 +1460,25 @@ def process_timbre(
     if male_segments_count == 0:
         log('pitch', "警告: 男性区間が検出されませんでした。処理をスキップします。")
 
-    y_processed = y.copy()
+    # ダブルチェック: 1秒以上の男性区間を音響特徴で再確認する（オプション）。
+    # 区間は時間順に1回のパスで切り出す（ストリーミングでも区間ごとにデコードしない）
+    double_checks = {}
+    checks = [(start_sec, end_sec) for label, start_sec, end_sec in segments
+              if label == 'male' and end_sec - start_sec >= 1.0 and int(start_sec * sr) < n_samples]
+    if enable_double_check and checks:
+        checks.sort()
+        windows = [double_check_window(start_sec, end_sec) for start_sec, end_sec in checks]
+        # 閾値は44.1kHzの全帯域・左チャンネルで決めてある
+        reader = iter_audio_blocks(audio_path, sr) if streaming else None
+        try:
+            blocks = (block[0] for block in reader) if streaming else [y_mono]
+            for check, segment_analysis in zip(checks, iter_segment_audio(blocks, sr, windows)):
+                double_checks[check] = detect_gender_for_segment(segment_analysis, sr)
+        finally:
+            if reader is not None:
+                reader.close()
+
+    shift_regions = []
     male_duration = 0
     female_duration = 0
     processed_count = 0
@@ -1141,19 +1490,18 @@ def process_timbre(
             end_sample = int(end_sec * sr)
 
             # 範囲チェック
-            if start_sample >= y.shape[1]:
+            if start_sample >= n_samples:
                 continue
-            end_sample = min(end_sample, y.shape[1])
+            end_sample = min(end_sample, n_samples)
 
-            segment_mono = y_mono[start_sample:end_sample]
-
-            # ダブルチェック: 音響特徴で再確認（1秒以上の区間のみ、オプション）
+            # ダブルチェックの結果（1秒以上の区間のみ、オプション）
             duration = end_sec - start_sec
             should_process = True
 
-            if enable_double_check and duration >= 1.0:
-                # 長い区間はダブルチェック
-                double_check_result = detect_gender_for_segment(segment_mono, sr)
+            double_check_result = double_checks.get((start_sec, end_sec))
+            if double_check_result is not None:
+                if double_check_result.get('error'):
+                    log('pitch', f"  ダブルチェック {start_sec:.1f}s-{end_sec:.1f}s: {double_check_result['error']}")
                 if not double_check_result['is_male'] and double_check_result['confidence'] > 0.3:
                     # ダブルチェックで「女性」と高確信度で判定された場合はスキップ
                     should_process = False
@@ -1170,32 +1518,9 @@ def process_timbre(
                     'pitch': float(pitch_shift_semitones)
                 })
 
-                # 各チャンネルをピッチシフト
-                for ch in range(y.shape[0]):
-                    segment = y[ch, start_sample:end_sample]
-                    if len(segment) < sr * 0.1:  # 0.1秒未満はスキップ
-                        continue
-
-                    processed = pitch_shift_audio(segment, sr, pitch_shift_semitones)
-
-                    # 長さを調整
-                    target_len = end_sample - start_sample
-                    if len(processed) > target_len:
-                        processed = processed[:target_len]
-                    elif len(processed) < target_len:
-                        processed = np.pad(processed, (0, target_len - len(processed)))
-
-                    # クロスフェード
-                    fade_len = min(int(0.02 * sr), len(processed) // 4)
-                    if fade_len > 0:
-                        if start_sample > 0:
-                            fade_in = np.linspace(0, 1, fade_len)
-                            processed[:fade_len] = processed[:fade_len] * fade_in + y[ch, start_sample:start_sample+fade_len] * (1 - fade_in)
-                        if end_sample < y.shape[1]:
-                            fade_out = np.linspace(1, 0, fade_len)
-                            processed[-fade_len:] = processed[-fade_len:] * fade_out + y[ch, end_sample-fade_len:end_sample] * (1 - fade_out)
-
-                    y_processed[ch, start_sample:end_sample] = processed
+                # シフト区間として記録（0.1秒未満はスキップ）。後で全体を1パスでピッチシフトする
+                if end_sample - start_sample >= sr * 0.1:
+                    shift_regions.append((start_sample, end_sample, pitch_shift_semitones))
 
                 # 最初の数区間はデバッグログを出力
                 if processed_count < 3:
@@ -1220,16 +1545,31 @@ def process_timbre(
         log('pitch', "警告: ピッチシフトが適用された区間がありません！")
         log('pitch', "原因: 男性区間が検出されなかったか、すべてダブルチェックで棄却されました")
 
-    # 4. クリッピング防止
-    max_val = np.max(np.abs(y_processed))
-    if max_val > 1.0:
-        y_processed = y_processed / max_val * 0.95
+    # 男性区間をまとめて1パスでピッチシフト（区間の境界は窓の重なりでつながる）
+    curve = build_semitone_curve(shift_regions, n_samples)
+    if plan is not None:
+        plan.update(regions_render_plan(shift_regions, n_samples, sr))
+
+    if not streaming:
+        y_processed = render_pitch_curve(y, curve)
+
+        # 4. クリッピング防止
+        max_val = np.max(np.abs(y_processed))
+        if max_val > 1.0:
+            y_processed = y_processed / max_val * 0.95
 
     # 5. 保存
     log('merge', f"音声を保存中: {output_path}")
     try:
-        sf.write(output_path, y_processed.T, sr)
-        log('merge', f"[OK] 音声保存完了 (サイズ: {os.path.getsize(output_path)} bytes)")
+        if streaming:
+            # ブロックごとにデコード→ピッチシフト→保存
+            render_pitch_curve_stream(audio_path, output_path, curve, sr)
+        else:
+            write_audio_output(output_path, y_processed, sr)
+        if isinstance(output_path, MuxAudioSink):
+            log('merge', f"[OK] 音声出力完了 ({output_path.frames_written / sr:.1f}秒)")
+        else:
+            log('merge', f"[OK] 音声保存完了 (サイズ: {os.path.getsize(output_path)} bytes)")
     except Exception as e:
         log('merge', f"[ERROR] 音声保存失敗: {str(e)}")
         raise
@@ -1239,12 +1579,97 @@ def process_timbre(
     return processed_segments
 
 
+def mix_speaker_stems(stems: list, male_flags: list, pitch_shift_semitones: float,
+                      target_len: int, log=None) -> np.ndarray:
+    """
+    話者分離した音声（16kHzモノラル）を44100Hzに戻し、男性話者だけピッチシフトして合成する
+
+    Returns:
+        合成した音声 (2, target_len)
+    """
+    import librosa
+    processed_speakers = []
+    for i, (y_sp_16k, is_male) in enumerate(zip(stems, male_flags)):
+        # 16kHz音声を44100Hzにリサンプリング
+        y_sp = librosa.resample(y_sp_16k, orig_sr=16000, target_sr=44100)
+
+        if is_male:
+            if log:
+                log(f"  話者{i+1}（男性）をピッチシフト中... ({pitch_shift_semitones}半音)")
+            y_sp = pitch_shift_audio(y_sp, 44100, pitch_shift_semitones)
+        elif log:
+            log(f"  話者{i+1}（女性）はそのまま")
+
+        processed_speakers.append(y_sp)
+
+    y_mixed = np.zeros(target_len)
+    for sp in processed_speakers:
+        if len(sp) < target_len:
+            sp = np.pad(sp, (0, target_len - len(sp)))
+        elif len(sp) > target_len:
+            sp = sp[:target_len]
+        y_mixed += sp
+
+    # 正規化
+    if len(processed_speakers) > 1:
+        y_mixed = y_mixed / len(processed_speakers)
+
+    # クリッピング防止
+    max_val = np.max(np.abs(y_mixed))
+    if max_val > 1.0:
+        y_mixed = y_mixed / max_val * 0.95
+
+    # ステレオに変換
+    return np.stack([y_mixed, y_mixed])
+
+
+def regions_render_plan(shift_regions: list, n_samples: int, sr: int = 44100) -> dict:
+    """
+    ピッチシフト区間から再レンダリング用の情報を作る
+    シフト量は持たず、再レンダリング時に指定した値を全区間に使う
+    """
+    return {'kind': 'regions', 'sr': sr, 'n_samples': int(n_samples),
+            'regions': [[int(start), int(end)] for start, end, _ in shift_regions]}
+
+
+def speakers_render_plan(stems: list, male_flags: list, target_len: int) -> dict:
+    """話者分離結果（16kHzモノラル）と男性判定から再レンダリング用の情報を作る"""
+    return {'kind': 'speakers', 'sr': 44100, 'n_samples': int(target_len),
+            'male': [bool(m) for m in male_flags], 'stems': stems}
+
+
+def save_render_plan(plan: dict, plan_dir: str) -> None:
+    """再レンダリング用の情報をディレクトリに保存する（plan.json + 話者音声の.npy）"""
+    os.makedirs(plan_dir, exist_ok=True)
+    meta = {k: v for k, v in plan.items() if k != 'stems'}
+    if 'stems' in plan:
+        meta['stems'] = []
+        for i, stem in enumerate(plan['stems']):
+            name = f"stem_{i}.npy"
+            np.save(os.path.join(plan_dir, name), np.asarray(stem, dtype=np.float32))
+            meta['stems'].append(name)
+    with open(os.path.join(plan_dir, 'plan.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+
+def load_render_plan(plan_dir: str) -> dict:
+    """save_render_planで保存した情報を読み込む"""
+    with open(os.path.join(plan_dir, 'plan.json'), encoding='utf-8') as f:
+        plan = json.load(f)
+    if 'stems' in plan:
+        plan['stems'] = [np.load(os.path.join(plan_dir, name)) for name in plan['stems']]
+    return plan
+
+
 def process_hybrid(
     audio_path: str,
     output_path: str,
     pitch_shift_semitones: float = -3.0,
     male_threshold: float = 165,
-    progress_callback=None
+    progress_callback=None,
+    audio: np.ndarray = None,
+    cache=None,
+    plan: dict = None
 ) -> None:
     """
     ハイブリッド版: ClearVoice話者分離 + SpeechBrain声質判定 + Hz判定
@@ -1262,9 +1687,10 @@ def process_hybrid(
     with tempfile.TemporaryDirectory() as tmpdir:
         # 1. ClearVoiceで話者分離
         log('separate', "ステップ1: ClearVoice話者分離...")
-        separated_files = separate_speakers_clearvoice(
-            audio_path, tmpdir,
-            lambda step, msg: log('separate', msg)
+        separated_files = run_cached(
+            cache, 'clearvoice', {},
+            lambda: separate_speakers_clearvoice(audio_path, tmpdir, lambda step, msg: log('separate', msg)),
+            log=lambda msg: log('separate', msg), files=True
         )
 
         if not separated_files:
@@ -1272,10 +1698,10 @@ def process_hybrid(
             return
 
         # 2. 元の音声を読み込み（44100Hzのまま）
-        log('analyze', "ステップ2: 元音声を読み込み中...")
-        y_original, sr_original = librosa.load(audio_path, sr=44100, mono=False)
-        if y_original.ndim == 1:
-            y_original = np.stack([y_original, y_original])
+        if audio is None:
+            log('analyze', "ステップ2: 元音声を読み込み中...")
+            audio = decode_audio(audio_path, 44100)
+        y_original, sr_original = audio, 44100
 
         # 3. 各話者を声質+Hzで判定
         log('analyze', "ステップ3: 各話者の性別を声質+Hzで判定中...")
@@ -1303,50 +1729,20 @@ def process_hybrid(
             gender_jp = "男性" if is_male else "女性"
             log('analyze', f"  話者{i+1}: 声質={gender}, Hz={pitch_gender} → {gender_jp}")
 
-        # 4. 男性話者の音声をピッチシフト
+        # 4. 男性話者の音声をピッチシフトして合成
         log('pitch', "ステップ4: 男性話者の音声をピッチシフト...")
-
-        processed_speakers = []
         target_len = y_original.shape[1]
+        stems = [read_mono_audio(sp['file'], 16000) for sp in speaker_info]
+        male_flags = [sp['is_male'] for sp in speaker_info]
+        if plan is not None:
+            plan.update(speakers_render_plan(stems, male_flags, target_len))
 
-        for i, sp_info in enumerate(speaker_info):
-            # 16kHz音声を44100Hzにリサンプリング
-            y_sp_16k, _ = librosa.load(sp_info['file'], sr=16000, mono=True)
-            y_sp = librosa.resample(y_sp_16k, orig_sr=16000, target_sr=44100)
-
-            if sp_info['is_male']:
-                log('pitch', f"  話者{i+1}（男性）をピッチシフト中...")
-                y_sp = pitch_shift_audio(y_sp, 44100, pitch_shift_semitones)
-            else:
-                log('pitch', f"  話者{i+1}（女性）はそのまま")
-
-            processed_speakers.append(y_sp)
+        y_stereo = mix_speaker_stems(stems, male_flags, pitch_shift_semitones, target_len,
+                                     log=lambda msg: log('pitch', msg))
 
-        # 5. 処理済み音声を合成
+        # 5. 保存
         log('merge', "ステップ5: 音声を合成中...")
-
-        y_mixed = np.zeros(target_len)
-        for sp in processed_speakers:
-            if len(sp) < target_len:
-                sp = np.pad(sp, (0, target_len - len(sp)))
-            elif len(sp) > target_len:
-                sp = sp[:target_len]
-            y_mixed += sp
-
-        # 正規化
-        if len(processed_speakers) > 1:
-            y_mixed = y_mixed / len(processed_speakers)
-
-        # クリッピング防止
-        max_val = np.max(np.abs(y_mixed))
-        if max_val > 1.0:
-            y_mixed = y_mixed / max_val * 0.95
-
-        # ステレオに変換
-        y_stereo = np.stack([y_mixed, y_mixed])
-
-        # 6. 保存
-        sf.write(output_path, y_stereo.T, 44100)
+        write_audio_output(output_path, y_stereo, 44100)
 
         male_count = sum(1 for sp in speaker_info if sp['is_male'])
         log('merge', f"処理完了: {male_count}人の男性話者をピッチシフト")
@@ -1356,7 +1752,10 @@ def process_precision(
     audio_path: str,
     output_path: str,
     pitch_shift_semitones: float = -3.0,
-    progress_callback=None
+    progress_callback=None,
+    audio: np.ndarray = None,
+    cache=None,
+    plan: dict = None
 ) -> list:
     """
     高精度モード: 話者分離 + CNN性別判定
@@ -1382,47 +1781,51 @@ def process_precision(
         # 1. ClearVoiceで話者分離
         log('separate', "ステップ1: 話者分離中（AI処理）...")
         try:
-            separated_files = separate_speakers_clearvoice(
-                audio_path, tmpdir,
-                lambda step, msg: log('separate', msg)
+            separated_files = run_cached(
+                cache, 'clearvoice', {},
+                lambda: separate_speakers_clearvoice(audio_path, tmpdir, lambda step, msg: log('separate', msg)),
+                log=lambda msg: log('separate', msg), files=True
             )
         except Exception as e:
             log('error', f"話者分離エラー: {str(e)}")
             log('error', "話者分離に失敗しました。通常のCNN判定にフォールバックします...")
             # フォールバック: 通常のCNN判定
             return process_timbre(audio_path, output_path, pitch_shift_semitones,
-                                 progress_callback=progress_callback, enable_double_check=True)
+                                 progress_callback=progress_callback, enable_double_check=True,
+                                 audio=audio, cache=cache, plan=plan)
 
         if not separated_files:
             log('error', "話者が検出されませんでした。通常のCNN判定にフォールバックします...")
             return process_timbre(audio_path, output_path, pitch_shift_semitones,
-                                 progress_callback=progress_callback, enable_double_check=True)
+                                 progress_callback=progress_callback, enable_double_check=True,
+                                 audio=audio, cache=cache, plan=plan)
 
         log('separate', f"  {len(separated_files)}人の話者を検出しました")
 
         # 2. 元の音声を読み込み（44100Hzのまま）
-        log('analyze', "ステップ2: 元音声を読み込み中...")
-        y_original, sr_original = librosa.load(audio_path, sr=44100, mono=False)
-        if y_original.ndim == 1:
-            y_original = np.stack([y_original, y_original])
+        if audio is None:
+            log('analyze', "ステップ2: 元音声を読み込み中...")
+            audio = decode_audio(audio_path, 44100)
+        y_original, sr_original = audio, 44100
 
         # 3. 各話者をCNNで性別判定
         log('analyze', "ステップ3: 各話者の性別をCNN(AI)で判定中...")
         speaker_info = []
+        # 分離結果（16kHzモノラル）は1回だけ読み、CNN判定・ピッチ判定・合成で共有する
+        stems = [read_mono_audio(speaker_file, INA_SR) for speaker_file in separated_files]
 
-        for i, speaker_file in enumerate(separated_files):
+        for i, (speaker_file, y_sp_16k) in enumerate(zip(separated_files, stems)):
             log('analyze', f"  話者{i+1}/{len(separated_files)}を分析中...")
 
             # 話者の音声をCNNで分析
             try:
-                # 一時的に44100Hzに変換してCNN判定
-                y_sp_16k, _ = librosa.load(speaker_file, sr=16000, mono=True)
-                temp_44k_path = os.path.join(tmpdir, f"speaker_{i}_44k.wav")
-                y_sp_44k = librosa.resample(y_sp_16k, orig_sr=16000, target_sr=44100)
-                sf.write(temp_44k_path, y_sp_44k, 44100)
-
-                # CNN判定
-                segments = detect_gender_ina(temp_44k_path, lambda msg: log('analyze', f"    {msg}"))
+                # CNN判定（inaは16kHzで処理するため、分離結果の配列をそのまま渡す）
+                segments = run_cached(
+                    cache, 'ina_speaker', {'speaker': i, **ina_cache_params()},
+                    lambda: detect_gender_ina(speaker_file, lambda msg: log('analyze', f"    {msg}"),
+                                              audio=y_sp_16k),
+                    log=lambda msg: log('analyze', f"    {msg}"))
+                segments = [tuple(s) for s in segments]
 
                 # 男性/女性の割合を計算
                 male_duration = sum(e - s for l, s, e in segments if l == 'male')
@@ -1434,7 +1837,7 @@ def process_precision(
                     is_male = male_ratio > 0.5  # 50%以上が男性なら男性と判定
                 else:
                     # 声がほとんど検出されない場合はピッチで判定
-                    avg_pitch = estimate_pitch_for_segment(y_sp_44k, 44100)
+                    avg_pitch = estimate_pitch_for_segment(y_sp_16k, 16000)
                     is_male = avg_pitch > 0 and avg_pitch < 165
 
                 speaker_info.append({
@@ -1454,8 +1857,7 @@ def process_precision(
             except Exception as e:
                 log('analyze', f"  話者{i+1}の分析エラー: {str(e)}")
                 # エラー時はピッチで判定
-                y_sp, _ = librosa.load(speaker_file, sr=16000, mono=True)
-                avg_pitch = estimate_pitch_for_segment(y_sp, 16000)
+                avg_pitch = estimate_pitch_for_segment(y_sp_16k, 16000)
                 is_male = avg_pitch > 0 and avg_pitch < 165
                 speaker_info.append({
                     'file': speaker_file,
@@ -1471,60 +1873,26 @@ def process_precision(
         male_count = sum(1 for sp in speaker_info if sp['is_male'])
         log('pitch', f"ステップ4: 男性話者({male_count}人)の音声をピッチシフト中...")
 
-        processed_speakers = []
         target_len = y_original.shape[1]
+        male_flags = [sp['is_male'] for sp in speaker_info]
+        if plan is not None:
+            plan.update(speakers_render_plan(stems, male_flags, target_len))
+
+        for i, (stem, is_male) in enumerate(zip(stems, male_flags)):
+            processed_speakers_info.append({
+                'speaker': i + 1,
+                'is_male': is_male,
+                'duration': len(stem) / 16000,
+                'pitch_shift': pitch_shift_semitones if is_male else 0
+            })
 
-        for i, sp_info in enumerate(speaker_info):
-            # 16kHz音声を44100Hzにリサンプリング
-            y_sp_16k, _ = librosa.load(sp_info['file'], sr=16000, mono=True)
-            y_sp = librosa.resample(y_sp_16k, orig_sr=16000, target_sr=44100)
-
-            if sp_info['is_male']:
-                log('pitch', f"  話者{i+1}（男性）をピッチシフト中... ({pitch_shift_semitones}半音)")
-                y_sp = pitch_shift_audio(y_sp, 44100, pitch_shift_semitones)
-                processed_speakers_info.append({
-                    'speaker': i + 1,
-                    'is_male': True,
-                    'duration': len(y_sp) / 44100,
-                    'pitch_shift': pitch_shift_semitones
-                })
-            else:
-                log('pitch', f"  話者{i+1}（女性）はそのまま")
-                processed_speakers_info.append({
-                    'speaker': i + 1,
-                    'is_male': False,
-                    'duration': len(y_sp) / 44100,
-                    'pitch_shift': 0
-                })
-
-            processed_speakers.append(y_sp)
+        y_stereo = mix_speaker_stems(stems, male_flags, pitch_shift_semitones, target_len,
+                                     log=lambda msg: log('pitch', msg))
 
-        # 5. 処理済み音声を合成
+        # 5. 処理済み音声を合成して保存
         log('merge', "ステップ5: 音声を合成中...")
-
-        y_mixed = np.zeros(target_len)
-        for sp in processed_speakers:
-            if len(sp) < target_len:
-                sp = np.pad(sp, (0, target_len - len(sp)))
-            elif len(sp) > target_len:
-                sp = sp[:target_len]
-            y_mixed += sp
-
-        # 正規化
-        if len(processed_speakers) > 1:
-            y_mixed = y_mixed / len(processed_speakers)
-
-        # クリッピング防止
-        max_val = np.max(np.abs(y_mixed))
-        if max_val > 1.0:
-            y_mixed = y_mixed / max_val * 0.95
-
-        # ステレオに変換
-        y_stereo = np.stack([y_mixed, y_mixed])
-
-        # 6. 保存
         log('merge', f"音声を保存中: {output_path}")
-        sf.write(output_path, y_stereo.T, 44100)
+        write_audio_output(output_path, y_stereo, 44100)
 
         log('merge', f"処理完了: {len(separated_files)}人中{male_count}人の男性話者をピッチシフト")
 
@@ -1595,20 +1963,715 @@ def merge_audio_video(video_path: str, audio_path: str, output_path: str) -> Non
         raise RuntimeError(f"ffmpeg失敗: {error_msg}")
 
 
-def estimate_pitch_for_segment(y: np.ndarray, sr: int) -> float:
-    """セグメントの平均ピッチを推定する"""
+# 波形エディタでの再生用の圧縮音声（AAC）のビットレート
+PREVIEW_AUDIO_BITRATE = '96k'
+
+
+def encode_preview_audio(audio_path: str, preview_path: str, bitrate: str = PREVIEW_AUDIO_BITRATE) -> None:
+    """
+    処理済み音声から再生用の圧縮音声（AAC/m4a）を作る
+    moovを先頭に置き、Range要求で途中から再生できるようにする
+    """
+    cmd = [
+        find_ffmpeg(), '-y', '-v', 'error', '-i', audio_path,
+        '-vn', '-c:a', 'aac', '-b:a', bitrate, '-movflags', '+faststart',
+        preview_path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        error_msg = result.stderr or result.stdout or "ffmpeg error"
+        raise RuntimeError(f"プレビュー音声の作成失敗: {error_msg}")
+
+
+class MuxAudioSink:
+    """
+    処理済み音声をffmpegの標準入力へ流し込み、元動画の映像と結合する
+
+    音声を一時WAVに書き出してから結合する代わりに、レンダリングした音声をそのまま
+    ffmpegへ渡す。tee_pathを指定したときだけ同じ音声をWAVにも書き出す
+
+    write()には (samples, channels) のfloat配列を渡す（sf.SoundFile.writeと同じ向き）
+    withで使うと、正常終了時は結合を完了し、例外時は中断して出力ファイルを削除する
+    """
+
+    def __init__(self, video_path: str, output_path: str, sr: int = 44100,
+                 channels: int = 2, tee_path: str = None):
+        self.output_path = output_path
+        self.sr = sr
+        self.channels = channels
+        self.tee_path = tee_path
+        self.frames_written = 0
+
+        cmd = [
+            find_ffmpeg(), '-y', '-v', 'error',
+            '-i', video_path,
+            '-f', 'f32le', '-ar', str(sr), '-ac', str(channels), '-i', 'pipe:0',
+            '-c:v', 'copy', '-map', '0:v:0', '-map', '1:a:0',
+            '-shortest', output_path
+        ]
+        # stderrをパイプにすると、書き込み側と詰まる可能性があるため一時ファイルに受ける
+        self._stderr = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                      stderr=self._stderr)
+        self._tee = None
+        if tee_path:
+            self._tee = sf.SoundFile(tee_path, 'w', samplerate=sr, channels=channels, subtype='PCM_16')
+
+    def _error_message(self) -> str:
+        self._stderr.seek(0)
+        return self._stderr.read().decode(errors='replace') or "ffmpeg error"
+
+    def write(self, frames: np.ndarray) -> None:
+        """音声 (samples, channels) を書き込む"""
+        frames = np.clip(frames, -1.0, 1.0).astype(np.float32)
+        if frames.ndim == 1:
+            frames = np.repeat(frames[:, None], self.channels, axis=1)
+        try:
+            self._proc.stdin.write(np.ascontiguousarray(frames).tobytes())
+        except (BrokenPipeError, OSError):
+            self._proc.wait()
+            raise RuntimeError(f"ffmpeg失敗: {self._error_message()}")
+        if self._tee is not None:
+            self._tee.write(frames)
+        self.frames_written += len(frames)
+
+    def close(self) -> None:
+        """入力を閉じて結合の完了を待つ"""
+        if self._tee is not None:
+            self._tee.close()
+        try:
+            self._proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self._proc.wait()
+        message = self._error_message()
+        self._stderr.close()
+        if self._proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg失敗: {message}")
+
+    def __str__(self) -> str:
+        return self.output_path
+
+    def abort(self) -> None:
+        """結合を中断し、書きかけの出力を削除する"""
+        if self._tee is not None:
+            self._tee.close()
+        self._proc.kill()
+        self._proc.wait()
+        self._stderr.close()
+        for path in [self.output_path, self.tee_path]:
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def write_audio_output(output, y: np.ndarray, sr: int) -> None:
+    """処理済み音声 (channels, samples) を出力する（outputはWAVのパスかMuxAudioSink）"""
+    if isinstance(output, MuxAudioSink):
+        output.write(y.T)
+    else:
+        sf.write(output, y.T, sr)
+
+
+# ストリーミング処理で一度にデコードする長さ（秒）
+STREAM_BLOCK_SECONDS = 30.0
+# これより長い音声は自動的にストリーミング処理にする（秒）
+STREAMING_AUTO_DURATION = 1800.0
+# decode_audioでパイプから一度に読み込む長さ（秒）
+DECODE_CHUNK_SECONDS = 10.0
+
+
+def _open_pcm_pipe(path: str, sr: int, start: float = None, duration: float = None) -> subprocess.Popen:
+    """
+    ffmpegで音声を2ch float32 PCM（f32le）にデコードして標準出力に流すプロセスを起動する
+
+    モノラル音源は両チャンネルに同じ音声が入る。モノラル化はlibrosaと同じチャンネル平均にするため
+    ffmpegの-ac 1（1/√2倍の和）は使わず、呼び出し側で行う
+    """
+    cmd = [find_ffmpeg(), '-v', 'error']
+    if start:
+        cmd += ['-ss', f"{start:.6f}"]
+    cmd += ['-i', path]
+    if duration is not None:
+        cmd += ['-t', f"{duration:.6f}"]
+    cmd += ['-vn', '-f', 'f32le', '-acodec', 'pcm_f32le', '-ac', '2', '-ar', str(sr), 'pipe:1']
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def _close_pcm_pipe(proc: subprocess.Popen, finished: bool) -> None:
+    """デコードプロセスを終了させる（最後まで読んだのに失敗していれば例外）"""
+    proc.stdout.close()
+    if not finished and proc.poll() is None:
+        # 途中で読むのをやめた場合もffmpegを終了させる
+        proc.kill()
+    stderr = proc.stderr.read().decode(errors='replace')
+    proc.stderr.close()
+    proc.wait()
+    if finished and proc.returncode != 0:
+        raise RuntimeError(f"音声デコード失敗: {stderr or 'ffmpeg error'}")
+
+
+def _read_full(stream, view: memoryview) -> int:
+    """viewが埋まるかEOFになるまで読み込み、読んだバイト数を返す"""
+    filled = 0
+    while filled < len(view):
+        n = stream.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+    return filled
+
+
+def get_audio_duration(path: str) -> float:
+    """
+    音声・動画ファイルの長さ（秒）を取得する（音声は読み込まない）
+    soundfileで開けない場合はffmpegのヘッダ情報から求める。不明ならNone
+    """
+    try:
+        return sf.info(path).duration
+    except Exception:
+        pass
+
+    import re
+    result = subprocess.run([find_ffmpeg(), '-hide_banner', '-i', path],
+                            capture_output=True, text=True, errors='replace')
+    match = re.search(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)', result.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def decode_audio(path: str, sr: int = 44100, mono: bool = False,
+                 start: float = None, duration: float = None) -> np.ndarray:
+    """
+    ffmpegのパイプからPCMを事前確保したfloat32配列へ直接読み込む
+
+    動画・音声ファイルのどちらでもよく、一時WAVの書き出し・再読み込みをしない。
+    配列は長さの見積もり（ヘッダ）から確保し、足りなければ拡張する
+
+    Args:
+        sr: デコードするサンプルレート（ffmpegでリサンプル）
+        mono: Trueならチャンネル平均のモノラル（librosa.load(mono=True)と同じ）
+        start, duration: 切り出す範囲（秒）。省略時は全体
+
+    Returns:
+        mono=Trueなら (samples,)、Falseなら (2, samples)
+    """
+    expected = duration
+    if expected is None:
+        total = get_audio_duration(path)
+        if total is not None:
+            expected = max(total - (start or 0), 0)
+    # 見積もりより1秒多めに確保する（不明なら1分から拡張していく）
+    capacity = int(np.ceil(expected * sr)) + sr if expected is not None else 60 * sr
+
+    out = np.empty(capacity if mono else (capacity, 2), dtype=np.float32)
+    chunk = np.empty((max(1, int(DECODE_CHUNK_SECONDS * sr)), 2), dtype=np.float32)
+    chunk_view = memoryview(chunk).cast('B')
+    filled = 0
+
+    proc = _open_pcm_pipe(path, sr, start, duration)
+    finished = False
+    try:
+        while True:
+            if mono:
+                n = _read_full(proc.stdout, chunk_view) // 8
+            else:
+                if filled == len(out):
+                    out = np.concatenate([out, np.empty((len(out) // 2 + sr, 2), dtype=np.float32)])
+                n = _read_full(proc.stdout, memoryview(out[filled:]).cast('B')) // 8
+            if n == 0:
+                break
+            if mono:
+                if filled + n > len(out):
+                    out = np.concatenate([out, np.empty(max(n, len(out) // 2), dtype=np.float32)])
+                np.mean(chunk[:n], axis=1, out=out[filled:filled + n])
+            filled += n
+        finished = True
+    finally:
+        _close_pcm_pipe(proc, finished)
+
+    return out[:filled] if mono else out[:filled].T
+
+
+def read_mono_audio(path: str, sr: int) -> np.ndarray:
+    """
+    モノラルの配列として読む（話者分離の出力のWAVなど）
+    ファイルのサンプルレートがsrならsoundfileでそのまま読み（ffmpegの起動・リサンプルをしない）、
+    違う場合や読めない形式はdecode_audioでデコードする。どちらもチャンネル平均のfloat32
+    """
+    try:
+        if sf.info(path).samplerate == sr:
+            y, _ = sf.read(path, dtype='float32', always_2d=True)
+            return y.mean(axis=1) if y.shape[1] > 1 else y[:, 0]
+    except:
+        pass
+    return decode_audio(path, sr, mono=True)
+
+
+def count_audio_frames(path: str, sr: int) -> int:
+    """srでデコードした場合のサンプル数（ファイルのサンプルレートがsrならヘッダから求め、音声は読まない）"""
+    try:
+        info = sf.info(path)
+        if info.samplerate == sr:
+            return info.frames
+    except:
+        pass
+    return len(decode_audio(path, sr, mono=True))
+
+
+def iter_audio_blocks(path: str, sr: int, mono: bool = False,
+                      block_seconds: float = STREAM_BLOCK_SECONDS):
+    """
+    ffmpegで音声をデコードし、ブロックごとに返す（全体をメモリに載せない）
+
+    mono=Trueなら (samples,)、Falseなら (2, samples) のブロックを返す
+    """
+    proc = _open_pcm_pipe(path, sr)
+    block_bytes = max(1, int(block_seconds * sr)) * 8
+    finished = False
+    try:
+        while True:
+            data = proc.stdout.read(block_bytes)
+            if not data:
+                break
+            block = np.frombuffer(data[:len(data) - len(data) % 8], dtype=np.float32).reshape(-1, 2).T
+            yield block.mean(axis=0) if mono else block
+        finished = True
+    finally:
+        _close_pcm_pipe(proc, finished)
+
+
+def iter_segment_audio(blocks, sr: int, windows: list):
+    """
+    時間順のモノラルのブロックから、区間windows [(start_sec, end_sec), ...]（開始の早い順）の音声を
+    順に切り出して返す。保持するのは切り出し中の区間にかかるブロックだけで、音声全体は載せない
+    """
+    blocks = iter(blocks)
+    pieces = []
+    # piecesの先頭のサンプル位置と、保持しているサンプル数
+    buffer_start = 0
+    buffered = 0
+    for start_sec, end_sec in windows:
+        start = int(start_sec * sr)
+        end = int(end_sec * sr)
+        # 区間より前のブロックは捨てる
+        while pieces and buffer_start + len(pieces[0]) <= start:
+            buffer_start += len(pieces[0])
+            buffered -= len(pieces[0])
+            pieces.pop(0)
+        # 区間の終わりまで読む
+        while buffer_start + buffered < end:
+            block = next(blocks, None)
+            if block is None:
+                break
+            if not pieces and buffer_start + len(block) <= start:
+                buffer_start += len(block)
+                continue
+            pieces.append(block)
+            buffered += len(block)
+
+        parts = []
+        position = buffer_start
+        for piece in pieces:
+            lo, hi = max(start - position, 0), min(end - position, len(piece))
+            if lo < hi:
+                parts.append(piece[lo:hi])
+            position += len(piece)
+        if len(parts) == 1:
+            yield parts[0]
+        else:
+            yield np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+
+
+# 波形表示用ピークの解像度（1ビンあたりのサンプル数）。細かい順で、それぞれ前の整数倍にする
+PEAK_LEVELS = (256, 2048, 16384)
+
+
+def _reduce_peaks(peaks: np.ndarray, factor: int) -> np.ndarray:
+    """(bins, 2) の min/max ピークをfactorビンずつまとめる"""
+    n = len(peaks)
+    if n == 0:
+        return peaks
+    starts = np.arange(0, n, factor)
+    return np.stack([np.minimum.reduceat(peaks[:, 0], starts),
+                     np.maximum.reduceat(peaks[:, 1], starts)], axis=1)
+
+
+def build_waveform_peaks(audio_path: str, peaks_path: str, levels: tuple = PEAK_LEVELS) -> dict:
+    """
+    処理済み音声から波形表示用の min/max ピーク（解像度の異なる複数段）を作り、npzで保存する
+
+    音声はブロックごとに読み（全体をメモリに載せない）、最も細かい段だけを音声から求め、
+    粗い段はそれをまとめて作る。チャンネルはまとめて1本のピークにする。
+    値は int16（±32767 が ±1.0）
+
+    Returns:
+        {'sample_rate', 'frames', 'levels'}
+    """
+    finest = levels[0]
+    chunks = []
+    # ブロックの端数（finestに満たない分）は次のブロックへ持ち越す
+    carry_lo = carry_hi = np.zeros(0, dtype=np.float32)
+    frames = 0
+    info = sf.info(audio_path)
+    for block in sf.blocks(audio_path, blocksize=finest * 256, dtype='float32', always_2d=True):
+        frames += len(block)
+        lo = np.concatenate([carry_lo, block.min(axis=1)])
+        hi = np.concatenate([carry_hi, block.max(axis=1)])
+        n_full = len(lo) // finest * finest
+        if n_full:
+            chunks.append(np.stack([lo[:n_full].reshape(-1, finest).min(axis=1),
+                                    hi[:n_full].reshape(-1, finest).max(axis=1)], axis=1))
+        carry_lo, carry_hi = lo[n_full:], hi[n_full:]
+    if len(carry_lo):
+        chunks.append(np.array([[carry_lo.min(), carry_hi.max()]], dtype=np.float32))
+    peaks = np.concatenate(chunks) if chunks else np.zeros((0, 2), dtype=np.float32)
+
+    arrays = {}
+    for level in levels:
+        arrays[f'level_{level}'] = np.round(np.clip(_reduce_peaks(peaks, level // finest), -1.0, 1.0)
+                                            * 32767).astype(np.int16)
+    with open(peaks_path, 'wb') as f:
+        np.savez(f, sample_rate=info.samplerate, frames=frames, levels=np.array(levels), **arrays)
+    return {'sample_rate': info.samplerate, 'frames': frames, 'levels': list(levels)}
+
+
+def load_waveform_peaks(peaks_path: str, samples_per_bin: int = None, max_bins: int = 50000) -> dict:
+    """
+    build_waveform_peaksで保存したピークのうち1段を読む
+
+    samples_per_binを省略した場合は、ビン数がmax_bins以下になる最も細かい段を選ぶ。
+    保存されていない段を指定するとKeyError
+
+    Returns:
+        {'sample_rate', 'frames', 'samples_per_bin', 'levels', 'peaks': (bins, 2) int16}
+    """
+    with np.load(peaks_path) as data:
+        levels = [int(level) for level in data['levels']]
+        frames = int(data['frames'])
+        if samples_per_bin is None:
+            samples_per_bin = next((level for level in levels if -(-frames // level) <= max_bins), levels[-1])
+        if samples_per_bin not in levels:
+            raise KeyError(samples_per_bin)
+        return {
+            'sample_rate': int(data['sample_rate']),
+            'frames': frames,
+            'samples_per_bin': samples_per_bin,
+            'levels': levels,
+            'peaks': data[f'level_{samples_per_bin}']
+        }
+
+
+# 中間生成物キャッシュの上限サイズ（環境変数 VOICE_CHANGER_CACHE_MB で変更可）
+CACHE_MAX_BYTES = 10 * 1024 ** 3
+# キャッシュ形式・アルゴリズムを変えたら上げる（古いキャッシュは使われずLRUで消える）
+CACHE_VERSION = 1
+# 使用中の印（.in-use-<pid>）がこれより古ければ、異常終了したプロセスの残りとみなす
+CACHE_HOLD_MAX_SECONDS = 24 * 3600
+
+
+def _release_cache_holds(markers: set) -> None:
+    for marker in list(markers):
+        try:
+            os.remove(marker)
+        except OSError:
+            pass
+        markers.discard(marker)
+
+
+def _cache_hold_alive(marker: str) -> bool:
+    """使用中の印が有効か（書いたプロセスが生きていて、古すぎない）"""
+    try:
+        if time.time() - os.path.getmtime(marker) > CACHE_HOLD_MAX_SECONDS:
+            return False
+    except OSError:
+        return False
+    if os.name == 'posix':
+        try:
+            os.kill(int(marker.rsplit('-', 1)[1]), 0)
+        except ProcessLookupError:
+            return False
+        except (OSError, ValueError):
+            pass
+    return True
+
+
+class ArtifactCache:
+    """
+    中間生成物（デコード済みPCM、F0トラック、ina判定結果、話者分離結果）のディスクキャッシュ
+
+    キーは (入力ファイル内容のSHA-256, 処理段階名, その段階の結果に影響するパラメータ)。
+    ピッチ量や閾値だけを変えた再処理では、重い段階をキャッシュの読み込みで置き換える。
+    合計サイズがmax_bytesを超えたら、最後に使われてから時間が経ったものから削除する（LRU）。
+    読み込んだ・書き込んだエントリには使用中の印を置き、release()（またはこのオブジェクトの破棄）まで
+    削除しない（返したパスを処理の途中で消さないように。他のジョブのエントリも同様）
+
+    値の保存形式:
+        ndarray → value.npy、ndarrayを含むdict → value.npz、それ以外 → value.json、
+        ファイル群（store_files） → files/ にコピー
+    """
+
+    # ファイル内容のSHA-256の記録 {(パス, サイズ, 更新時刻): ダイジェスト}。同じ入力の再処理で読み直さない
+    _digests = {}
+
+    def __init__(self, root: str, input_path: str, max_bytes: int = None):
+        self.root = root
+        self.max_bytes = (max_bytes or int(os.environ.get('VOICE_CHANGER_CACHE_MB', 0)) * 1024 ** 2
+                          or CACHE_MAX_BYTES)
+        os.makedirs(root, exist_ok=True)
+        self.digest = self.file_digest(input_path)
+        self._holds = set()
+        self._finalizer = weakref.finalize(self, _release_cache_holds, self._holds)
+
+    @classmethod
+    def file_digest(cls, path: str) -> str:
+        """ファイル内容のSHA-256（16進）。サイズ・更新時刻が変わっていなければ前回の値を使う"""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        digest = cls._digests.get(key)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            digest = cls._digests[key] = h.hexdigest()
+        return digest
+
+    def _entry_dir(self, stage: str, params: dict) -> str:
+        key = json.dumps({'version': CACHE_VERSION, 'input': self.digest,
+                          'stage': stage, 'params': params or {}}, sort_keys=True)
+        return os.path.join(self.root, stage, hashlib.sha256(key.encode()).hexdigest())
+
+    def load(self, stage: str, params: dict = None):
+        """キャッシュを読み込む（なければNone）"""
+        entry = self._entry_dir(stage, params)
+        if not os.path.isdir(entry):
+            return None
+        try:
+            if os.path.exists(os.path.join(entry, 'value.npy')):
+                value = np.load(os.path.join(entry, 'value.npy'))
+            elif os.path.exists(os.path.join(entry, 'value.npz')):
+                with np.load(os.path.join(entry, 'value.npz')) as data:
+                    value = {k: (data[k].item() if data[k].ndim == 0 else data[k]) for k in data.files}
+            elif os.path.exists(os.path.join(entry, 'files.json')):
+                with open(os.path.join(entry, 'files.json'), encoding='utf-8') as f:
+                    value = [os.path.join(entry, 'files', name) for name in json.load(f)]
+            else:
+                with open(os.path.join(entry, 'value.json'), encoding='utf-8') as f:
+                    value = json.load(f)
+        except Exception:
+            # 壊れたエントリは使わない（次のstoreで作り直す）
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        # LRU用に最終使用時刻を更新
+        os.utime(entry)
+        self._hold(entry)
+        return value
+
+    def _hold(self, entry: str) -> None:
+        """エントリに使用中の印を置く（release()まで削除されない）"""
+        marker = os.path.join(entry, f'.in-use-{os.getpid()}')
+        try:
+            with open(marker, 'w'):
+                pass
+            self._holds.add(marker)
+        except OSError:
+            pass
+
+    def release(self) -> None:
+        """このオブジェクトが置いた使用中の印を外す"""
+        _release_cache_holds(self._holds)
+
+    def _commit(self, entry: str, write) -> None:
+        """一時ディレクトリに書き込んでから置き換える（途中のエントリを読ませない）"""
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=os.path.dirname(entry))
+        try:
+            write(tmp)
+            if os.path.isdir(entry):
+                # 同じキーを別のジョブが先に保存した（使用中かもしれないので置き換えない）
+                shutil.rmtree(tmp, ignore_errors=True)
+            else:
+                os.rename(tmp, entry)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        os.utime(entry)
+        self._hold(entry)
+        self.evict(keep=entry)
+
+    def store(self, stage: str, params: dict, value):
+        """値を保存して、そのまま返す"""
+        def write(tmp):
+            if isinstance(value, np.ndarray):
+                np.save(os.path.join(tmp, 'value.npy'), value)
+            elif isinstance(value, dict) and any(isinstance(v, np.ndarray) for v in value.values()):
+                np.savez(os.path.join(tmp, 'value.npz'), **value)
+            else:
+                with open(os.path.join(tmp, 'value.json'), 'w', encoding='utf-8') as f:
+                    json.dump(value, f)
+
+        self._commit(self._entry_dir(stage, params), write)
+        return value
+
+    def store_files(self, stage: str, params: dict, paths: list) -> list:
+        """ファイル群をコピーして保存し、キャッシュ内のパスのリストを返す"""
+        entry = self._entry_dir(stage, params)
+        names = [f"{i}_{os.path.basename(path)}" for i, path in enumerate(paths)]
+
+        def write(tmp):
+            os.makedirs(os.path.join(tmp, 'files'))
+            for path, name in zip(paths, names):
+                shutil.copy2(path, os.path.join(tmp, 'files', name))
+            with open(os.path.join(tmp, 'files.json'), 'w', encoding='utf-8') as f:
+                json.dump(names, f)
+
+        self._commit(entry, write)
+        return [os.path.join(entry, 'files', name) for name in names]
+
+    def evict(self, keep: str = None) -> None:
+        """
+        合計サイズが上限を超えていれば、古いエントリから削除する
+        keep（書き込んだばかりのエントリ）と使用中のエントリは削除しない（上限を超えたままでも）
+        """
+        entries = []
+        total = 0
+        for stage in os.listdir(self.root):
+            stage_dir = os.path.join(self.root, stage)
+            if not os.path.isdir(stage_dir):
+                continue
+            for name in os.listdir(stage_dir):
+                if name.startswith('.tmp-'):
+                    continue
+                path = os.path.join(stage_dir, name)
+                try:
+                    size = sum(os.path.getsize(os.path.join(d, f))
+                               for d, _, files in os.walk(path) for f in files)
+                    in_use = any(_cache_hold_alive(os.path.join(path, f))
+                                 for f in os.listdir(path) if f.startswith('.in-use-'))
+                    if path != keep and not in_use:
+                        entries.append((os.path.getmtime(path), size, path))
+                except OSError:
+                    continue
+                total += size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def run_cached(cache: ArtifactCache, stage: str, params: dict, compute, log=None, files: bool = False):
+    """
+    キャッシュがあれば読み込み、なければcompute()で計算して保存する
+
+    cacheがNoneなら常に計算する。files=Trueならcompute()はファイルパスのリストを返し、
+    戻り値はキャッシュ内のコピーのパスになる
+    """
+    if cache is None:
+        return compute()
+    value = cache.load(stage, params)
+    if value is not None:
+        if log:
+            log(f"キャッシュを使用: {stage}")
+        return value
+    value = compute()
+    if files:
+        return cache.store_files(stage, params, value) if value else value
+    return cache.store(stage, params, value)
+
+
+def f0_cache_params(engine: str, streaming: bool = False) -> dict:
+    """
+    F0トラックのキャッシュキー（44.1kHzのPCMを解析用サンプルレートに間引いて計算したもの）
+    ストリーミングはブロックごとに間引くため、全体を一度に間引いたトラックとは別のキーにする
+    """
+    params = {'engine': engine, 'source_sr': 44100, 'sr': ANALYSIS_SR, 'fmin': 50, 'fmax': 400,
+              'frame_length': ANALYSIS_FRAME_LENGTH, 'hop_length': ANALYSIS_HOP_LENGTH}
+    if streaming:
+        params['streaming'] = True
+    return params
+
+
+def ina_cache_params() -> dict:
+    """CNN判定結果のキャッシュキー（チャンクの長さと重なりで境界付近の判定が変わる）"""
+    return {'chunk_duration': INA_CHUNK_SECONDS, 'overlap': INA_CHUNK_OVERLAP}
+
+
+# ピッチ・特徴量解析用のサンプルレート
+# F0は最大400Hzなので44.1kHzで解析する必要はない。一度だけ間引いてから解析する
+ANALYSIS_SR = 16000
+# フレームは最低のF0（50Hz、周期20ms）の3周期以上を含む長さにする（44.1kHzの2048/512と同程度）
+ANALYSIS_FRAME_LENGTH = 1024  # 64ms
+ANALYSIS_HOP_LENGTH = 256     # 16ms
+
+
+def to_analysis_rate(y: np.ndarray, sr: int) -> np.ndarray:
+    """解析用サンプルレート（ANALYSIS_SR）に間引く（既に同じレートならそのまま）"""
+    import librosa
+    if sr == ANALYSIS_SR:
+        return y
+    return librosa.resample(y, orig_sr=sr, target_sr=ANALYSIS_SR).astype(np.float32)
+
+
+def iter_analysis_rate(blocks, sr: int, context_seconds: float = 0.1):
+    """
+    モノラルのブロック列を解析用サンプルレートに間引いて返す（ストリーミング用）
+
+    各ブロックは前後にcontext_seconds秒の文脈を付けてリサンプルしてから切り出すので、
+    つなぎ目でフィルタが途切れず、全体をto_analysis_rateしたものとほぼ同じになる
+    """
+    import librosa
+    if sr == ANALYSIS_SR:
+        yield from blocks
+        return
+
+    from math import gcd
+    g = gcd(sr, ANALYSIS_SR)
+    up, down = ANALYSIS_SR // g, sr // g
+    # 入力・出力のサンプル位置がずれないよう、区切りはdownの倍数にする
+    context = int(np.ceil(context_seconds * sr / down)) * down
+
+    left = np.zeros(0, dtype=np.float32)
+    pending = np.zeros(0, dtype=np.float32)
+    for block in blocks:
+        pending = np.concatenate([pending, np.asarray(block, dtype=np.float32)])
+        usable = (len(pending) - context) // down * down
+        if usable <= 0:
+            continue
+        segment = np.concatenate([left, pending[:usable + context]])
+        out = librosa.resample(segment, orig_sr=sr, target_sr=ANALYSIS_SR)
+        start = len(left) // down * up
+        yield out[start:start + usable // down * up].astype(np.float32)
+        left = np.concatenate([left, pending[:usable]])[-context:]
+        pending = pending[usable:]
+
+    segment = np.concatenate([left, pending])
+    if len(pending) > 0:
+        out = librosa.resample(segment, orig_sr=sr, target_sr=ANALYSIS_SR)
+        yield out[len(left) // down * up:].astype(np.float32)
+
+
+def estimate_pitch_for_segment(y: np.ndarray, sr: int, engine: str = 'pyin') -> float:
+    """セグメントの平均ピッチを推定する（解析用サンプルレートで実行）"""
     if len(y) < sr * 0.05:  # 50ms未満は無視
         return 0
 
     try:
-        f0, voiced_flag, voiced_probs = librosa.pyin(
-            y,
-            fmin=50,
-            fmax=400,
-            sr=sr,
-            frame_length=1024,  # より細かく
-            hop_length=256
-        )
+        y = to_analysis_rate(y, sr)
+        f0 = compute_f0_track(y, ANALYSIS_SR, engine=engine)['f0']
         valid_f0 = f0[~np.isnan(f0)]
         if len(valid_f0) > 0:
             return np.median(valid_f0)
@@ -1618,11 +2681,442 @@ def estimate_pitch_for_segment(y: np.ndarray, sr: int) -> float:
     return 0
 
 
+# F0トラックを計算するブロックのフレーム数（長い音声でもメモリを抑えるため分割して計算）
+F0_TRACK_BLOCK_FRAMES = 4096
+
+
+def _padded_frame_block(y: np.ndarray, frame_start: int, frame_end: int,
+                        frame_length: int, hop_length: int) -> np.ndarray:
+    """
+    center=True相当（前後をframe_length//2だけゼロ埋め）にした信号から
+    フレーム[frame_start, frame_end)に必要な範囲だけを切り出す
+    全体をパディングしたコピーは作らない
+    """
+    pad = frame_length // 2
+    block_start = frame_start * hop_length - pad
+    block_end = (frame_end - 1) * hop_length + frame_length - pad
+
+    src_start = max(block_start, 0)
+    src_end = min(block_end, len(y))
+    block = y[src_start:src_end]
+
+    pad_left = src_start - block_start
+    pad_right = block_end - src_end
+    if pad_left > 0 or pad_right > 0:
+        block = np.pad(block, (pad_left, pad_right))
+    return block
+
+
+def _f0_block_pyin(block: np.ndarray, sr: int, fmin: float, fmax: float,
+                   frame_length: int, hop_length: int) -> tuple:
+    """pYIN（Viterbi復号あり、高精度・低速）でブロックのF0を推定する"""
+    import librosa
+    f0, voiced, _ = librosa.pyin(
+        block,
+        fmin=fmin,
+        fmax=fmax,
+        sr=sr,
+        frame_length=frame_length,
+        hop_length=hop_length,
+        center=False
+    )
+    return f0, voiced
+
+
+# 高速YINの閾値（累積平均正規化差分関数の谷の深さ）
+# 閾値（YIN_THRESHOLDか、ノイズで谷が浅い場合は最深の谷+YIN_THRESHOLD_MARGIN）を
+# 下回る最初の谷を周期とする（オクターブ下の誤検出を防ぐ）
+# 周期の谷がYIN_VOICING_MAXより浅いフレームは無声扱い
+YIN_THRESHOLD = 0.15
+YIN_THRESHOLD_MARGIN = 0.1
+YIN_VOICING_MAX = 0.4
+# これ未満のRMSのフレームは無声扱い
+YIN_SILENCE_RMS = 1e-3
+
+
+def _f0_block_yin(block: np.ndarray, sr: int, fmin: float, fmax: float,
+                  frame_length: int, hop_length: int) -> tuple:
+    """
+    完全ベクトル化したYINでブロックのF0を推定する（高速）
+
+    ブロック全体をストライドでフレーム行列にし、差分関数をFFTの相互相関で
+    全フレーム同時に計算する。Viterbi復号は行わない（セグメントの中央値しか使わないため）
+    """
+    import librosa
+    frames = librosa.util.frame(block, frame_length=frame_length, hop_length=hop_length, axis=0)
+    frames = frames.astype(np.float64)
+
+    min_period = max(int(np.floor(sr / fmax)), 1)
+    max_period = min(int(np.ceil(sr / fmin)), frame_length - 2)
+    window = frame_length - max_period
+
+    # 差分関数 d(tau) = E(0) + E(tau) - 2 r(tau) を全フレーム同時に計算
+    n_fft = 1 << int(np.ceil(np.log2(frame_length + window)))
+    spec_full = np.fft.rfft(frames, n_fft, axis=1)
+    spec_head = np.fft.rfft(frames[:, :window], n_fft, axis=1)
+    r = np.fft.irfft(spec_full * np.conj(spec_head), n_fft, axis=1)[:, :max_period + 1]
+
+    energy_cumsum = np.concatenate(
+        [np.zeros((frames.shape[0], 1)), np.cumsum(frames ** 2, axis=1)], axis=1
+    )
+    taus = np.arange(max_period + 1)
+    energy_head = energy_cumsum[:, window:window + 1]
+    energy_lag = energy_cumsum[:, taus + window] - energy_cumsum[:, taus]
+    diff = np.maximum(energy_head + energy_lag - 2 * r, 0)
+    diff[:, 0] = 0
+
+    # 累積平均正規化差分関数
+    cumulative = np.cumsum(diff[:, 1:], axis=1)
+    cmndf = np.ones_like(diff)
+    cmndf[:, 1:] = diff[:, 1:] * taus[1:] / np.maximum(cumulative, 1e-12)
+
+    # 探索範囲内で、閾値を下回る最初の極小値を周期とする（なければ最小値）
+    search = cmndf[:, min_period:max_period]
+    is_local_min = search < cmndf[:, min_period + 1:max_period + 1]
+    threshold = np.maximum(YIN_THRESHOLD, search.min(axis=1, keepdims=True) + YIN_THRESHOLD_MARGIN)
+    candidates = (search < threshold) & is_local_min
+    has_candidate = candidates.any(axis=1)
+    period = np.where(
+        has_candidate,
+        np.argmax(candidates, axis=1),
+        np.argmin(search, axis=1)
+    ) + min_period
+
+    # 放物線補間で周期を細かく推定
+    rows = np.arange(frames.shape[0])
+    prev_val = cmndf[rows, period - 1]
+    cur_val = cmndf[rows, period]
+    next_val = cmndf[rows, np.minimum(period + 1, max_period)]
+    denom = prev_val - 2 * cur_val + next_val
+    shift = np.where(np.abs(denom) > 1e-12, (prev_val - next_val) / (2 * denom + 1e-24), 0)
+    shift = np.clip(shift, -1, 1)
+
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    voiced = (cur_val < YIN_VOICING_MAX) & (rms > YIN_SILENCE_RMS)
+    f0 = np.where(voiced, sr / (period + shift), np.nan)
+    return f0, voiced
+
+
+# ピッチ推定エンジン
+#   'pyin' - librosa.pyin（既定。高精度）
+#   'yin'  - ベクトル化YIN（高速。セグメント中央値の判定用）
+PITCH_ENGINES = {
+    'pyin': _f0_block_pyin,
+    'yin': _f0_block_yin,
+}
+
+
+def resolve_analysis_workers(workers: int = None) -> int:
+    """
+    解析用ワーカープロセス数を決める
+    None/0の場合は環境変数 VOICE_CHANGER_WORKERS、なければCPUコア数を使う
+    """
+    if not workers:
+        workers = int(os.environ.get('VOICE_CHANGER_WORKERS', 0)) or os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def _f0_track_block(y: np.ndarray, block_index: int, n_frames: int, sr: int, engine: str,
+                    fmin: float, fmax: float, frame_length: int, hop_length: int):
+    """F0トラックの1ブロック分を計算する（失敗時はNone）"""
+    frame_start = block_index * F0_TRACK_BLOCK_FRAMES
+    frame_end = min(frame_start + F0_TRACK_BLOCK_FRAMES, n_frames)
+    block = _padded_frame_block(y, frame_start, frame_end, frame_length, hop_length)
+
+    try:
+        block_f0, block_voiced = PITCH_ENGINES[engine](block, sr, fmin, fmax, frame_length, hop_length)
+        return block_f0[:frame_end - frame_start], block_voiced[:frame_end - frame_start]
+    except:
+        return None
+
+
+def _f0_track_block_shared(shm_name: str, length: int, block_index: int, n_frames: int, sr: int,
+                           engine: str, fmin: float, fmax: float, frame_length: int, hop_length: int):
+    """ワーカープロセス用: 共有メモリ上の音声から1ブロック分を計算する（音声はpickleしない）"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        y = np.ndarray((length,), dtype=np.float32, buffer=shm.buf)
+        result = _f0_track_block(y, block_index, n_frames, sr, engine,
+                                 fmin, fmax, frame_length, hop_length)
+        del y
+        return result
+    finally:
+        shm.close()
+
+
+def compute_f0_track(
+    y: np.ndarray,
+    sr: int,
+    fmin: float = 50,
+    fmax: float = 400,
+    frame_length: int = ANALYSIS_FRAME_LENGTH,
+    hop_length: int = ANALYSIS_HOP_LENGTH,
+    progress_callback=None,
+    engine: str = 'pyin',
+    workers: int = 1
+) -> dict:
+    """
+    音声全体のフレーム単位F0トラックを1回だけ計算する
+
+    セグメントごとにpyinを呼ぶ代わりに、全体を一度だけ解析して
+    各セグメントのピッチはフレームのスライスで取り出す（pitch_from_track）
+
+    Args:
+        y: モノラル音声（通常はto_analysis_rateで間引いたもの）
+        sr: yのサンプルレート
+        progress_callback: 進捗用コールバック (完了ブロック数, 全ブロック数)
+        engine: ピッチ推定エンジン（PITCH_ENGINESのキー）
+        workers: ワーカープロセス数。2以上なら連続するブロックをプロセスプールで並列計算する
+                 （音声は共有メモリで渡す。ブロック分割は直列と同じなので結果も同一）
+
+    Returns:
+        {'f0': ndarray, 'voiced': ndarray, 'sr': int, 'hop_length': int}
+        f0は無声フレームがNaN。フレームiの中心はサンプル i * hop_length
+    """
+    if engine not in PITCH_ENGINES:
+        raise ValueError(f"不明なピッチ推定エンジン: {engine}")
+
+    # 直列・並列で同じ結果になるようfloat32に揃える
+    y = np.ascontiguousarray(y, dtype=np.float32)
+
+    n_frames = 1 + len(y) // hop_length
+    f0 = np.full(n_frames, np.nan, dtype=np.float32)
+    voiced = np.zeros(n_frames, dtype=bool)
+
+    num_blocks = int(np.ceil(n_frames / F0_TRACK_BLOCK_FRAMES))
+    block_args = (n_frames, sr, engine, fmin, fmax, frame_length, hop_length)
+
+    def store(block_index, result):
+        if result is not None:
+            frame_start = block_index * F0_TRACK_BLOCK_FRAMES
+            block_f0, block_voiced = result
+            f0[frame_start:frame_start + len(block_f0)] = block_f0
+            voiced[frame_start:frame_start + len(block_voiced)] = block_voiced
+        if progress_callback:
+            progress_callback(block_index + 1, num_blocks)
+
+    workers = min(workers, num_blocks)
+    if workers <= 1:
+        for b in range(num_blocks):
+            store(b, _f0_track_block(y, b, *block_args))
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=max(y.nbytes, 1))
+        try:
+            np.ndarray(y.shape, dtype=np.float32, buffer=shm.buf)[:] = y
+            # spawnで起動（Webサーバーのスレッドからforkしないため）
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                # 連続するブロックをまとめて各ワーカーに割り当てる
+                chunksize = max(1, num_blocks // (workers * 4))
+                results = executor.map(
+                    _f0_track_block_shared,
+                    [shm.name] * num_blocks,
+                    [len(y)] * num_blocks,
+                    range(num_blocks),
+                    *[[arg] * num_blocks for arg in block_args],
+                    chunksize=chunksize
+                )
+                for b, result in enumerate(results):
+                    store(b, result)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    return {
+        'f0': f0,
+        'voiced': voiced,
+        'sr': sr,
+        'hop_length': hop_length
+    }
+
+
+def _f0_stream_block(block: np.ndarray, n: int, sr: int, engine: str,
+                     fmin: float, fmax: float, frame_length: int, hop_length: int):
+    """ストリーミング用: ゼロ埋め済みの1ブロックから先頭nフレーム分のF0を計算する（失敗時は無声）"""
+    try:
+        block_f0, block_voiced = PITCH_ENGINES[engine](block, sr, fmin, fmax, frame_length, hop_length)
+        return np.asarray(block_f0[:n], dtype=np.float32), np.asarray(block_voiced[:n], dtype=bool)
+    except:
+        return np.full(n, np.nan, dtype=np.float32), np.zeros(n, dtype=bool)
+
+
+def compute_f0_track_stream(
+    blocks,
+    sr: int,
+    fmin: float = 50,
+    fmax: float = 400,
+    frame_length: int = ANALYSIS_FRAME_LENGTH,
+    hop_length: int = ANALYSIS_HOP_LENGTH,
+    progress_callback=None,
+    engine: str = 'pyin',
+    workers: int = 1
+) -> dict:
+    """
+    ブロックごとに渡される音声からF0トラックを計算する（ストリーミング用）
+
+    compute_f0_trackと同じブロック分割・ゼロ埋めで計算するので結果も同じ。
+    保持する音声は計算中のブロック分だけなので、音声の長さによらずメモリ使用量は一定
+
+    Args:
+        blocks: モノラル音声ブロックのイテラブル（iter_audio_blocksなど）
+        progress_callback: 進捗用コールバック (解析済みの秒数)
+        workers: ワーカープロセス数。2以上ならブロックをプロセスプールで並列計算する
+                 （同時に渡すブロックはworkers*2個まで。結果は直列と同一）
+
+    Returns:
+        compute_f0_trackと同じ形式
+    """
+    if engine not in PITCH_ENGINES:
+        raise ValueError(f"不明なピッチ推定エンジン: {engine}")
+
+    pad = frame_length // 2
+    step = F0_TRACK_BLOCK_FRAMES * hop_length
+    need = (F0_TRACK_BLOCK_FRAMES - 1) * hop_length + frame_length
+    block_args = (sr, engine, fmin, fmax, frame_length, hop_length)
+
+    f0_parts = []
+    voiced_parts = []
+    pending = []
+    submitted = 0
+
+    def store(result):
+        block_f0, block_voiced = result
+        f0_parts.append(block_f0)
+        voiced_parts.append(block_voiced)
+        if progress_callback:
+            progress_callback(sum(len(p) for p in f0_parts) * hop_length / sr)
+
+    executor = None
+    if workers > 1:
+        # spawnで起動（Webサーバーのスレッドからforkしないため）
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def run(block, n):
+        nonlocal submitted
+        submitted += 1
+        if executor is None:
+            store(_f0_stream_block(block, n, *block_args))
+            return
+        pending.append(executor.submit(_f0_stream_block, block, n, *block_args))
+        # デコード済みのブロックを溜め込みすぎない
+        while len(pending) > workers * 2:
+            store(pending.pop(0).result())
+
+    try:
+        # center=True相当の先頭ゼロ埋め
+        buffer = np.zeros(pad, dtype=np.float32)
+        total = 0
+        for block in blocks:
+            block = np.asarray(block, dtype=np.float32)
+            buffer = np.concatenate([buffer, block])
+            total += len(block)
+            while len(buffer) >= need:
+                run(buffer[:need], F0_TRACK_BLOCK_FRAMES)
+                buffer = buffer[step:]
+
+        # 残りのフレーム（末尾はゼロ埋め）
+        n_frames = 1 + total // hop_length
+        remaining = n_frames - F0_TRACK_BLOCK_FRAMES * submitted
+        if remaining > 0:
+            length = (remaining - 1) * hop_length + frame_length
+            tail = buffer[:length]
+            if len(tail) < length:
+                tail = np.pad(tail, (0, length - len(tail)))
+            run(tail, remaining)
+        for future in pending:
+            store(future.result())
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    return {
+        'f0': np.concatenate(f0_parts) if f0_parts else np.zeros(0, dtype=np.float32),
+        'voiced': np.concatenate(voiced_parts) if voiced_parts else np.zeros(0, dtype=bool),
+        'sr': sr,
+        'hop_length': hop_length
+    }
+
+
+def pitch_from_track(track: dict, start: int, end: int, sr: int = None) -> float:
+    """
+    F0トラックから区間[start, end)のピッチ中央値を取り出す
+    estimate_pitch_for_segmentと同じく、有声フレームがなければ0を返す
+
+    Args:
+        start, end: 区間（srのサンプル単位。44.1kHzの再生用サンプル位置をそのまま渡せる）
+        sr: start/endのサンプルレート（省略時はトラックのサンプルレート）
+    """
+    sr = sr or track['sr']
+    if end - start < sr * 0.05:  # 50ms未満は無視
+        return 0
+
+    # サンプル位置をトラックのフレーム番号に変換（中心が区間内にあるフレームを対象にする）
+    samples_per_frame = track['hop_length'] * sr / track['sr']
+    frame_start = int(np.ceil(start / samples_per_frame))
+    frame_end = int(np.ceil(end / samples_per_frame))
+    f0 = track['f0'][frame_start:frame_end]
+
+    valid_f0 = f0[~np.isnan(f0)]
+    if len(valid_f0) > 0:
+        return float(np.median(valid_f0))
+
+    return 0
+
+
+def compare_pitch_engines(
+    y: np.ndarray,
+    sr: int,
+    engine: str = 'yin',
+    reference: str = 'pyin',
+    segment_duration: float = 0.5,
+    male_threshold: float = 165
+) -> dict:
+    """
+    高速エンジンとpYINのセグメント判定の一致度を調べる（検証用）
+
+    Returns:
+        {'segments': int,          # どちらかで有声だったセグメント数
+         'agreement': float,       # is_male_voiceの判定が一致した割合
+         'median_cents': float}    # 両方有声のセグメントのピッチ差（セント）の中央値
+    """
+    y = to_analysis_rate(y, sr)
+    track = compute_f0_track(y, ANALYSIS_SR, engine=engine)
+    reference_track = compute_f0_track(y, ANALYSIS_SR, engine=reference)
+
+    segment_samples = int(segment_duration * ANALYSIS_SR)
+    segments = 0
+    agreed = 0
+    cents = []
+    for start in range(0, len(y), segment_samples):
+        end = min(start + segment_samples, len(y))
+        pitch = pitch_from_track(track, start, end)
+        reference_pitch = pitch_from_track(reference_track, start, end)
+        if pitch == 0 and reference_pitch == 0:
+            continue
+
+        segments += 1
+        if is_male_voice(pitch, male_threshold) == is_male_voice(reference_pitch, male_threshold):
+            agreed += 1
+        if pitch > 0 and reference_pitch > 0:
+            cents.append(abs(1200 * np.log2(pitch / reference_pitch)))
+
+    return {
+        'segments': segments,
+        'agreement': agreed / segments if segments else 1.0,
+        'median_cents': float(np.median(cents)) if cents else 0.0
+    }
+
+
 def estimate_pitch_for_speaker(y: np.ndarray, sr: int, num_samples: int = 20) -> float:
     """
     話者の音声全体からピッチを推定する（長い音声ファイル用）
     有声部分を検出し、複数箇所からサンプリングして中央値を取る
     """
+    import librosa
+    # 解析用サンプルレートに一度だけ間引く
+    y = to_analysis_rate(y, sr)
+    sr = ANALYSIS_SR
+
     if len(y) < sr * 0.5:  # 0.5秒未満は通常の関数を使用
         return estimate_pitch_for_segment(y, sr)
 
@@ -1715,14 +3209,20 @@ def calculate_local_threshold(pitches: list, base_threshold: float = 165) -> flo
 
 
 def pitch_shift_audio(y: np.ndarray, sr: int, semitones: float) -> np.ndarray:
-    """音声のピッチをシフトする"""
+    """
+    音声のピッチをシフトする
+
+    y は (samples,) または (channels, samples)。
+    多チャンネルは1回のSTFT/位相ボコーダー/リサンプルで全チャンネルまとめて処理する
+    """
+    import librosa
     if semitones == 0:
         return y
 
     try:
-        original_rms = np.sqrt(np.mean(y**2)) if len(y) > 0 else 0
+        original_rms = np.sqrt(np.mean(y**2)) if y.size > 0 else 0
         result = librosa.effects.pitch_shift(y, sr=sr, n_steps=semitones)
-        result_rms = np.sqrt(np.mean(result**2)) if len(result) > 0 else 0
+        result_rms = np.sqrt(np.mean(result**2)) if result.size > 0 else 0
 
         # デバッグ: ピッチシフトが実際に適用されたか確認
         if abs(original_rms - result_rms) < 0.0001 and original_rms > 0.01:
@@ -1734,6 +3234,388 @@ def pitch_shift_audio(y: np.ndarray, sr: int, semitones: float) -> np.ndarray:
         return y  # エラー時は元の音声を返す
 
 
+# 区間プレビューで前後に付ける文脈（秒）。ピッチシフトの窓の立ち上がりを区間の外に逃がす
+PREVIEW_CONTEXT_SECONDS = 0.25
+# 区間プレビューの最大長（秒）
+PREVIEW_MAX_SECONDS = 30.0
+# 区間プレビューのサンプルレート
+PREVIEW_SAMPLE_RATE = 44100
+
+
+def read_audio_slice(path: str, start: float, end: float, sr: int = 44100) -> np.ndarray:
+    """
+    音声の一部だけを (2, samples) で読む
+    同じサンプルレートのWAV等はシークして読み、それ以外（動画など）はffmpegで該当区間だけデコードする
+    """
+    try:
+        info = sf.info(path)
+    except Exception:
+        info = None
+    if info is not None and info.samplerate == sr:
+        y, _ = sf.read(path, start=int(start * sr), stop=int(end * sr), dtype='float32', always_2d=True)
+        y = y.T
+        if y.shape[0] == 1:
+            y = np.repeat(y, 2, axis=0)
+        return y[:2]
+    return decode_audio(path, sr, start=start, duration=end - start)
+
+
+def render_region_preview(audio_path: str, start: float, end: float, semitones: float,
+                          sr: int = PREVIEW_SAMPLE_RATE, context: float = PREVIEW_CONTEXT_SECONDS) -> np.ndarray:
+    """
+    指定区間だけをピッチシフトして (2, samples) で返す（区間の試聴用）
+    前後に文脈を付けて読み、適用時（apply_region_edits・pitch_shift_region）と同じ
+    render_pitch_curveで区間だけをシフトしてから区間分を切り出す（試聴と適用結果が同じ音になるように）
+    負の開始位置は0に詰める。区間が音声の末尾より後ならValueError
+    """
+    start = max(0.0, start)
+    end = min(end, start + PREVIEW_MAX_SECONDS)
+    if end <= start:
+        raise ValueError("区間の指定が不正です")
+    read_start = max(0.0, start - context)
+    y = read_audio_slice(audio_path, read_start, end + context, sr)
+    offset = int(round((start - read_start) * sr))
+    if offset >= y.shape[1]:
+        raise ValueError("区間が音声の長さを超えています")
+    length = int(round((end - start) * sr))
+    curve = build_semitone_curve([(offset, offset + length, semitones)], y.shape[1])
+    shifted = render_pitch_curve(y, curve)
+    return np.clip(shifted[:, offset:offset + length], -1.0, 1.0)
+
+
+# 時間変化ピッチシフトのSTFT設定（44.1kHzで約46ms窓・75%オーバーラップ）
+RENDER_N_FFT = 2048
+RENDER_HOP_LENGTH = 512
+# 1回にまとめて処理するフレーム数
+RENDER_BATCH_FRAMES = 256
+
+
+def build_semitone_curve(regions: list, n_samples: int,
+                         hop_length: int = RENDER_HOP_LENGTH) -> np.ndarray:
+    """
+    区間リストからフレーム単位の半音カーブを作る（未処理フレームは0）
+
+    regions: [(start_sample, end_sample, semitones), ...]  サンプル単位。後の区間が優先
+    フレームtの中心はサンプル t * hop_length（librosaのcenter=Trueと同じ）
+    """
+    curve = np.zeros(1 + n_samples // hop_length, dtype=np.float32)
+    for start, end, semitones in regions:
+        first = max(0, int(np.ceil(start / hop_length)))
+        last = min(len(curve), int(np.ceil(end / hop_length)))
+        if last > first:
+            curve[first:last] = semitones
+    return curve
+
+
+class PitchCurveRenderer:
+    """
+    フレーム単位の半音カーブに従って、信号全体を1回のSTFTパスでピッチシフトするレンダラー
+
+    区間ごとの切り出し・長さ調整・クロスフェードは不要で、区間の境界は窓の重なりで自然につながる。
+    各フレームでスペクトルピークの周波数を 2^(半音/12) 倍に移し（ピーク周辺はローブごと移動）、
+    位相はピークの瞬時周波数で積算する（位相ロック型の位相ボコーダー）。
+    カーブが0のフレームはFFTを省略し、シフトの影響を受けないサンプルは入力をそのまま返す。
+
+    process()に先頭から順にブロックを渡すとストリーミングで処理でき、
+    確定した出力サンプルを返す。最後にflush()で残りを取り出す。
+    """
+
+    def __init__(self, semitone_curve: np.ndarray, channels: int = 1,
+                 n_fft: int = RENDER_N_FFT, hop_length: int = RENDER_HOP_LENGTH):
+        import librosa
+        if n_fft % hop_length != 0:
+            raise ValueError("n_fftはhop_lengthの整数倍にしてください")
+
+        self.curve = np.asarray(semitone_curve, dtype=np.float32)
+        self.channels = channels
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.pad = n_fft // 2
+        self.overlap = n_fft // hop_length
+        self.window = librosa.filters.get_window('hann', n_fft, fftbins=True).astype(np.float32)
+        self.window_sq = self.window ** 2
+        n_bins = n_fft // 2 + 1
+        # 1ホップあたりの各ビンの位相進み
+        self.omega = (2 * np.pi * hop_length * np.arange(n_bins) / n_fft)[:, None].astype(np.float32)
+        # 窓の中心を位相の基準にする（ローブ内のビンがほぼ同じ位相になり、ビンを写しても打ち消し合わない）
+        self.center_sign = np.where(np.arange(n_bins) % 2 == 0, 1, -1)[:, None].astype(np.float32)
+
+        # 入力バッファ（center用の先頭パディング込みの座標系）
+        self._x = np.zeros((channels, self.pad), dtype=np.float32)
+        self._x_start = 0
+        self._next_frame = 0
+        # 出力の重ね合わせバッファ（_x_startと同じ座標から始まる）
+        self._ola = np.zeros((channels, 0), dtype=np.float32)
+        self._norm = np.zeros(0, dtype=np.float32)
+        self._touched = np.zeros(0, dtype=bool)
+        self._emitted = self.pad
+        self._n_input = 0
+        # 直前フレームの元の位相と出力位相
+        self._prev_phase = None
+        self._acc_phase = None
+
+    def _shift_at(self, frames: np.ndarray) -> np.ndarray:
+        """フレーム番号の半音値（カーブ外は0）"""
+        shifts = np.zeros(len(frames), dtype=np.float32)
+        inside = (frames >= 0) & (frames < len(self.curve))
+        shifts[inside] = self.curve[frames[inside]]
+        return shifts
+
+    def _ensure_output(self, end: int) -> None:
+        """重ね合わせバッファを座標endまで伸ばす"""
+        need = end - self._x_start - self._norm.shape[0]
+        if need > 0:
+            self._ola = np.concatenate([self._ola, np.zeros((self.channels, need), dtype=np.float32)], axis=1)
+            self._norm = np.concatenate([self._norm, np.zeros(need, dtype=np.float32)])
+            self._touched = np.concatenate([self._touched, np.zeros(need, dtype=bool)])
+
+    def _render_shifted(self, frames: np.ndarray, idx: np.ndarray, shifts: np.ndarray,
+                        shifted: np.ndarray, contrib: np.ndarray) -> None:
+        """FFTが必要なフレーム（シフトフレームとその直前）を処理してcontribに書き込む"""
+        from scipy import fft as sp_fft  # float32のままFFTできる
+
+        n_fft = self.n_fft
+        n_frames = len(shifts)
+        spec = sp_fft.rfft(frames[:, :, idx] * self.window[:, None], axis=1) * self.center_sign
+        phase = np.angle(spec)
+
+        # シフトフレームの直前フレームの元の位相（バッチ先頭はキャリー、なければ自身）
+        if self._prev_phase is not None and idx[0] == 0:
+            first_prev = self._prev_phase
+        else:
+            first_prev = phase[:, :, 0]
+        prev_phase = np.concatenate([first_prev[:, :, None], phase[:, :, :-1]], axis=2)
+
+        sidx = np.flatnonzero(shifted[idx])
+        if len(sidx) > 0:
+            mag = np.abs(spec[:, :, sidx])
+            cur = phase[:, :, sidx]
+            prev = prev_phase[:, :, sidx]
+            n_bins = mag.shape[1]
+            bins = np.arange(n_bins, dtype=np.int32)[None, :, None]
+
+            # 瞬時周波数（1ホップあたりの位相進み）
+            dphi = cur - prev - self.omega
+            dphi -= np.float32(2 * np.pi) * np.round(dphi / np.float32(2 * np.pi))
+            inst = self.omega + dphi
+
+            # 各出力ビンを受け持つスペクトルピークを決める
+            # （入力ビン j/ratio に最も近いピーク。ピークの間は中点で分ける）
+            ratio = (2.0 ** (shifts[idx[sidx]] / 12.0)).astype(np.float32)
+            is_peak = np.zeros(mag.shape, dtype=bool)
+            is_peak[:, 1:-1] = (mag[:, 1:-1] > mag[:, :-2]) & (mag[:, 1:-1] >= mag[:, 2:])
+            below = np.maximum.accumulate(np.where(is_peak, bins, -n_bins), axis=1)
+            above = np.minimum.accumulate(np.where(is_peak, bins, 2 * n_bins)[:, ::-1], axis=1)[:, ::-1]
+            nearest_peak = np.where(bins - below <= above - bins, below, above)
+            nearest_peak = np.where((nearest_peak < 0) | (nearest_peak >= n_bins), bins, nearest_peak)
+            stretched = np.minimum(np.round(np.arange(n_bins, dtype=np.float32)[:, None]
+                                            / ratio[None, :]).astype(np.int64), n_bins - 1)
+            owner = np.take_along_axis(nearest_peak, np.broadcast_to(stretched, mag.shape), 1)
+
+            # ピーク周辺はローブごと (ratio-1)*ピーク周波数 だけずらす
+            # （単純な伸縮と違いローブ形状が保たれ、振幅が痩せない）
+            owner_inst = np.take_along_axis(inst, owner, 1)
+            owner_freq = owner_inst * np.float32(self.n_fft / (2 * np.pi * self.hop_length))
+            src_bin = bins - (ratio - 1) * owner_freq
+            valid = (src_bin >= 0) & (src_bin <= n_bins - 1)
+            src_bin = np.clip(src_bin, 0, n_bins - 1)
+            i0 = np.minimum(src_bin.astype(np.int64), n_bins - 1)
+            i1 = np.minimum(i0 + 1, n_bins - 1)
+            frac = src_bin - i0
+            mag_out = np.where(valid, np.take_along_axis(mag, i0, 1) * (1 - frac)
+                               + np.take_along_axis(mag, i1, 1) * frac, 0)
+
+            # 位相ロック: 領域内のビンはピークと同じだけ位相を進め、ピークとの位相差は入力のまま保つ
+            nearest_src = np.round(src_bin).astype(np.int64)
+            peak_out = np.clip(np.round(owner + (ratio - 1) * owner_freq).astype(np.int64), 0, n_bins - 1)
+            advance = ratio * owner_inst
+            offset = np.take_along_axis(cur, nearest_src, 1) - np.take_along_axis(cur, owner, 1)
+            start_phase = np.take_along_axis(prev, nearest_src, 1)
+
+            # シフト区間の先頭は直前フレームの写像元ビンの位相から始める
+            frame_pos = idx[sidx]
+            continued = np.concatenate([[self._acc_phase is not None and frame_pos[0] == 0],
+                                        np.diff(frame_pos) == 1])
+            out_phase = np.empty((len(sidx),) + mag_out.shape[:2], dtype=np.float32)
+            flat_peak = np.moveaxis(peak_out + np.arange(self.channels)[:, None, None] * n_bins, 2, 0)
+            step = np.moveaxis(advance + offset, 2, 0)
+            start_phase = np.moveaxis(start_phase, 2, 0)
+            last = self._acc_phase
+            for p in range(len(sidx)):
+                if not continued[p]:
+                    last = start_phase[p]
+                last = np.take(last, flat_peak[p]) + step[p]
+                out_phase[p] = last
+
+            out_phase = np.moveaxis(out_phase, 0, 2)
+            out_spec = np.empty(mag_out.shape, dtype=np.complex64)
+            out_spec.real = mag_out * np.cos(out_phase) * self.center_sign
+            out_spec.imag = mag_out * np.sin(out_phase) * self.center_sign
+            out = sp_fft.irfft(out_spec, n=n_fft, axis=1)
+            contrib[:, :, frame_pos] = out * self.window[:, None]
+            self._acc_phase = last if frame_pos[-1] == n_frames - 1 else None
+        else:
+            self._acc_phase = None
+        self._prev_phase = phase[:, :, -1] if idx[-1] == n_frames - 1 else None
+
+    def _render_frames(self, t_a: int, t_b: int) -> None:
+        """フレーム[t_a, t_b)を処理して重ね合わせバッファに加算する"""
+        n_fft, hop = self.n_fft, self.hop_length
+        frame_ids = np.arange(t_a, t_b)
+        shifts = self._shift_at(frame_ids)
+        shifted = shifts != 0
+
+        # シフトフレームと重なるフレーム（±overlap-1）は時間領域で加算する必要がある
+        k = self.overlap - 1
+        near = np.zeros(len(frame_ids), dtype=bool)
+        around = self._shift_at(np.arange(t_a - k, t_b + k)) != 0
+        for d in range(2 * k + 1):
+            near |= around[d:d + len(frame_ids)]
+        if not near.any():
+            # このバッチは全くシフトの影響を受けない
+            self._prev_phase = None
+            self._acc_phase = None
+            return
+
+        # 位相積算の起点として、シフトフレーム直前の0フレームもFFTする
+        next_shifted = self._shift_at(frame_ids + 1) != 0
+        analyzed = shifted | next_shifted
+
+        offset = t_a * hop - self._x_start
+        seg = self._x[:, offset:offset + (t_b - t_a - 1) * hop + n_fft]
+        # (channels, n_fft, n_frames) のビュー
+        frames = np.lib.stride_tricks.sliding_window_view(seg, n_fft, axis=1)[:, ::hop].transpose(0, 2, 1)
+
+        contrib = np.zeros((self.channels, n_fft, len(frame_ids)), dtype=np.float32)
+        weight = np.zeros((n_fft, len(frame_ids)), dtype=np.float32)
+        weight[:, near] = self.window_sq[:, None]
+
+        # シフトしないフレーム: 分析窓×合成窓をかけた元の信号（FFT不要）
+        plain = near & ~shifted
+        if plain.any():
+            contrib[:, :, plain] = frames[:, :, plain] * self.window_sq[:, None]
+
+        idx = np.flatnonzero(analyzed)
+        if len(idx) > 0:
+            self._render_shifted(frames, idx, shifts, shifted, contrib)
+        else:
+            self._prev_phase = None
+            self._acc_phase = None
+
+        # ホップ単位に分けて重ね合わせ
+        n = len(frame_ids)
+        out_len = (n - 1 + self.overlap) * hop
+        self._ensure_output(t_a * hop + out_len)
+        base_off = t_a * hop - self._x_start
+        ola = self._ola[:, base_off:base_off + out_len].reshape(self.channels, -1, hop)
+        norm = self._norm[base_off:base_off + out_len].reshape(-1, hop)
+        touched = self._touched[base_off:base_off + out_len].reshape(-1, hop)
+        c = contrib.reshape(self.channels, self.overlap, hop, n)
+        w = weight.reshape(self.overlap, hop, n)
+        for q in range(self.overlap):
+            ola[:, q:q + n] += np.transpose(c[:, q], (0, 2, 1))
+            norm[q:q + n] += w[q].T
+            touched[q:q + n] |= shifted[:, None]
+
+    def _finalize(self, end: int) -> np.ndarray:
+        """座標endまでの出力を確定して返し、バッファを捨てる"""
+        start = self._x_start
+        n = end - start
+        if n <= 0:
+            return np.zeros((self.channels, 0), dtype=np.float32)
+        self._ensure_output(end)
+        out = self._x[:, :n].copy()
+        touched = self._touched[:n]
+        if touched.any():
+            norm = np.maximum(self._norm[:n][touched], 1e-8)
+            out[:, touched] = self._ola[:, :n][:, touched] / norm
+        self._x = self._x[:, n:]
+        self._ola = self._ola[:, n:]
+        self._norm = self._norm[n:]
+        self._touched = self._touched[n:]
+        self._x_start = end
+        # center用パディングと入力末尾より後ろは出力しない
+        lo = max(self._emitted - start, 0)
+        hi = min(self.pad + self._n_input - start, n)
+        self._emitted = max(self._emitted, start + hi)
+        return out[:, lo:hi] if hi > lo else np.zeros((self.channels, 0), dtype=np.float32)
+
+    def _run(self, x_end: int) -> np.ndarray:
+        """座標x_endまでの入力で計算できるフレームをすべて処理する"""
+        n_ready = (x_end - self.n_fft) // self.hop_length + 1
+        outputs = [np.zeros((self.channels, 0), dtype=np.float32)]
+        while self._next_frame < n_ready:
+            t_b = min(self._next_frame + RENDER_BATCH_FRAMES, n_ready)
+            self._render_frames(self._next_frame, t_b)
+            self._next_frame = t_b
+            # バッチごとに確定させてバッファを小さく保つ
+            outputs.append(self._finalize(t_b * self.hop_length))
+        return np.concatenate(outputs, axis=1)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """
+        入力ブロック（(samples,) または (channels, samples)）を追加し、確定した出力を返す
+        """
+        block = np.asarray(block, dtype=np.float32)
+        if block.ndim == 1:
+            block = block[None, :]
+        self._x = np.concatenate([self._x, block], axis=1)
+        self._n_input += block.shape[1]
+        return self._run(self._x_start + self._x.shape[1])
+
+    def flush(self) -> np.ndarray:
+        """末尾のパディングを加えて残りの出力をすべて返す"""
+        self._x = np.concatenate([self._x, np.zeros((self.channels, self.pad), dtype=np.float32)], axis=1)
+        out = self._run(self._x_start + self._x.shape[1])
+        rest = self._finalize(self.pad + self._n_input)
+        return np.concatenate([out, rest], axis=1)
+
+
+def render_pitch_curve(y: np.ndarray, semitone_curve: np.ndarray,
+                       n_fft: int = RENDER_N_FFT, hop_length: int = RENDER_HOP_LENGTH) -> np.ndarray:
+    """
+    信号全体を半音カーブに従ってピッチシフトする（入力と同じ形・長さで返す）
+
+    y は (samples,) または (channels, samples)
+    """
+    mono = y.ndim == 1
+    y2 = y[None, :] if mono else y
+    renderer = PitchCurveRenderer(semitone_curve, y2.shape[0], n_fft, hop_length)
+    out = np.concatenate([renderer.process(y2), renderer.flush()], axis=1)
+    return out[0] if mono else out
+
+
+def render_pitch_curve_stream(audio_path: str, output_path, semitone_curve: np.ndarray,
+                              sr: int = 44100, channels: int = 2) -> None:
+    """
+    音声をブロックごとにデコード→ピッチシフト→出力へ追記する（ストリーミング用）
+
+    output_pathはWAVのパスかMuxAudioSink。音声全体をメモリに載せないため、
+    全体での正規化の代わりにブロックごとにクリップする
+    """
+    renderer = PitchCurveRenderer(semitone_curve, channels)
+    if isinstance(output_path, MuxAudioSink):
+        out = output_path
+    else:
+        out = sf.SoundFile(output_path, 'w', samplerate=sr, channels=channels, subtype='PCM_16')
+    try:
+        for block in iter_audio_blocks(audio_path, sr):
+            if channels == 1:
+                block = block.mean(axis=0, keepdims=True)
+            out.write(np.clip(renderer.process(block), -1.0, 1.0).T)
+        out.write(np.clip(renderer.flush(), -1.0, 1.0).T)
+    finally:
+        if out is not output_path:
+            out.close()
+
+
+def segment_peaks(y: np.ndarray, segment_samples: int) -> np.ndarray:
+    """セグメント（segment_samplesごと）ごとの最大振幅を求める"""
+    if len(y) == 0:
+        return np.zeros(0, dtype=np.float32)
+    return np.maximum.reduceat(np.abs(y), np.arange(0, len(y), segment_samples))
+
+
 def process_simple(
     audio_path: str,
     output_path: str,
@@ -1741,7 +3623,13 @@ def process_simple(
     segment_duration: float = 0.5,
     male_threshold: float = 165,
     adaptive_window: float = 300.0,
-    progress_callback=None
+    progress_callback=None,
+    pitch_engine: str = 'pyin',
+    analysis_workers: int = None,
+    streaming: bool = False,
+    audio: np.ndarray = None,
+    cache=None,
+    plan: dict = None
 ) -> None:
     """
     簡易版：ピッチ検出ベースで男性の声のみピッチを下げる
@@ -1749,26 +3637,75 @@ def process_simple(
 
     Args:
         adaptive_window: 閾値再計算の区間（秒）。0で固定閾値モード
+        pitch_engine: ピッチ推定エンジン（'pyin' or 'yin'）
+        analysis_workers: F0解析のワーカープロセス数（None: 自動、1: 直列）
+        streaming: Trueなら音声をブロックごとに読み込んで処理する（長時間の音声でもメモリ一定）
+        output_path: 出力WAVのパス、またはMuxAudioSink（動画との結合へ直接流し込む）
+        audio: デコード済みの音声 (2, samples)、44100Hz。省略時はaudio_pathからデコードする
+        cache: ArtifactCache。指定時はF0トラックをキャッシュする
+        plan: dictを渡すと再レンダリング用の情報（男性区間）を書き込む
     """
+    import librosa
     def log(step, message):
         print(message)
         if progress_callback:
             progress_callback(step, message)
 
-    # 音声を読み込み
-    log('analyze', "音声ファイルを読み込み中...")
-    y, sr = librosa.load(audio_path, sr=44100, mono=False)
+    sr = 44100
+    segment_samples = int(segment_duration * sr)
 
-    # モノラルの場合はステレオに変換
-    if y.ndim == 1:
-        y = np.stack([y, y])
+    if streaming:
+        # 第1パスは音声をブロックごとにデコードし、セグメントごとの最大振幅と
+        # F0トラック（解析用サンプルレートに間引いて計算）を同時に求める（音声全体は保持しない）
+        log('analyze', "ストリーミングモード: 音声をブロックごとに解析します")
+        log('pitch', f"F0トラックを計算中（エンジン: {pitch_engine}）...")
+        peak_parts = []
+        carry = np.zeros(0, dtype=np.float32)
+        n_samples = 0
+
+        def mono_blocks():
+            nonlocal carry, n_samples
+            for block_mono in iter_audio_blocks(audio_path, sr, mono=True):
+                n_samples += len(block_mono)
+                data = np.concatenate([carry, block_mono])
+                full = len(data) // segment_samples * segment_samples
+                if full > 0:
+                    peak_parts.append(segment_peaks(data[:full], segment_samples))
+                carry = data[full:]
+                yield block_mono
+
+        def stream_progress(seconds):
+            log('pitch', f"  ピッチ解析: {seconds:.0f}秒")
+
+        f0_track = cache.load('f0', f0_cache_params(pitch_engine, streaming=True)) if cache else None
+        if f0_track is None:
+            f0_track = compute_f0_track_stream(iter_analysis_rate(mono_blocks(), sr), ANALYSIS_SR,
+                                               progress_callback=stream_progress, engine=pitch_engine,
+                                               workers=resolve_analysis_workers(analysis_workers))
+            if cache:
+                cache.store('f0', f0_cache_params(pitch_engine, streaming=True), f0_track)
+        else:
+            # F0はキャッシュ済みなので、デコードはセグメントの最大振幅のためだけに行う
+            log('pitch', "キャッシュを使用: f0")
+            for _ in mono_blocks():
+                pass
+        peak_parts.append(segment_peaks(carry, segment_samples))
+        peaks = np.concatenate(peak_parts)
+    else:
+        # 音声を読み込み（モノラル音源も2chでデコードされる）
+        if audio is None:
+            log('analyze', "音声ファイルを読み込み中...")
+            audio = decode_audio(audio_path, sr)
+        y = audio
+
+        y_mono = librosa.to_mono(y)
+        n_samples = len(y_mono)
+        peaks = segment_peaks(y_mono, segment_samples)
 
-    y_mono = librosa.to_mono(y)
-    total_duration = len(y_mono) / sr
+    total_duration = n_samples / sr
 
     # セグメントごとに処理
-    segment_samples = int(segment_duration * sr)
-    num_segments = len(y_mono) // segment_samples + 1
+    num_segments = n_samples // segment_samples + 1
 
     log('pitch', f"セグメント数: {num_segments} (各{segment_duration}秒)")
     log('pitch', f"ベース閾値: {male_threshold}Hz")
@@ -1776,50 +3713,61 @@ def process_simple(
     # 動的閾値調整の設定
     if adaptive_window > 0 and total_duration > adaptive_window:
         adaptive_samples = int(adaptive_window * sr)
-        num_windows = int(np.ceil(len(y_mono) / adaptive_samples))
+        num_windows = int(np.ceil(n_samples / adaptive_samples))
         log('pitch', f"動的閾値調整: {adaptive_window}秒ごと ({num_windows}区間)")
     else:
-        adaptive_samples = len(y_mono)
+        adaptive_samples = n_samples
         num_windows = 1
         log('pitch', f"固定閾値モード")
 
-    y_processed = y.copy()
-
     male_segments = 0
     female_segments = 0
     silent_segments = 0
     threshold_history = []
 
+    if not streaming:
+        # F0トラックを全体で1回だけ計算（第1パス・第2パスで共有）
+        log('pitch', f"F0トラックを計算中（エンジン: {pitch_engine}）...")
+
+        def track_progress(done, total):
+            if done < total and done % 5 == 0:
+                log('pitch', f"  ピッチ解析: {int((done / total) * 50)}%")
+
+        # 解析用サンプルレートに一度だけ間引いてからF0を計算する
+        f0_track = run_cached(
+            cache, 'f0', f0_cache_params(pitch_engine),
+            lambda: compute_f0_track(to_analysis_rate(y_mono, sr), ANALYSIS_SR,
+                                     progress_callback=track_progress, engine=pitch_engine,
+                                     workers=resolve_analysis_workers(analysis_workers)),
+            log=lambda msg: log('pitch', msg))
+
     # 第1パス: 各区間のピッチを収集
     log('pitch', "第1パス: ピッチ分布を解析中...")
     window_pitches = [[] for _ in range(num_windows)]
+    # セグメントごとのピッチ（無音はNone）。第2パスで再利用する
+    segment_pitches = []
 
     for i in range(num_segments):
         start = i * segment_samples
-        end = min((i + 1) * segment_samples, len(y_mono))
+        end = min((i + 1) * segment_samples, n_samples)
 
-        if start >= len(y_mono):
+        if start >= n_samples:
             break
 
-        segment_mono = y_mono[start:end]
-
         # 無音チェック
-        if np.max(np.abs(segment_mono)) < 0.005:
+        if i >= len(peaks) or peaks[i] < 0.005:
+            segment_pitches.append(None)
             continue
 
-        # ピッチを推定
-        pitch = estimate_pitch_for_segment(segment_mono, sr)
+        # トラックからピッチを取り出す（44.1kHzのサンプル位置をフレームに変換）
+        pitch = pitch_from_track(f0_track, start, end, sr)
+        segment_pitches.append(pitch)
 
         if pitch > 0:
             # どの区間に属するか
             window_idx = min(start // adaptive_samples, num_windows - 1)
             window_pitches[window_idx].append(pitch)
 
-        # 進捗表示（20セグメントごと）
-        if i > 0 and i % 20 == 0:
-            progress = int((i / num_segments) * 50)
-            log('pitch', f"  ピッチ解析: {progress}%")
-
     # 各区間の閾値を計算
     window_thresholds = []
     for idx, pitches in enumerate(window_pitches):
@@ -1829,25 +3777,18 @@ def process_simple(
         end_time = min((idx + 1) * adaptive_window, total_duration)
         log('pitch', f"  区間 {start_time:.0f}-{end_time:.0f}秒: 閾値={local_threshold:.0f}Hz (サンプル={len(pitches)})")
 
-    # 第2パス: ピッチシフト処理
-    log('pitch', "第2パス: ピッチシフト処理中...")
-    for i in range(num_segments):
+    # 第2パス: 男女判定
+    log('pitch', "第2パス: 男女判定中...")
+    shift_regions = []
+    for i, pitch in enumerate(segment_pitches):
         start = i * segment_samples
-        end = min((i + 1) * segment_samples, len(y_mono))
-
-        if start >= len(y_mono):
-            break
-
-        segment_mono = y_mono[start:end]
+        end = min((i + 1) * segment_samples, n_samples)
 
-        # 無音チェック
-        if np.max(np.abs(segment_mono)) < 0.005:
+        # 無音チェック（第1パスの結果）
+        if pitch is None:
             silent_segments += 1
             continue
 
-        # ピッチを推定
-        pitch = estimate_pitch_for_segment(segment_mono, sr)
-
         if pitch == 0:
             continue
 
@@ -1859,29 +3800,8 @@ def process_simple(
         if is_male_voice(pitch, current_threshold):
             male_segments += 1
 
-            # 男性の声：ピッチを下げる
-            for ch in range(y.shape[0]):
-                segment = y[ch, start:end]
-                processed = pitch_shift_audio(segment, sr, pitch_shift_semitones)
-
-                # 長さを調整
-                target_len = end - start
-                if len(processed) > target_len:
-                    processed = processed[:target_len]
-                elif len(processed) < target_len:
-                    processed = np.pad(processed, (0, target_len - len(processed)))
-
-                # クロスフェード（短め）
-                fade_len = min(int(0.01 * sr), len(processed) // 4)
-                if fade_len > 0:
-                    if start > 0:
-                        fade_in = np.linspace(0, 1, fade_len)
-                        processed[:fade_len] = processed[:fade_len] * fade_in + y[ch, start:start+fade_len] * (1 - fade_in)
-                    if end < y.shape[1]:
-                        fade_out = np.linspace(1, 0, fade_len)
-                        processed[-fade_len:] = processed[-fade_len:] * fade_out + y[ch, end-fade_len:end] * (1 - fade_out)
-
-                y_processed[ch, start:end] = processed
+            # 男性の声：区間を記録し、後で全体を1パスでピッチシフトする
+            shift_regions.append((start, end, pitch_shift_semitones))
         else:
             female_segments += 1
 
@@ -1892,13 +3812,27 @@ def process_simple(
 
     log('pitch', f"結果: 男性={male_segments}, 女性={female_segments}, 無音={silent_segments}")
 
+    # 男性区間をまとめて1パスでピッチシフト（区間の境界は窓の重なりでつながる）
+    log('pitch', "ピッチシフト処理中...")
+    curve = build_semitone_curve(shift_regions, n_samples)
+    if plan is not None:
+        plan.update(regions_render_plan(shift_regions, n_samples, sr))
+
+    if streaming:
+        # 第2パス: ブロックごとにデコード→ピッチシフト→保存
+        render_pitch_curve_stream(audio_path, output_path, curve, sr)
+        log('merge', f"処理済み音声を保存")
+        return
+
+    y_processed = render_pitch_curve(y, curve)
+
     # クリッピング防止
     max_val = np.max(np.abs(y_processed))
     if max_val > 1.0:
         y_processed = y_processed / max_val * 0.95
 
     # 保存
-    sf.write(output_path, y_processed.T, sr)
+    write_audio_output(output_path, y_processed, sr)
     log('merge', f"処理済み音声を保存")
 
 
@@ -1912,7 +3846,12 @@ def process_video(
     adaptive_window: float = 300.0,
     progress_callback=None,
     save_audio_path: str = None,
-    enable_double_check: bool = True
+    enable_double_check: bool = True,
+    pitch_engine: str = 'pyin',
+    analysis_workers: int = None,
+    streaming: bool = None,
+    cache_dir: str = None,
+    plan_dir: str = None
 ) -> dict:
     """
     動画を処理して男性の声のみピッチを下げる
@@ -1928,15 +3867,22 @@ def process_video(
     adaptive_window: 動的閾値調整の区間（秒）。0で固定閾値モード - 簡易版で使用
     save_audio_path: 処理済み音声を保存するパス（指定時のみ保存）
     enable_double_check: ダブルチェックを有効にするか（timbreモードのみ）
+    pitch_engine: ピッチ推定エンジン 'pyin'（高精度）/ 'yin'（高速）- 簡易版で使用
+    analysis_workers: F0解析のワーカープロセス数（None: 環境変数VOICE_CHANGER_WORKERSかCPUコア数、1: 直列）
+    streaming: 音声をブロックごとに処理してメモリ使用量を一定に保つか
+               （None: STREAMING_AUTO_DURATION秒以上なら自動で有効）- 簡易版・声質版で使用
+    cache_dir: 中間生成物キャッシュのディレクトリ。指定時は同じ入力の再処理で
+               デコード・F0解析・CNN判定・話者分離の結果を再利用する
+    plan_dir: 指定時は再レンダリング用の情報（男性区間や話者ごとの音声）を保存する
+              （rerender_videoでピッチ量だけ変えて出力し直せる）
 
     Returns:
         dict: {
             'audio_path': str or None,  # 処理済み音声ファイルのパス
-            'processed_segments': list  # 処理された区間のリスト [{'start', 'end', 'pitch'}, ...]
+            'processed_segments': list,  # 処理された区間のリスト [{'start', 'end', 'pitch'}, ...]
+            'render_plan': str or None  # 再レンダリング用の情報のディレクトリ（plan_dir指定時）
         }
     """
-    import shutil
-
     def log(step, message):
         print(message)
         if progress_callback:
@@ -1956,79 +3902,182 @@ def process_video(
     log('extract', f"ピッチシフト: {pitch_shift_semitones} semitones")
     if mode in ['simple', 'hybrid']:
         log('extract', f"男性判定閾値: {male_threshold}Hz")
+    if mode == 'simple':
+        log('extract', f"ピッチ推定エンジン: {pitch_engine}")
     if mode == 'precision':
         log('extract', "※話者分離を使用するため処理時間が長くなります")
 
     saved_audio = None
     processed_segments = []
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-        extracted_audio = os.path.join(tmpdir, "extracted.wav")
-        processed_audio = os.path.join(tmpdir, "processed.wav")
-
-        # 1. 動画から音声を抽出
-        log('extract', "1. 音声を抽出中...")
-        extract_audio(input_video, extracted_audio)
-        log('extract', "音声抽出完了")
+    plan = {} if plan_dir else None
+
+    cache = None
+    if cache_dir:
+        cache = ArtifactCache(cache_dir, input_video)
+        log('extract', f"キャッシュキー: {cache.digest[:16]}")
+
+    # 処理済み音声はffmpegへ直接流し込んで動画と結合する（WAVはsave_audio_path指定時のみ書き出す）
+    with MuxAudioSink(input_video, output_video, 44100, 2, tee_path=save_audio_path) as sink:
+        # 長い音声はストリーミング処理（簡易版・声質版のみ対応）
+        if streaming is None:
+            streaming = (get_audio_duration(input_video) or 0.0) >= STREAMING_AUTO_DURATION
+        if streaming and mode not in ['simple', 'timbre']:
+            log('extract', f"※{mode_name}はストリーミング処理に未対応のため通常処理で実行します")
+            streaming = False
+
+        # 1. 動画から音声をデコード（一時WAVを介さず、ffmpegのパイプから直接配列に読み込む）
+        audio = None
+        if streaming:
+            log('extract', "ストリーミング処理: 音声をブロックごとに処理します")
+        else:
+            log('extract', "1. 音声を抽出中...")
+            audio = run_cached(cache, 'pcm', {'sr': 44100}, lambda: decode_audio(input_video, 44100),
+                               log=lambda msg: log('extract', msg))
+            log('extract', "音声抽出完了")
 
         # 2. 音声処理（モードに応じて分岐）
         if mode == 'precision':
             # 高精度版（話者分離 + CNN判定）
             log('analyze', "2. 高精度版で処理中...")
             processed_segments = process_precision(
-                extracted_audio,
-                processed_audio,
+                input_video,
+                sink,
                 pitch_shift_semitones,
-                progress_callback=progress_callback
+                progress_callback=progress_callback,
+                audio=audio,
+                cache=cache,
+                plan=plan
             )
         elif mode == 'timbre':
             # 声質版（セグメントごとのピッチ判定）
             log('analyze', "2. 声質版で処理中...")
             processed_segments = process_timbre(
-                extracted_audio,
-                processed_audio,
+                input_video,
+                sink,
                 pitch_shift_semitones,
                 segment_duration=2.0,
                 progress_callback=progress_callback,
-                enable_double_check=enable_double_check
+                enable_double_check=enable_double_check,
+                streaming=streaming,
+                audio=audio,
+                cache=cache,
+                plan=plan
             )
         elif mode == 'hybrid':
             # ハイブリッド版（Hz + 声質の両方で判定）
             log('analyze', "2. ハイブリッド版で処理中...")
             process_hybrid(
-                extracted_audio,
-                processed_audio,
+                input_video,
+                sink,
                 pitch_shift_semitones,
                 male_threshold,
-                progress_callback
+                progress_callback,
+                audio=audio,
+                cache=cache,
+                plan=plan
             )
         else:
             # 簡易版モード（Hzセグメント判定）
             log('analyze', "2. 簡易版で処理中...")
             process_simple(
-                extracted_audio,
-                processed_audio,
+                input_video,
+                sink,
                 pitch_shift_semitones,
                 segment_duration,
                 male_threshold,
                 adaptive_window,
-                progress_callback
+                progress_callback,
+                pitch_engine=pitch_engine,
+                analysis_workers=analysis_workers,
+                streaming=streaming,
+                audio=audio,
+                cache=cache,
+                plan=plan
             )
 
-        # 処理済み音声を保存（指定時）
-        if save_audio_path:
-            shutil.copy2(processed_audio, save_audio_path)
-            saved_audio = save_audio_path
-            log('combine', f"処理済み音声を保存: {save_audio_path}")
-
-        # 3. 処理した音声と元の動画を結合
+        # 3. 処理した音声と元の動画の結合を完了（withを抜けるときにffmpegの終了を待つ）
         log('combine', "3. 動画と音声を結合中...")
-        merge_audio_video(input_video, processed_audio, output_video)
+
+    # 処理済み音声を保存（指定時）
+    if save_audio_path:
+        saved_audio = save_audio_path
+        log('combine', f"処理済み音声を保存: {save_audio_path}")
+
+    # 再レンダリング用の情報を保存（指定時）
+    render_plan = None
+    if plan:
+        save_render_plan(plan, plan_dir)
+        render_plan = plan_dir
 
     log('combine', f"完了！出力ファイル: {output_video}")
     return {
         'audio_path': saved_audio,
-        'processed_segments': processed_segments
+        'processed_segments': processed_segments,
+        'render_plan': render_plan
+    }
+
+
+def rerender_video(
+    input_video: str,
+    output_video: str,
+    plan_dir: str,
+    pitch_shift_semitones: float = -3.0,
+    progress_callback=None,
+    save_audio_path: str = None,
+    cache_dir: str = None
+) -> dict:
+    """
+    process_videoで保存した再レンダリング用の情報を使い、ピッチ量だけ変えて出力し直す
+
+    男性区間の検出・CNN判定・話者分離はやり直さず、ピッチシフトと動画との結合だけを行う
+
+    Returns:
+        process_videoと同じ形式（processed_segmentsは空）
+    """
+    def log(step, message):
+        print(message)
+        if progress_callback:
+            progress_callback(step, message)
+
+    plan = load_render_plan(plan_dir)
+    sr = plan['sr']
+    n_samples = plan['n_samples']
+    log('extract', f"再レンダリング: {input_video}")
+    log('extract', f"ピッチシフト: {pitch_shift_semitones} semitones")
+
+    with MuxAudioSink(input_video, output_video, sr, 2, tee_path=save_audio_path) as sink:
+        if plan['kind'] == 'speakers':
+            # 分離済みの話者音声を合成し直す
+            log('pitch', f"話者{len(plan['stems'])}人分の音声を合成し直し中...")
+            y_stereo = mix_speaker_stems(plan['stems'], plan['male'], pitch_shift_semitones, n_samples,
+                                         log=lambda msg: log('pitch', msg))
+            write_audio_output(sink, y_stereo, sr)
+        else:
+            log('pitch', f"{len(plan['regions'])}区間をピッチシフト中...")
+            curve = build_semitone_curve([(start, end, pitch_shift_semitones) for start, end in plan['regions']],
+                                         n_samples)
+            if n_samples / sr >= STREAMING_AUTO_DURATION:
+                # 長い音声はブロックごとにデコード→ピッチシフト
+                render_pitch_curve_stream(input_video, sink, curve, sr)
+            else:
+                cache = ArtifactCache(cache_dir, input_video) if cache_dir else None
+                y = run_cached(cache, 'pcm', {'sr': sr}, lambda: decode_audio(input_video, sr),
+                               log=lambda msg: log('extract', msg))
+                y_processed = render_pitch_curve(y, curve)
+
+                # クリッピング防止
+                max_val = np.max(np.abs(y_processed))
+                if max_val > 1.0:
+                    y_processed = y_processed / max_val * 0.95
+                write_audio_output(sink, y_processed, sr)
+
+        log('combine', "動画と音声を結合中...")
+
+    log('combine', f"完了！出力ファイル: {output_video}")
+    return {
+        'audio_path': save_audio_path,
+        'processed_segments': [],
+        'render_plan': plan_dir
     }
 
 
@@ -2049,6 +4098,7 @@ def analyze_speech_segments(y: np.ndarray, sr: int, silence_threshold: float = 0
     Returns:
         発話区間の長さ（秒）のリスト
     """
+    import librosa
     # RMSエネルギーを計算（フレーム単位）
     frame_length = int(0.025 * sr)  # 25ms
     hop_length = int(0.010 * sr)    # 10ms
@@ -2084,10 +4134,15 @@ def analyze_speech_segments(y: np.ndarray, sr: int, silence_threshold: float = 0
     return speech_durations
 
 
-def analyze_pitch_distribution(video_path: str, segment_duration: float = 0.3, progress_callback=None) -> dict:
+def analyze_pitch_distribution(video_path: str, segment_duration: float = 0.3, progress_callback=None,
+                               pitch_engine: str = 'pyin', analysis_workers: int = None,
+                               cache_dir: str = None) -> dict:
     """
     動画の音声を分析してピッチ分布を取得する
 
+    cache_dir: 中間生成物キャッシュのディレクトリ。指定時はprocess_videoと同じ
+               デコード済みPCM・F0トラックを共有する（解析後の本処理で再利用される）
+
     Returns:
         {
             'pitches': [float, ...],  # 検出されたピッチのリスト
@@ -2099,132 +4154,140 @@ def analyze_pitch_distribution(video_path: str, segment_duration: float = 0.3, p
             }
         }
     """
-    import tempfile
-
+    import librosa
     def log(message):
         print(message)
         if progress_callback:
             progress_callback(message)
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        audio_path = os.path.join(tmpdir, "audio.wav")
-
-        log("音声を抽出中...")
-        extract_audio(video_path, audio_path)
-
-        log("音声ファイルを読み込み中...")
-        y, sr = librosa.load(audio_path, sr=44100, mono=True)
-
-        # 発話区間を分析して推奨セグメント長を算出
-        log("発話パターンを分析中...")
-        speech_durations = analyze_speech_segments(y, sr)
-        if speech_durations:
-            # 発話区間の中央値を基準に推奨セグメント長を決定
-            median_duration = float(np.median(speech_durations))
-            # 推奨値: 発話区間の中央値の50-70%程度（細かく捉える）
-            suggested_segment = max(0.2, min(2.0, round(median_duration * 0.6, 1)))
-            log(f"発話区間の中央値: {median_duration:.2f}秒 → 推奨セグメント長: {suggested_segment}秒")
-        else:
-            suggested_segment = 0.5  # デフォルト
-
-        # セグメントごとにピッチを検出
-        segment_samples = int(segment_duration * sr)
-        num_segments = len(y) // segment_samples + 1
+    log("音声を抽出中...")
+    sr = ANALYSIS_SR
+    cache = ArtifactCache(cache_dir, video_path) if cache_dir else None
+    if cache:
+        # 本処理とキャッシュを共有するため、44.1kHzでデコードしてから解析用に間引く
+        audio = run_cached(cache, 'pcm', {'sr': 44100}, lambda: decode_audio(video_path, 44100), log=log)
+        y = to_analysis_rate(librosa.to_mono(audio), 44100)
+        del audio
+    else:
+        # 解析のみなので解析用サンプルレートのモノラルで直接デコードする（一時WAVは作らない）
+        y = decode_audio(video_path, sr, mono=True)
+
+    # 発話区間を分析して推奨セグメント長を算出
+    log("発話パターンを分析中...")
+    speech_durations = analyze_speech_segments(y, sr)
+    if speech_durations:
+        # 発話区間の中央値を基準に推奨セグメント長を決定
+        median_duration = float(np.median(speech_durations))
+        # 推奨値: 発話区間の中央値の50-70%程度（細かく捉える）
+        suggested_segment = max(0.2, min(2.0, round(median_duration * 0.6, 1)))
+        log(f"発話区間の中央値: {median_duration:.2f}秒 → 推奨セグメント長: {suggested_segment}秒")
+    else:
+        suggested_segment = 0.5  # デフォルト
 
-        log(f"セグメント数: {num_segments} (各{segment_duration}秒)")
+    # セグメントごとにピッチを検出
+    segment_samples = int(segment_duration * sr)
+    num_segments = len(y) // segment_samples + 1
 
-        pitches = []
+    log(f"セグメント数: {num_segments} (各{segment_duration}秒)")
 
-        for i in range(num_segments):
-            start = i * segment_samples
-            end = min((i + 1) * segment_samples, len(y))
+    # F0トラックを全体で1回だけ計算
+    def track_progress(done, total):
+        if done < total and done % 5 == 0:
+            log(f"ピッチ解析中... {int((done / total) * 100)}% ({done}/{total}ブロック)")
 
-            if start >= len(y):
-                break
+    f0_params = f0_cache_params(pitch_engine) if cache else None
+    f0_track = run_cached(cache, 'f0', f0_params,
+                          lambda: compute_f0_track(y, sr, progress_callback=track_progress, engine=pitch_engine,
+                                                   workers=resolve_analysis_workers(analysis_workers)),
+                          log=log)
 
-            segment = y[start:end]
+    pitches = []
 
-            # 無音チェック
-            if np.max(np.abs(segment)) < 0.005:
-                continue
+    for i in range(num_segments):
+        start = i * segment_samples
+        end = min((i + 1) * segment_samples, len(y))
 
-            # ピッチを推定
-            pitch = estimate_pitch_for_segment(segment, sr)
+        if start >= len(y):
+            break
 
-            if pitch > 0:
-                pitches.append(pitch)
+        segment = y[start:end]
 
-            # 進捗表示（20セグメントごと）
-            if i > 0 and i % 20 == 0:
-                progress = int((i / num_segments) * 100)
-                log(f"ピッチ解析中... {progress}% ({i}/{num_segments})")
+        # 無音チェック
+        if np.max(np.abs(segment)) < 0.005:
+            continue
 
-        if not pitches:
-            return {
-                'pitches': [],
-                'male_pitches': [],
-                'female_pitches': [],
-                'suggested_threshold': 165,
-                'stats': None
-            }
+        # トラックからピッチを取り出す
+        pitch = pitch_from_track(f0_track, start, end)
 
-        pitches_array = np.array(pitches)
+        if pitch > 0:
+            pitches.append(pitch)
 
-        # 統計を計算
-        stats = {
-            'min': float(np.min(pitches_array)),
-            'max': float(np.max(pitches_array)),
-            'mean': float(np.mean(pitches_array)),
-            'median': float(np.median(pitches_array))
+    if not pitches:
+        return {
+            'pitches': [],
+            'male_pitches': [],
+            'female_pitches': [],
+            'suggested_threshold': 165,
+            'stats': None
         }
 
-        # ピッチ分布から閾値を推定
-        # 男性: 85-180Hz, 女性: 165-255Hz の一般的な範囲
-        # 二峰性があれば谷を閾値に
-
-        # ヒストグラムで分布を分析
-        hist, bin_edges = np.histogram(pitches_array, bins=30, range=(50, 350))
-        bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
-
-        # 谷を探す（二峰性の場合）
-        suggested_threshold = 165  # デフォルト
-
-        if len(hist) > 5:
-            # スムージング
-            from scipy.ndimage import uniform_filter1d
-            smoothed = uniform_filter1d(hist.astype(float), size=3)
-
-            # 100-200Hzの範囲で谷を探す
-            for j in range(len(bin_centers)):
-                if 120 < bin_centers[j] < 200:
-                    # 谷の検出（前後より小さい）
-                    if j > 0 and j < len(smoothed) - 1:
-                        if smoothed[j] < smoothed[j-1] and smoothed[j] < smoothed[j+1]:
-                            if smoothed[j] < np.mean(smoothed) * 0.7:
-                                suggested_threshold = bin_centers[j]
-                                break
-
-        # 男性/女性に分類
-        male_pitches = [p for p in pitches if p < suggested_threshold]
-        female_pitches = [p for p in pitches if p >= suggested_threshold]
-
-        log(f"解析完了: {len(pitches)}セグメント検出")
-        log(f"男性推定: {len(male_pitches)}, 女性推定: {len(female_pitches)}")
-        log(f"推奨閾値: {round(suggested_threshold)}Hz")
-        log(f"推奨セグメント長: {suggested_segment}秒")
+    pitches_array = np.array(pitches)
 
-        return {
-            'pitches': pitches,
-            'male_pitches': male_pitches,
-            'female_pitches': female_pitches,
-            'suggested_threshold': round(suggested_threshold),
-            'suggested_segment': suggested_segment,
-            'stats': stats,
-            'histogram': {
-                'counts': hist.tolist(),
-                'bins': bin_centers.tolist()
-            }
+    # 統計を計算
+    stats = {
+        'min': float(np.min(pitches_array)),
+        'max': float(np.max(pitches_array)),
+        'mean': float(np.mean(pitches_array)),
+        'median': float(np.median(pitches_array))
+    }
+
+    # ピッチ分布から閾値を推定
+    # 男性: 85-180Hz, 女性: 165-255Hz の一般的な範囲
+    # 二峰性があれば谷を閾値に
+
+    # ヒストグラムで分布を分析
+    hist, bin_edges = np.histogram(pitches_array, bins=30, range=(50, 350))
+    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+
+    # 谷を探す（二峰性の場合）
+    suggested_threshold = 165  # デフォルト
+
+    if len(hist) > 5:
+        # スムージング
+        from scipy.ndimage import uniform_filter1d
+        smoothed = uniform_filter1d(hist.astype(float), size=3)
+
+        # 100-200Hzの範囲で谷を探す
+        for j in range(len(bin_centers)):
+            if 120 < bin_centers[j] < 200:
+                # 谷の検出（前後より小さい）
+                if j > 0 and j < len(smoothed) - 1:
+                    if smoothed[j] < smoothed[j-1] and smoothed[j] < smoothed[j+1]:
+                        if smoothed[j] < np.mean(smoothed) * 0.7:
+                            suggested_threshold = bin_centers[j]
+                            break
+
+    # 男性/女性に分類
+    male_pitches = [p for p in pitches if p < suggested_threshold]
+    female_pitches = [p for p in pitches if p >= suggested_threshold]
+
+    log(f"解析完了: {len(pitches)}セグメント検出")
+    log(f"男性推定: {len(male_pitches)}, 女性推定: {len(female_pitches)}")
+    log(f"推奨閾値: {round(suggested_threshold)}Hz")
+    log(f"推奨セグメント長: {suggested_segment}秒")
+
+    return {
+        'pitches': pitches,
+        'male_pitches': male_pitches,
+        'female_pitches': female_pitches,
+        'suggested_threshold': round(suggested_threshold),
+        'suggested_segment': suggested_segment,
+        'stats': stats,
+        'histogram': {
+            'counts': hist.tolist(),
+            'bins': bin_centers.tolist()
         }
+    }
 
 
 def pitch_shift_region(
@@ -2232,7 +4295,8 @@ def pitch_shift_region(
     output_video: str,
     regions: list,
     pitch_shift_semitones: float = -3.0,
-    save_audio_path: str = None
+    save_audio_path: str = None,
+    audio_source: str = None
 ) -> str:
     """
     動画の指定区間のみピッチシフトする
@@ -2240,12 +4304,11 @@ def pitch_shift_region(
     regions: [{'start': float, 'end': float, 'pitch': float(optional)}, ...]  秒単位
              pitchが指定されていない場合はpitch_shift_semitonesを使用
     save_audio_path: 処理済み音声を保存するパス（指定時のみ保存）
+    audio_source: 音声を読むファイル（省略時はinput_video。手動編集の結果のように音声を動画と別に持つ場合）
 
     Returns:
         処理済み音声ファイルのパス（save_audio_path指定時）、またはNone
     """
-    import shutil
-
     print(f"入力動画: {input_video}")
     print(f"出力動画: {output_video}")
     print(f"区間数: {len(regions)}")
@@ -2253,86 +4316,162 @@ def pitch_shift_region(
 
     saved_audio = None
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        extracted_audio = os.path.join(tmpdir, "extracted.wav")
-        processed_audio = os.path.join(tmpdir, "processed.wav")
-
-        # 1. 動画から音声を抽出
-        print("1. 音声を抽出中...")
-        extract_audio(input_video, extracted_audio)
+    # 1. 動画から音声をデコード（ffmpegのパイプから直接読み込む）
+    print("1. 音声を抽出中...")
+    sr = 44100
+    y = decode_audio(audio_source or input_video, sr)
 
-        # 2. 音声を読み込み
-        print("2. 音声を処理中...")
-        y, sr = librosa.load(extracted_audio, sr=44100, mono=False)
+    # 2. 音声を処理
+    print("2. 音声を処理中...")
 
-        # モノラルの場合はステレオに変換
-        if y.ndim == 1:
-            y = np.stack([y, y])
+    # 3. 各区間のピッチシフト量を集める
+    shift_regions = []
+    for i, region in enumerate(regions):
+        start_sec = region['start']
+        end_sec = region['end']
+        # 区間ごとのピッチ値（指定がなければデフォルト値）
+        region_pitch = region.get('pitch', pitch_shift_semitones)
 
-        # 3. 各区間をピッチシフト
-        for i, region in enumerate(regions):
-            start_sec = region['start']
-            end_sec = region['end']
-            # 区間ごとのピッチ値（指定がなければデフォルト値）
-            region_pitch = region.get('pitch', pitch_shift_semitones)
+        start_sample = int(start_sec * sr)
+        end_sample = int(end_sec * sr)
 
-            start_sample = int(start_sec * sr)
-            end_sample = int(end_sec * sr)
+        # 範囲チェック
+        if start_sample >= y.shape[1]:
+            continue
+        end_sample = min(end_sample, y.shape[1])
 
-            # 範囲チェック
-            if start_sample >= y.shape[1]:
-                continue
-            end_sample = min(end_sample, y.shape[1])
-
-            print(f"  区間 {i+1}: {start_sec:.2f}s - {end_sec:.2f}s をピッチシフト ({region_pitch:+.1f}半音)")
-
-            # 各チャンネルをピッチシフト
-            for ch in range(y.shape[0]):
-                segment = y[ch, start_sample:end_sample]
-                shifted = pitch_shift_audio(segment, sr, region_pitch)
-
-                # 長さを調整
-                target_len = end_sample - start_sample
-                if len(shifted) > target_len:
-                    shifted = shifted[:target_len]
-                elif len(shifted) < target_len:
-                    shifted = np.pad(shifted, (0, target_len - len(shifted)))
-
-                # クロスフェード
-                fade_len = min(int(0.01 * sr), len(shifted) // 4)
-                if fade_len > 0:
-                    if start_sample > 0:
-                        fade_in = np.linspace(0, 1, fade_len)
-                        shifted[:fade_len] = shifted[:fade_len] * fade_in + y[ch, start_sample:start_sample+fade_len] * (1 - fade_in)
-                    if end_sample < y.shape[1]:
-                        fade_out = np.linspace(1, 0, fade_len)
-                        shifted[-fade_len:] = shifted[-fade_len:] * fade_out + y[ch, end_sample-fade_len:end_sample] * (1 - fade_out)
-
-                y[ch, start_sample:end_sample] = shifted
+        print(f"  区間 {i+1}: {start_sec:.2f}s - {end_sec:.2f}s をピッチシフト ({region_pitch:+.1f}半音)")
+        shift_regions.append((start_sample, end_sample, region_pitch))
 
-        # 4. クリッピング防止
-        max_val = np.max(np.abs(y))
-        if max_val > 1.0:
-            y = y / max_val * 0.95
+    # 全区間をまとめて1パスでピッチシフト（区間の境界は窓の重なりでつながる）
+    curve = build_semitone_curve(shift_regions, y.shape[1])
+    y = render_pitch_curve(y, curve)
 
-        # 5. 保存
-        sf.write(processed_audio, y.T, sr)
-        print(f"  処理済み音声: {processed_audio}")
+    # 4. クリッピング防止
+    max_val = np.max(np.abs(y))
+    if max_val > 1.0:
+        y = y / max_val * 0.95
 
-        # 処理済み音声を保存（指定時）
-        if save_audio_path:
-            shutil.copy2(processed_audio, save_audio_path)
-            saved_audio = save_audio_path
-            print(f"  音声ファイルを保存: {save_audio_path}")
+    # 5. 動画と結合（音声はffmpegへ直接流し込み、WAVは指定時のみ書き出す）
+    print("3. 動画と音声を結合中...")
+    with MuxAudioSink(input_video, output_video, sr, 2, tee_path=save_audio_path) as sink:
+        sink.write(y.T)
 
-        # 6. 動画と音声を結合
-        print("3. 動画と音声を結合中...")
-        merge_audio_video(input_video, processed_audio, output_video)
+    # 処理済み音声を保存（指定時）
+    if save_audio_path:
+        saved_audio = save_audio_path
+        print(f"  音声ファイルを保存: {save_audio_path}")
 
     print(f"完了！出力ファイル: {output_video}")
     return saved_audio
 
 
+# 手動編集で差し替える区間の前後に付ける文脈（秒）と、差し替えの境界のクロスフェード（秒）
+EDIT_CONTEXT_SECONDS = 0.25
+EDIT_CROSSFADE_SECONDS = 0.01
+# 区間外をコピーするときに一度に読む長さ（サンプル）
+EDIT_COPY_BLOCK = 1 << 20
+
+
+def apply_region_edits(
+    source_audio: str,
+    output_audio: str,
+    regions: list,
+    pitch_shift_semitones: float = -3.0,
+    sr: int = 44100
+) -> int:
+    """
+    処理済み音声の指定区間だけをピッチシフトし、それ以外はそのままコピーした音声（WAV）を書き出す
+    手動編集用（動画の再エンコードはしない。結合は書き出し時に行う）
+
+    source_audio: 直前の処理済み音声（WAV）。同じサンプルレートで読めないもの（動画など）は全体をデコードして使う
+    regions: [{'start': float, 'end': float, 'pitch': float(optional)}, ...]  秒単位
+             pitchが指定されていない場合はpitch_shift_semitonesを使用
+
+    近い区間はまとめ、前後に文脈を付けて切り出してrender_pitch_curveでシフトし、
+    境界をクロスフェードして差し替える。区間外のサンプルは読み込んだ値をそのまま書き出す
+    （PCM_16のWAV同士なら劣化しない）
+
+    Returns:
+        差し替えた箇所の数
+    """
+    try:
+        src = sf.SoundFile(source_audio)
+        if src.samplerate != sr:
+            src.close()
+            src = None
+    except Exception:
+        src = None
+
+    if src is None:
+        decoded = decode_audio(source_audio, sr).T
+        n_total = len(decoded)
+
+        def read(start, end):
+            return decoded[start:end]
+    else:
+        n_total = src.frames
+
+        def read(start, end):
+            src.seek(start)
+            frames = src.read(end - start, dtype='float32', always_2d=True)
+            return np.repeat(frames, 2, axis=1) if frames.shape[1] == 1 else frames[:, :2]
+
+    # 区間をサンプル単位にして、文脈が重なるものをまとめる（区間の順序は後の区間優先のため保つ）
+    context = int(EDIT_CONTEXT_SECONDS * sr)
+    fade = int(EDIT_CROSSFADE_SECONDS * sr)
+    spans = []
+    for i, region in enumerate(regions):
+        start = int(region['start'] * sr)
+        end = min(int(region['end'] * sr), n_total)
+        if start < end:
+            spans.append((start, end, region.get('pitch', pitch_shift_semitones), i))
+    groups = []
+    for span in sorted(spans):
+        lo, hi = max(0, span[0] - context), min(n_total, span[1] + context)
+        if groups and lo <= groups[-1]['hi']:
+            groups[-1]['hi'] = max(groups[-1]['hi'], hi)
+            groups[-1]['spans'].append(span)
+        else:
+            groups.append({'lo': lo, 'hi': hi, 'spans': [span]})
+
+    try:
+        with sf.SoundFile(output_audio, 'w', samplerate=sr, channels=2, subtype='PCM_16') as out:
+            def copy(start, end):
+                for pos in range(start, end, EDIT_COPY_BLOCK):
+                    out.write(read(pos, min(pos + EDIT_COPY_BLOCK, end)))
+
+            pos = 0
+            for group in groups:
+                lo, hi = group['lo'], group['hi']
+                group_spans = sorted(group['spans'], key=lambda span: span[3])
+                print(f"  区間 {lo / sr:.2f}s - {hi / sr:.2f}s を差し替え（{len(group_spans)}区間）")
+                y = read(lo, hi).T
+                curve = build_semitone_curve([(s - lo, e - lo, p) for s, e, p, _ in group_spans], hi - lo)
+                shifted = np.clip(render_pitch_curve(y, curve), -1.0, 1.0)
+
+                # 差し替え範囲：最初の区間の開始〜最後の区間の終了（前後はクロスフェード）
+                a = max(0, min(span[0] for span in group_spans) - lo - fade)
+                b = min(hi - lo, max(span[1] for span in group_spans) - lo + fade)
+                weight = np.ones(b - a, dtype=np.float32)
+                ramp_in = min(fade, b - a)
+                weight[:ramp_in] = np.linspace(0.0, 1.0, ramp_in, endpoint=False)
+                ramp_out = min(fade, b - a - ramp_in)
+                if ramp_out > 0:
+                    weight[b - a - ramp_out:] = np.linspace(1.0, 0.0, ramp_out, endpoint=False)
+                patch = y[:, a:b] * (1.0 - weight) + shifted[:, a:b] * weight
+
+                copy(pos, lo + a)
+                out.write(patch.T)
+                pos = lo + b
+            copy(pos, n_total)
+    finally:
+        if src is not None:
+            src.close()
+
+    return len(groups)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='男性の声だけピッチを下げる動画処理アプリ'
@@ -2363,6 +4502,35 @@ def main():
         default=165,
         help='男性判定のピッチ閾値（Hz、デフォルト: 165）'
     )
+    parser.add_argument(
+        '-m', '--mode',
+        choices=['simple', 'timbre', 'hybrid', 'precision'],
+        default='hybrid',
+        help='処理モード（デフォルト: hybrid）'
+    )
+    parser.add_argument(
+        '-e', '--pitch-engine',
+        choices=sorted(PITCH_ENGINES),
+        default='pyin',
+        help='ピッチ推定エンジン（pyin: 高精度, yin: 高速。デフォルト: pyin）'
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=None,
+        help='F0解析のワーカープロセス数（デフォルト: CPUコア数、1で直列処理）'
+    )
+    parser.add_argument(
+        '--streaming',
+        action='store_true',
+        default=None,
+        help='音声をブロックごとに処理してメモリ使用量を抑える（デフォルト: 30分以上の音声で自動）'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=None,
+        help='中間生成物キャッシュのディレクトリ（同じ動画をパラメータを変えて再処理する場合に高速化）'
+    )
 
     args = parser.parse_args()
 
@@ -2376,7 +4544,9 @@ def main():
         input_path = Path(args.input)
         output_path = str(input_path.parent / f"{input_path.stem}_processed{input_path.suffix}")
 
-    process_video(args.input, output_path, args.pitch, args.segment, args.threshold)
+    process_video(args.input, output_path, args.pitch, args.segment, args.threshold, args.mode,
+                  pitch_engine=args.pitch_engine, analysis_workers=args.workers,
+                  streaming=args.streaming, cache_dir=args.cache_dir)
 
     return 0
 
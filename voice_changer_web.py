@@ -3,20 +3,34 @@
 男性の声だけピッチを下げる動画処理アプリ - Web GUI版（編集機能付き）
 """
 
+import io
 import os
 import sys
+import tempfile
 import threading
+import time
 import uuid
 import traceback
 import json
 from pathlib import Path
 from datetime import datetime
 
-from flask import Flask, render_template_string, request, jsonify, send_file, send_from_directory
+import numpy as np
+import soundfile as sf
+from flask import Flask, Response, render_template_string, request, jsonify, send_file, send_from_directory
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 
-from voice_changer import process_video, analyze_pitch_distribution, pitch_shift_region
+from voice_changer import (process_video, rerender_video, analyze_pitch_distribution, pitch_shift_region,
+                           apply_region_edits, merge_audio_video,
+                           separate_speakers_to_files, process_with_selected_speakers, PITCH_ENGINES,
+                           get_ina_segmenter, get_clearvoice_separator,
+                           build_waveform_peaks, load_waveform_peaks, PEAK_LEVELS, encode_preview_audio,
+                           render_region_preview, render_pitch_curve, build_semitone_curve,
+                           PREVIEW_SAMPLE_RATE)
+from job_queue import JobQueue, QueueFullError, HEAVY_JOB_WORKERS, LIGHT_JOB_WORKERS
+from task_store import TaskStore, FINISHED_STATUSES
+from model_server import ModelServer, USE_MODEL_SERVER, ADDRESS_ENV
 
 app = Flask(__name__, static_folder='static', static_url_path='')
 CORS(app)
@@ -24,6 +38,8 @@ CORS(app)
 # アップロード設定
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
 OUTPUT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
+# 中間生成物キャッシュ（入力内容のハッシュ＋段階＋パラメータで再利用）
+CACHE_FOLDER = os.path.join(OUTPUT_FOLDER, "cache")
 ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'webm', 'm4v', 'flv', 'wmv'}
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
@@ -31,8 +47,115 @@ os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 # アップロードサイズ無制限
 
-# 処理状態を保持
-processing_status = {}
+# 処理状態を保持（SQLite。再起動後も参照でき、終了したタスクは一定時間で削除）
+# 生成ファイルの索引は起動時に作り直す（状態ストアにない古いファイルもファイル名のタスクIDで登録）
+task_store = TaskStore(os.path.join(OUTPUT_FOLDER, "tasks.sqlite3"),
+                       artifact_dirs={UPLOAD_FOLDER: 'input', OUTPUT_FOLDER: None})
+
+# ワーカープロセス内でのみ設定される（進捗・ログを親プロセスへ送るキュー）
+_event_queue = None
+
+
+def update_task(task_id, **fields):
+    """タスクの状態を更新する（ワーカープロセスからは親プロセスへ送る）"""
+    if _event_queue is not None:
+        _event_queue.put(('update', task_id, fields))
+    else:
+        task_store.update(task_id, fields)
+
+
+def append_log(task_id, entry):
+    """タスクのログに1件追加する（ワーカープロセスからは親プロセスへ送る）"""
+    if _event_queue is not None:
+        _event_queue.put(('log', task_id, entry))
+    else:
+        task_store.append_log(task_id, entry)
+
+
+def apply_task_event(event):
+    """ワーカープロセスから届いたイベントを処理状態に反映する"""
+    kind, task_id, payload = event
+    if kind == 'log':
+        task_store.append_log(task_id, payload)
+    else:
+        task_store.update(task_id, payload)
+
+
+def init_job_worker(event_queue):
+    """ワーカープロセスの初期化（軽いレーン）"""
+    global _event_queue
+    _event_queue = event_queue
+
+
+def init_heavy_job_worker(event_queue):
+    """ワーカープロセスの初期化（重いレーン）。モデルサーバーが無い場合はモデルを先に読み込んでおく"""
+    init_job_worker(event_queue)
+    if os.environ.get(ADDRESS_ENV):
+        return
+    for loader in (get_ina_segmenter, get_clearvoice_separator):
+        try:
+            loader()
+        except Exception as e:
+            print(f"[WORKER] モデルの事前読み込みをスキップ: {e}")
+
+
+# ジョブの中の解析（F0・CNN判定のプロセスプール）のプロセス数。同時に動くジョブでCPUコアを分け合う
+# （ジョブごとにCPUコア数のプールを起動すると、ワーカーの中で入れ子になりコア数を大きく超えるため）
+JOB_ANALYSIS_WORKERS = max(1, (os.cpu_count() or 1) // (HEAVY_JOB_WORKERS + LIGHT_JOB_WORKERS))
+os.environ.setdefault('VOICE_CHANGER_WORKERS', str(JOB_ANALYSIS_WORKERS))
+os.environ.setdefault('VOICE_CHANGER_INA_WORKERS', str(JOB_ANALYSIS_WORKERS))
+
+# CNN判定・話者分離のモデルを読み込んでおく常駐プロセス（起動時に開始）
+model_server = ModelServer()
+
+# 処理ジョブのキュー（heavy: CNN判定・話者分離を含む処理、light: 解析・手動編集・再レンダリング）
+# 各レーンのジョブはワーカープロセスで実行する
+job_queue = JobQueue({'heavy': HEAVY_JOB_WORKERS, 'light': LIGHT_JOB_WORKERS},
+                     event_handler=apply_task_event,
+                     worker_initializers={'heavy': init_heavy_job_worker, 'light': init_job_worker})
+
+# 重いレーン内の優先度（小さいほど先に実行）。簡易版は短時間で終わるため先に通す
+MODE_PRIORITY = {'simple': 0, 'timbre': 1, 'hybrid': 2, 'precision': 2}
+
+
+def enqueue_task(task_id, target, args, lane='light', priority=0, restore=None):
+    """
+    タスクをジョブキューに入れる
+    実行開始までは queued=True とし、/status で待ち順を返す（statusの値は変えない）
+    満杯ならタスクの状態を削除して（既存のタスクを再実行する場合はrestoreの状態に戻して）QueueFullErrorを投げる
+    """
+    task_store.update(task_id, {'queued': True})
+    try:
+        position = job_queue.submit(task_id, target, args, lane=lane, priority=priority,
+                                    on_start=lambda: update_task(task_id, queued=False),
+                                    on_error=lambda e: task_failed(task_id, e))
+    except QueueFullError:
+        if restore is not None:
+            task_store.update(task_id, {**restore, 'queued': False})
+        else:
+            task_store.delete(task_id)
+        raise
+    print(f"[QUEUE] {task_id[:8]} -> {lane} (待ち順: {position})")
+    return position
+
+
+def task_failed(task_id, error):
+    """ワーカープロセスが異常終了した場合など、タスク自身がエラーを記録できなかったとき"""
+    task = task_store.get(task_id)
+    if task is not None and task.get('status') in ('processing', 'separating'):
+        update_task(task_id, status='error', message=f'処理が中断されました: {error}', error=str(error))
+    elif task is not None and task.get('muxing'):
+        # 動画の結合（ダウンロード時）が中断された
+        update_task(task_id, muxing=None, mux_error=str(error))
+
+
+def remove_quietly(path):
+    """受け付けられなかったアップロードを削除する"""
+    try:
+        os.remove(path)
+    except:
+        pass
+
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -644,6 +767,15 @@ HTML_TEMPLATE = '''
                         <span>200 (緩く)</span>
                     </div>
                 </div>
+                <div class="setting-group" id="engineGroup" style="display: none;">
+                    <div class="setting-label">
+                        <span>ピッチ推定エンジン<small style="color: #888;">（簡易版のみ）</small></span>
+                    </div>
+                    <select id="pitchEngineSelect" style="width: 100%; padding: 6px;">
+                        <option value="pyin">pYIN（精度重視）</option>
+                        <option value="yin">YIN（高速、長い動画向け）</option>
+                    </select>
+                </div>
             </div>
 
             <div id="simpleAnalyzeArea" style="display: none; margin-bottom: 10px;">
@@ -1057,6 +1189,7 @@ HTML_TEMPLATE = '''
         const segmentGroup = document.getElementById('segmentGroup');
         const adaptiveGroup = document.getElementById('adaptiveGroup');
         const thresholdGroup = document.getElementById('thresholdGroup');
+        const engineGroup = document.getElementById('engineGroup');
         const simpleAnalyzeArea = document.getElementById('simpleAnalyzeArea');
         const modeSimple = document.getElementById('modeSimple');
         const modeTimbre = document.getElementById('modeTimbre');
@@ -1073,6 +1206,7 @@ HTML_TEMPLATE = '''
             segmentGroup.style.display = showHzSettings ? 'block' : 'none';
             adaptiveGroup.style.display = showHzSettings ? 'block' : 'none';
             thresholdGroup.style.display = showHzSettings ? 'block' : 'none';
+            engineGroup.style.display = showHzSettings ? 'block' : 'none';
             simpleAnalyzeArea.style.display = showHzSettings ? 'block' : 'none';
 
             // モード説明の切り替え
@@ -1113,6 +1247,7 @@ HTML_TEMPLATE = '''
             formData.append('threshold', thresholdSlider.value);
             formData.append('adaptive_window', adaptiveSlider.value);
             formData.append('mode', document.querySelector('input[name="mode"]:checked').value);
+            formData.append('pitch_engine', document.getElementById('pitchEngineSelect').value);
 
             const xhr = new XMLHttpRequest();
             xhr.upload.addEventListener('progress', (e) => {
@@ -1477,25 +1612,14 @@ def index():
 @app.route('/audio/<task_id>')
 def get_audio(task_id):
     """Serve audio file for WaveSurfer.js"""
-    audio_path = None
-
-    # First check in-memory task status
-    if task_id in processing_status:
-        task = processing_status[task_id]
-        audio_path = task.get('processed_audio') or task.get('input')
+    # Compressed preview rendition (the lossless WAV is only sent by /download?type=audio).
+    # send_file answers Range requests, so playback can seek without fetching the whole file
+    preview_path = task_store.artifact(task_id, 'preview')
+    if preview_path and os.path.exists(preview_path):
+        return send_file(preview_path, mimetype='audio/mp4', conditional=True)
 
-    # If not found, search output folder for matching files
-    if not audio_path or not os.path.exists(audio_path):
-        import glob
-        patterns = [
-            os.path.join(OUTPUT_FOLDER, f"*{task_id[:8]}*.wav"),
-            os.path.join(OUTPUT_FOLDER, f"*{task_id}*.wav"),
-        ]
-        for pattern in patterns:
-            matches = glob.glob(pattern)
-            if matches:
-                audio_path = matches[0]
-                break
+    # Tasks without a preview (editor uploads, older tasks): resolve through the artifact index (no folder scans)
+    audio_path = task_store.artifact(task_id, 'processed_audio') or task_store.artifact(task_id, 'input')
 
     if not audio_path or not os.path.exists(audio_path):
         return jsonify({'error': 'Audio file not found'}), 404
@@ -1503,41 +1627,81 @@ def get_audio(task_id):
     return send_file(audio_path, mimetype='audio/wav')
 
 
+@app.route('/peaks/<task_id>')
+def get_peaks(task_id):
+    """
+    波形表示用のピーク（min/max）を返す（音声を取得せずに波形を描けるように）
+    level: 1ビンあたりのサンプル数（256 / 2048 / 16384）。省略時は長さに応じて選ぶ
+    format: json（既定。dataは [min, max, min, max, ...] で±1.0）
+            bin（int16リトルエンディアンのmin, maxの並び。±32767が±1.0。情報はX-Peaks-*ヘッダ）
+    """
+    peaks_path = task_store.artifact(task_id, 'peaks')
+    if not peaks_path or not os.path.exists(peaks_path):
+        return jsonify({'error': 'Peaks not found'}), 404
+
+    try:
+        peaks = load_waveform_peaks(peaks_path, request.args.get('level', type=int))
+    except KeyError:
+        return jsonify({'error': f"levelは {', '.join(str(level) for level in PEAK_LEVELS)} のいずれかです"}), 400
+
+    data = peaks['peaks'].reshape(-1)
+    if request.args.get('format') == 'bin':
+        return Response(data.astype('<i2').tobytes(), mimetype='application/octet-stream', headers={
+            'X-Peaks-Sample-Rate': str(peaks['sample_rate']),
+            'X-Peaks-Samples-Per-Bin': str(peaks['samples_per_bin']),
+            'X-Peaks-Frames': str(peaks['frames']),
+        })
+    return jsonify({
+        'sample_rate': peaks['sample_rate'],
+        'samples_per_bin': peaks['samples_per_bin'],
+        'levels': peaks['levels'],
+        'length': len(peaks['peaks']),
+        'duration': peaks['frames'] / peaks['sample_rate'],
+        'data': np.round(data / 32767.0, 4).tolist(),
+    })
+
+
+def warm_up_region_preview():
+    """区間プレビューの初回だけ遅くならないよう、起動時にプレビューと同じピッチシフトを一度実行しておく"""
+    y = np.zeros((2, PREVIEW_SAMPLE_RATE), dtype=np.float32)
+    render_pitch_curve(y, build_semitone_curve([(0, y.shape[1], -1.0)], y.shape[1]))
+
+
+@app.route('/preview')
+def region_preview():
+    """
+    選択区間だけをピッチシフトした試聴用の音声（WAV）を返す
+    task_id, start, end（秒）, semitones を受け取り、タスクの処理済み音声（なければ入力）の該当区間だけを読んで処理する。
+    ジョブキューを通さずその場で返す（最大30秒）
+    """
+    task_id = request.args.get('task_id', '')
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    semitones = request.args.get('semitones', -3.0, type=float)
+    if start is None or end is None:
+        return jsonify({'error': 'start と end を指定してください'}), 400
+
+    source_path = task_store.artifact(task_id, 'processed_audio') or task_store.artifact(task_id, 'input')
+    if not source_path or not os.path.exists(source_path):
+        return jsonify({'error': 'Audio file not found'}), 404
+
+    try:
+        y = render_region_preview(source_path, start, end, semitones, sr=PREVIEW_SAMPLE_RATE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    buffer = io.BytesIO()
+    sf.write(buffer, y.T, PREVIEW_SAMPLE_RATE, format='WAV', subtype='PCM_16')
+    buffer.seek(0)
+    return send_file(buffer, mimetype='audio/wav', max_age=0)
+
+
 @app.route('/video/<task_id>')
 def get_video(task_id):
     """Serve video file for editor preview"""
-    video_path = None
-
-    # First check in-memory task status
-    if task_id in processing_status:
-        task = processing_status[task_id]
-        video_path = task.get('output') or task.get('input')
-
-    # If not found, search output folder for matching files
-    if not video_path or not os.path.exists(video_path):
-        import glob
-        patterns = [
-            os.path.join(OUTPUT_FOLDER, f"*{task_id[:8]}*.mp4"),
-            os.path.join(OUTPUT_FOLDER, f"*{task_id}*.mp4"),
-        ]
-        for pattern in patterns:
-            matches = glob.glob(pattern)
-            if matches:
-                video_path = matches[0]
-                break
-
-    # Also check uploads folder for original file
-    if not video_path or not os.path.exists(video_path):
-        import glob
-        patterns = [
-            os.path.join(UPLOAD_FOLDER, f"*{task_id[:8]}*"),
-            os.path.join(UPLOAD_FOLDER, f"*{task_id}*"),
-        ]
-        for pattern in patterns:
-            matches = glob.glob(pattern)
-            if matches:
-                video_path = matches[0]
-                break
+    # Resolve through the artifact index (no folder scans)
+    video_path = next((path for path in (task_store.artifact(task_id, 'output'), task_store.artifact(task_id, 'input'))
+                       if path and os.path.exists(path)), None)
 
     if not video_path or not os.path.exists(video_path):
         return jsonify({'error': 'Video file not found'}), 404
@@ -1564,6 +1728,9 @@ def upload():
         adaptive_window = float(request.form.get('adaptive_window', 300))
         mode = request.form.get('mode', 'hybrid')  # hybrid, simple, timbre
         double_check = request.form.get('double_check', '1') == '1'  # デフォルト有効
+        pitch_engine = request.form.get('pitch_engine', 'pyin')  # pyin（高精度）, yin（高速）
+        if pitch_engine not in PITCH_ENGINES:
+            return jsonify({'error': f'不明なピッチ推定エンジンです: {pitch_engine}'}), 400
         task_id = str(uuid.uuid4())
 
         filename = secure_filename(file.filename)
@@ -1575,19 +1742,25 @@ def upload():
         output_filename = f"{name}_{task_id[:8]}_processed.mp4"
         output_path = os.path.join(OUTPUT_FOLDER, output_filename)
 
-        processing_status[task_id] = {
+        task_store.create(task_id, {
             'status': 'processing',
             'input': input_path,
             'output': output_path,
             'original_filename': filename,
+            'mode': mode,
+            'pitch': pitch,
             'progress': 10,
             'step': '処理を開始中...',
             'logs': [{'message': 'ファイルを受信しました', 'type': 'info'}]
-        }
+        })
 
-        thread = threading.Thread(target=process_task, args=(task_id, input_path, output_path, pitch, segment, threshold, mode, adaptive_window, double_check))
-        thread.daemon = True
-        thread.start()
+        try:
+            enqueue_task(task_id, process_task,
+                         (task_id, input_path, output_path, pitch, segment, threshold, mode, adaptive_window, double_check, pitch_engine),
+                         lane='heavy', priority=MODE_PRIORITY.get(mode, 2))
+        except QueueFullError as e:
+            remove_quietly(input_path)
+            return jsonify({'error': str(e)}), 503
 
         return jsonify({'task_id': task_id})
 
@@ -1620,18 +1793,20 @@ def analyze():
         input_path = os.path.join(UPLOAD_FOLDER, unique_filename)
         file.save(input_path)
 
-        processing_status[task_id] = {
+        task_store.create(task_id, {
             'status': 'analyzing',
             'input': input_path,
             'progress': 0,
             'step': '解析を開始中...',
             'logs': [{'message': 'ファイルを受信しました', 'type': 'info'}]
-        }
+        })
 
         # バックグラウンドで解析実行
-        thread = threading.Thread(target=analyze_task, args=(task_id, input_path))
-        thread.daemon = True
-        thread.start()
+        try:
+            enqueue_task(task_id, analyze_task, (task_id, input_path), lane='light')
+        except QueueFullError as e:
+            remove_quietly(input_path)
+            return jsonify({'error': str(e)}), 503
 
         return jsonify({'task_id': task_id})
 
@@ -1645,20 +1820,18 @@ def analyze_task(task_id, input_path):
         def progress_callback(message):
             add_log(task_id, message)
 
-        result = analyze_pitch_distribution(input_path, progress_callback=progress_callback)
+        result = analyze_pitch_distribution(input_path, progress_callback=progress_callback,
+                                            cache_dir=CACHE_FOLDER)
 
         # 結果を保存
-        processing_status[task_id]['status'] = 'complete'
-        processing_status[task_id]['result'] = result
+        update_task(task_id, status='complete', result=result)
         add_log(task_id, '解析が完了しました!')
 
     except Exception as e:
         error_msg = str(e)
         tb = traceback.format_exc()
         add_log(task_id, f'エラー発生: {error_msg}', 'error')
-        processing_status[task_id]['status'] = 'error'
-        processing_status[task_id]['message'] = error_msg
-        processing_status[task_id]['traceback'] = tb
+        update_task(task_id, status='error', message=error_msg, traceback=tb)
 
     finally:
         # 一時ファイルを削除
@@ -1686,12 +1859,12 @@ def upload_for_editor():
         input_path = os.path.join(UPLOAD_FOLDER, unique_filename)
         file.save(input_path)
 
-        processing_status[task_id] = {
+        task_store.create(task_id, {
             'status': 'ready',
             'input': input_path,
             'output': input_path,
             'original_filename': filename,
-        }
+        })
 
         return jsonify({'task_id': task_id})
 
@@ -1708,35 +1881,44 @@ def apply_pitch():
         regions = data.get('regions', [])
         pitch = float(data.get('pitch', -3.0))
 
-        if not source_task_id or source_task_id not in processing_status:
+        if not source_task_id or source_task_id not in task_store:
             return jsonify({'error': 'タスクが見つかりません'}), 400
 
         if not regions:
             return jsonify({'error': '区間が選択されていません'}), 400
 
-        source_task = processing_status[source_task_id]
-        input_path = source_task.get('output') or source_task.get('input')
+        source_task = task_store[source_task_id]
+        input_path = source_task.get('output')
+        audio_source = None
+        if not input_path or not os.path.exists(input_path):
+            # 手動編集の動画はダウンロード時まで結合しないため、元の動画と編集結果の音声を使う
+            input_path = source_task.get('video_source') or source_task.get('input')
+            processed_audio = source_task.get('processed_audio')
+            if processed_audio and os.path.exists(processed_audio):
+                audio_source = processed_audio
+        if not input_path or not os.path.exists(input_path):
+            return jsonify({'error': '入力ファイルが見つかりません'}), 400
 
         task_id = str(uuid.uuid4())
         name = Path(input_path).stem
         output_filename = f"{name}_edited_{task_id[:8]}.mp4"
         output_path = os.path.join(OUTPUT_FOLDER, output_filename)
 
-        processing_status[task_id] = {
+        task_store.create(task_id, {
             'status': 'processing',
             'input': input_path,
             'output': output_path,
             'progress': 10,
             'step': '区間ピッチ変換中...',
             'logs': [{'message': f'{len(regions)}区間をピッチ変換します', 'type': 'info'}]
-        }
+        })
 
-        thread = threading.Thread(
-            target=process_regions_task,
-            args=(task_id, input_path, output_path, regions, pitch)
-        )
-        thread.daemon = True
-        thread.start()
+        try:
+            enqueue_task(task_id, process_regions_task,
+                         (task_id, input_path, output_path, regions, pitch, audio_source),
+                         lane='light')
+        except QueueFullError as e:
+            return jsonify({'error': str(e)}), 503
 
         return jsonify({'task_id': task_id})
 
@@ -1745,22 +1927,39 @@ def apply_pitch():
 
 
 def add_log(task_id, message, log_type='info'):
-    if task_id in processing_status:
-        processing_status[task_id]['logs'].append({
-            'message': message,
-            'type': log_type,
-            'time': datetime.now().isoformat()
-        })
-        print(f"[{log_type.upper()}] {message}")
+    append_log(task_id, {
+        'message': message,
+        'type': log_type,
+        'time': datetime.now().isoformat()
+    })
+    print(f"[{log_type.upper()}] {message}")
 
 
 def update_progress(task_id, progress, step):
-    if task_id in processing_status:
-        processing_status[task_id]['progress'] = progress
-        processing_status[task_id]['step'] = step
+    update_task(task_id, progress=progress, step=step)
 
 
-def process_task(task_id, input_path, output_path, pitch, segment=0.5, threshold=165, mode='hybrid', adaptive_window=300.0, double_check=True):
+def save_editor_renditions(task_id, audio_path):
+    """
+    処理済み音声から波形エディタ用のデータ（波形ピーク・再生用の圧縮音声）を作る
+    失敗しても処理自体はエラーにしない（エディタは非圧縮WAVで表示する）
+    """
+    base, _ = os.path.splitext(audio_path)
+    peaks_path = base + '_peaks.npz'
+    try:
+        build_waveform_peaks(audio_path, peaks_path)
+        update_task(task_id, peaks=peaks_path)
+    except Exception as e:
+        add_log(task_id, f'波形ピークの作成に失敗しました: {e}', 'warning')
+    preview_path = base + '_preview.m4a'
+    try:
+        encode_preview_audio(audio_path, preview_path)
+        update_task(task_id, preview=preview_path)
+    except Exception as e:
+        add_log(task_id, f'再生用音声の作成に失敗しました: {e}', 'warning')
+
+
+def process_task(task_id, input_path, output_path, pitch, segment=0.5, threshold=165, mode='hybrid', adaptive_window=300.0, double_check=True, pitch_engine='pyin'):
     try:
         mode_names = {
             'simple': '簡易版（Hz判定のみ）',
@@ -1778,6 +1977,7 @@ def process_task(task_id, input_path, output_path, pitch, segment=0.5, threshold
             add_log(task_id, f'セグメント長: {segment}秒')
             adaptive_str = '固定' if adaptive_window == 0 else f'{adaptive_window}秒ごと'
             add_log(task_id, f'動的閾値調整: {adaptive_str}')
+            add_log(task_id, f'ピッチ推定エンジン: {pitch_engine}')
         elif mode == 'hybrid':
             add_log(task_id, f'男性判定閾値: {threshold}Hz')
         update_progress(task_id, 20, '音声を抽出中...')
@@ -1796,62 +1996,218 @@ def process_task(task_id, input_path, output_path, pitch, segment=0.5, threshold
                 update_progress(task_id, prog, status)
             add_log(task_id, message)
 
-        # 音声ファイル保存パスを生成
+        # 音声ファイル・再レンダリング情報の保存パスを生成
         audio_output_path = output_path.replace('.mp4', '.wav')
+        plan_dir = output_path.replace('.mp4', '_plan')
 
         result = process_video(input_path, output_path, pitch, segment, threshold, mode, adaptive_window,
                       progress_callback=progress_callback, save_audio_path=audio_output_path,
-                      enable_double_check=double_check)
+                      enable_double_check=double_check, pitch_engine=pitch_engine,
+                      cache_dir=CACHE_FOLDER, plan_dir=plan_dir)
 
         update_progress(task_id, 100, '完了!')
         add_log(task_id, '処理が完了しました!')
-        processing_status[task_id]['status'] = 'complete'
-        processing_status[task_id]['processed_audio'] = audio_output_path
         # 処理済み区間を保存（波形エディタで表示用）
         if result and 'processed_segments' in result:
-            processing_status[task_id]['processed_segments'] = result['processed_segments']
+            update_task(task_id, processed_segments=result['processed_segments'])
             add_log(task_id, f'処理済み区間: {len(result["processed_segments"])}箇所')
 
-        try:
-            os.remove(input_path)
-        except:
-            pass
+        if result and result.get('render_plan'):
+            # 再レンダリング（/rerender）で使うため入力ファイルは残す
+            # （入力と再レンダリング情報はタスクの期限切れ時に状態ストアが削除する）
+            update_task(task_id, render_plan=result['render_plan'])
+        else:
+            try:
+                os.remove(input_path)
+            except:
+                pass
+        save_editor_renditions(task_id, audio_output_path)
+        update_task(task_id, status='complete', processed_audio=audio_output_path)
 
     except Exception as e:
         error_msg = str(e)
         tb = traceback.format_exc()
         add_log(task_id, f'エラー発生: {error_msg}', 'error')
-        processing_status[task_id]['status'] = 'error'
-        processing_status[task_id]['message'] = error_msg
-        processing_status[task_id]['traceback'] = tb
+        update_task(task_id, status='error', message=error_msg, traceback=tb)
 
 
-def process_regions_task(task_id, input_path, output_path, regions, pitch):
-    """選択区間のみピッチ変換"""
+def process_regions_task(task_id, input_path, output_path, regions, pitch, audio_source=None):
+    """選択区間のみピッチ変換（audio_source: 動画と別に持つ音声。指定時はこの音声を変換する）"""
     try:
         add_log(task_id, f'{len(regions)}区間をピッチ {pitch}半音で変換')
         update_progress(task_id, 30, '音声を処理中...')
 
-        pitch_shift_region(input_path, output_path, regions, pitch)
+        pitch_shift_region(input_path, output_path, regions, pitch, audio_source=audio_source)
 
         update_progress(task_id, 100, '完了!')
         add_log(task_id, '処理が完了しました!')
-        processing_status[task_id]['status'] = 'complete'
+        update_task(task_id, status='complete')
 
     except Exception as e:
         error_msg = str(e)
         tb = traceback.format_exc()
         add_log(task_id, f'エラー発生: {error_msg}', 'error')
-        processing_status[task_id]['status'] = 'error'
-        processing_status[task_id]['message'] = error_msg
-        processing_status[task_id]['traceback'] = tb
+        update_task(task_id, status='error', message=error_msg, traceback=tb)
+
+
+@app.route('/rerender/<task_id>', methods=['POST'])
+def rerender(task_id):
+    """完了したタスクの解析結果（男性区間・話者分離）を使い、ピッチ量だけ変えて出力し直す"""
+    try:
+        if task_id not in task_store:
+            return jsonify({'error': 'タスクが見つかりません'}), 404
+
+        source_task = task_store[task_id]
+        plan_dir = source_task.get('render_plan')
+        input_path = source_task.get('input')
+        if source_task.get('status') != 'complete' or not plan_dir:
+            return jsonify({'error': '再レンダリングできるタスクではありません'}), 400
+        if not input_path or not os.path.exists(input_path):
+            return jsonify({'error': '入力ファイルが見つかりません'}), 400
+
+        data = request.get_json(silent=True) or {}
+        pitch = float(data.get('pitch', source_task.get('pitch', -3.0)))
+
+        new_task_id = str(uuid.uuid4())
+        original_name = source_task.get('original_filename', 'output.mp4')
+        name, _ = os.path.splitext(original_name)
+        output_filename = f"{name}_{new_task_id[:8]}_processed.mp4"
+        output_path = os.path.join(OUTPUT_FOLDER, output_filename)
+        audio_output_path = output_path.replace('.mp4', '.wav')
+
+        task_store.create(new_task_id, {
+            'status': 'processing',
+            'input': input_path,
+            'output': output_path,
+            'processed_audio': audio_output_path,
+            'original_filename': original_name,
+            'mode': source_task.get('mode'),
+            'pitch': pitch,
+            'render_plan': plan_dir,
+            'processed_segments': source_task.get('processed_segments', []),
+            'progress': 10,
+            'step': '再レンダリング中...',
+            'logs': [{'message': f'解析結果を再利用してピッチ {pitch}半音で出力し直します', 'type': 'info'}]
+        })
+
+        try:
+            enqueue_task(new_task_id, process_rerender_task,
+                         (new_task_id, input_path, output_path, audio_output_path, plan_dir, pitch),
+                         lane='light')
+        except QueueFullError as e:
+            return jsonify({'error': str(e)}), 503
+
+        return jsonify({'task_id': new_task_id})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def process_rerender_task(task_id, input_path, output_path, audio_output_path, plan_dir, pitch):
+    """ピッチシフトと動画の結合だけをやり直す"""
+    try:
+        def progress_callback(step, message):
+            progress_map = {
+                'pitch': (50, 'ピッチ変換中...'),
+                'combine': (90, '動画を出力中...'),
+            }
+            if step in progress_map:
+                prog, status = progress_map[step]
+                update_progress(task_id, prog, status)
+            add_log(task_id, message)
+
+        rerender_video(input_path, output_path, plan_dir, pitch, progress_callback=progress_callback,
+                       save_audio_path=audio_output_path, cache_dir=CACHE_FOLDER)
+
+        save_editor_renditions(task_id, audio_output_path)
+        update_progress(task_id, 100, '完了!')
+        add_log(task_id, '再レンダリングが完了しました!')
+        update_task(task_id, status='complete')
+
+    except Exception as e:
+        error_msg = str(e)
+        tb = traceback.format_exc()
+        add_log(task_id, f'エラー発生: {error_msg}', 'error')
+        update_task(task_id, status='error', message=error_msg, traceback=tb)
+
+
+# /events で変更がないときに送るキープアライブの間隔（秒）
+SSE_KEEPALIVE_SECONDS = 15.0
+
+
+def task_status(task_id, since=0):
+    """
+    /status と /events で返すタスクの状態
+    logsにはログIDがsinceより後のものだけを入れ、log_cursor（次回のsince）を付ける
+    """
+    task = task_store.get(task_id)
+    if task is None:
+        return None
+    rows = task_store.log_rows(task_id, since)
+    task['logs'] = [entry for _, entry in rows]
+    task['log_cursor'] = rows[-1][0] if rows else since
+    if task.get('queued'):
+        # 実行待ちの間は待ち順を返す
+        position = job_queue.position(task_id)
+        if position is not None:
+            task.update(queue_position=position, step=f'順番待ち中（{position}番目）')
+    return task
 
 
 @app.route('/status/<task_id>')
 def status(task_id):
-    if task_id not in processing_status:
+    task = task_status(task_id, request.args.get('since', 0, type=int))
+    if task is None:
+        return jsonify({'error': 'タスクが見つかりません'}), 404
+    return jsonify(task)
+
+
+@app.route('/events/<task_id>')
+def task_events(task_id):
+    """
+    処理状況をServer-Sent Eventsで送る
+    状態が変わったときだけ送り、ログは前回から増えた分だけを入れる。処理が終わったら閉じる
+    再接続時は Last-Event-ID（=log_cursor）から続きを送る
+    """
+    if task_id not in task_store:
         return jsonify({'error': 'タスクが見つかりません'}), 404
-    return jsonify(processing_status[task_id])
+    since = request.args.get('since', type=int)
+    if since is None:
+        since = int(request.headers.get('Last-Event-ID') or 0)
+
+    def stream(cursor):
+        last_state = None
+        version = task_store.version
+        while True:
+            task = task_status(task_id, cursor)
+            if task is None:
+                return
+            cursor = task['log_cursor']
+            state = {k: v for k, v in task.items() if k not in ('logs', 'log_cursor')}
+            if task['logs'] or state != last_state:
+                last_state = state
+                yield f"id: {cursor}\ndata: {json.dumps(task, ensure_ascii=False)}\n\n"
+            if task.get('status') in FINISHED_STATUSES:
+                return
+            new_version = task_store.wait_for_change(version, SSE_KEEPALIVE_SECONDS)
+            if new_version == version:
+                yield ": keepalive\n\n"
+            version = new_version
+
+    return Response(stream(since), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/queue')
+def queue_stats():
+    """ジョブキューのレーンごとの待ち件数・実行中件数"""
+    return jsonify(job_queue.stats())
+
+
+@app.route('/models')
+def model_stats():
+    """モデルサーバーの状態（モデルごとに cold/loading/warm/unavailable、処理した要求数・バッチ数）"""
+    return jsonify(model_server.status())
 
 
 @app.route('/apply_manual_pitch', methods=['POST'])
@@ -1863,16 +2219,34 @@ def apply_manual_pitch():
         regions = data.get('regions', [])
         pitch = float(data.get('pitch', -3.0))
 
-        if not source_task_id or source_task_id not in processing_status:
+        if not source_task_id or source_task_id not in task_store:
             return jsonify({'error': '元のタスクが見つかりません'}), 400
 
         if not regions:
             return jsonify({'error': '区間が選択されていません'}), 400
 
-        source_task = processing_status[source_task_id]
-        input_path = source_task.get('output')
+        source_task = task_store[source_task_id]
+        # 手動編集は元の動画と1回目の処理結果（非圧縮WAV）に対する編集リストとして持つ。
+        # 音声は直前の編集結果のWAVに今回の区間だけを差し替え、動画との結合はダウンロード時に行う
+        video_source = source_task.get('video_source')
+        if not video_source:
+            video_source = next((path for path in (source_task.get('input'), source_task.get('output'))
+                                 if path and os.path.exists(path)), None)
+        if not video_source or not os.path.exists(video_source):
+            return jsonify({'error': '入力ファイルが見つかりません'}), 400
 
-        if not input_path or not os.path.exists(input_path):
+        base_audio = source_task.get('base_audio') or source_task.get('processed_audio') or video_source
+        edit = [dict(r, pitch=r.get('pitch', pitch)) for r in regions]
+        edits = source_task.get('edits', []) + [edit]
+
+        source_audio = source_task.get('processed_audio')
+        if source_audio and os.path.exists(source_audio):
+            pending_edits = [edit]
+        elif os.path.exists(base_audio):
+            # 直前の編集結果がなければ、1回目の処理結果から編集リストを順に適用し直す
+            source_audio = base_audio
+            pending_edits = edits
+        else:
             return jsonify({'error': '入力ファイルが見つかりません'}), 400
 
         # 新しいタスクIDを生成
@@ -1883,24 +2257,27 @@ def apply_manual_pitch():
         output_path = os.path.join(OUTPUT_FOLDER, output_filename)
         audio_output_path = output_path.replace('.mp4', '.wav')
 
-        processing_status[new_task_id] = {
+        task_store.create(new_task_id, {
             'status': 'processing',
-            'input': input_path,
+            'input': video_source,
             'output': output_path,
             'processed_audio': audio_output_path,
+            'video_source': video_source,
+            'base_audio': base_audio,
+            'edits': edits,
             'original_filename': original_name,
             'progress': 10,
             'step': '手動編集を処理中...',
             'logs': [{'message': f'{len(regions)}区間をピッチ変換します', 'type': 'info'}]
-        }
+        })
 
         # バックグラウンドで処理
-        thread = threading.Thread(
-            target=process_manual_regions_task,
-            args=(new_task_id, input_path, output_path, audio_output_path, regions, pitch)
-        )
-        thread.daemon = True
-        thread.start()
+        try:
+            enqueue_task(new_task_id, process_manual_regions_task,
+                         (new_task_id, source_audio, audio_output_path, pending_edits),
+                         lane='light')
+        except QueueFullError as e:
+            return jsonify({'error': str(e)}), 503
 
         return jsonify({'task_id': new_task_id})
 
@@ -1911,53 +2288,134 @@ def apply_manual_pitch():
         return jsonify({'error': str(e)}), 500
 
 
-def process_manual_regions_task(task_id, input_path, output_path, audio_output_path, regions, pitch):
-    """手動選択区間のピッチ変換"""
+def process_manual_regions_task(task_id, source_audio, audio_output_path, pending_edits):
+    """
+    手動選択区間のピッチ変換（編集リストのうち未適用の分をsource_audioに順に適用する）
+    変更した区間だけを描き直して差し替え、動画の結合はダウンロード時まで行わない
+    """
     try:
-        # 各regionにpitchが含まれているかログ出力
-        print(f"[DEBUG] regions received: {regions}")
+        regions = pending_edits[-1]
         for i, r in enumerate(regions):
-            region_pitch = r.get('pitch', pitch)
-            print(f"[DEBUG] region {i}: start={r.get('start')}, end={r.get('end')}, pitch={region_pitch}")
-            add_log(task_id, f"区間{i+1}: {r.get('start'):.2f}s - {r.get('end'):.2f}s, {region_pitch}半音")
+            add_log(task_id, f"区間{i+1}: {r.get('start'):.2f}s - {r.get('end'):.2f}s, {r.get('pitch')}半音")
+        if len(pending_edits) > 1:
+            add_log(task_id, f'編集リストを適用し直します（{len(pending_edits)}回分）')
 
         add_log(task_id, f'{len(regions)}区間を処理中...')
         update_progress(task_id, 30, '音声を処理中...')
 
-        # pitch_shift_regionを呼び出し（音声も保存）
-        pitch_shift_region(input_path, output_path, regions, pitch, save_audio_path=audio_output_path)
+        current = source_audio
+        for step, edit in enumerate(pending_edits):
+            target = audio_output_path if step == len(pending_edits) - 1 else f"{audio_output_path}.step{step}.wav"
+            apply_region_edits(current, target, edit)
+            if current != source_audio:
+                remove_quietly(current)
+            current = target
 
+        save_editor_renditions(task_id, audio_output_path)
         update_progress(task_id, 100, '完了!')
         add_log(task_id, '手動編集が完了しました!')
-        processing_status[task_id]['status'] = 'complete'
+        update_task(task_id, status='complete')
 
     except Exception as e:
         error_msg = str(e)
         tb = traceback.format_exc()
         add_log(task_id, f'エラー発生: {error_msg}', 'error')
-        processing_status[task_id]['status'] = 'error'
-        processing_status[task_id]['message'] = error_msg
-        processing_status[task_id]['traceback'] = tb
+        update_task(task_id, status='error', message=error_msg, traceback=tb)
+
+
+# 手動編集の動画の結合を待つ時間の上限（秒）。これより前に始まった結合は中断されたものとしてやり直す
+EDIT_MUX_TIMEOUT = 600.0
+# 結合を始めるかどうかの判定と開始の記録をまとめて行うためのロック
+_mux_guard = threading.Lock()
+
+
+def mux_edited_video_task(task_id, video_source, processed_audio, output_path):
+    """
+    手動編集の音声を元の動画と結合する（ジョブキューの軽いレーンで実行）
+    途中のファイルを返さないよう、一時ファイルに書き出してから置き換える
+    """
+    base, ext = os.path.splitext(output_path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(base)}.muxing-", suffix=ext,
+                                    dir=os.path.dirname(output_path))
+    os.close(fd)
+    try:
+        merge_audio_video(video_source, processed_audio, tmp_path)
+        os.replace(tmp_path, output_path)
+        update_task(task_id, muxing=None, mux_error=None)
+    except Exception as e:
+        add_log(task_id, f'動画の結合に失敗しました: {e}', 'error')
+        update_task(task_id, muxing=None, mux_error=str(e))
+    finally:
+        remove_quietly(tmp_path)
+
+
+def start_edited_video_mux(task_id):
+    """
+    手動編集のタスクの動画がまだなければ、結合をジョブキューに入れる
+    結合中（EDIT_MUX_TIMEOUT以内に始まったもの）なら新しく入れず、その結果を待つ
+    """
+    with _mux_guard:
+        task = task_store[task_id]
+        output_path = task['output']
+        if os.path.exists(output_path):
+            return
+        started = task.get('muxing')
+        if started and time.time() - started < EDIT_MUX_TIMEOUT:
+            return
+        task_store.update(task_id, {'muxing': time.time(), 'mux_error': None})
+        enqueue_task(task_id, mux_edited_video_task,
+                     (task_id, task['video_source'], task['processed_audio'], output_path),
+                     lane='light', restore={'muxing': None})
+
+
+def wait_for_edited_video(task_id, timeout=EDIT_MUX_TIMEOUT):
+    """結合が終わるまで待つ（失敗したらRuntimeError、時間切れはTimeoutError）"""
+    deadline = time.time() + timeout
+    while True:
+        version = task_store.version
+        task = task_store[task_id]
+        if not task.get('muxing'):
+            break
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TimeoutError('動画の結合が時間内に終わりませんでした')
+        task_store.wait_for_change(version, min(remaining, SSE_KEEPALIVE_SECONDS))
+    if task.get('mux_error'):
+        raise RuntimeError(task['mux_error'])
+    task_store.refresh_artifact(task_id, 'output')
 
 
 @app.route('/download/<task_id>')
 def download(task_id):
-    if task_id not in processing_status:
+    if task_id not in task_store:
         return jsonify({'error': 'タスクが見つかりません'}), 404
 
-    task = processing_status[task_id]
+    task = task_store[task_id]
     output_path = task.get('output')
     audio_path = task.get('processed_audio')
 
+    # フォーマット指定（video または audio）
+    format_type = request.args.get('type', request.args.get('format', 'video'))
+
+    if (format_type != 'audio' and task.get('edits') and task.get('status') == 'complete'
+            and output_path and not os.path.exists(output_path)):
+        # 手動編集の結果は、書き出すときに初めて動画と結合する（結合は軽いレーンのジョブで行う）
+        try:
+            start_edited_video_mux(task_id)
+            wait_for_edited_video(task_id)
+        except QueueFullError as e:
+            return jsonify({'error': str(e)}), 503
+        except TimeoutError as e:
+            return jsonify({'error': str(e)}), 504
+        except Exception as e:
+            return jsonify({'error': f'動画の書き出しに失敗しました: {e}'}), 500
+
     if not output_path or not os.path.exists(output_path):
         return jsonify({'error': 'ファイルが見つかりません'}), 404
 
     original_name = task.get('original_filename', 'output.mp4')
     name, _ = os.path.splitext(original_name)
 
-    # フォーマット指定（video または audio）
-    format_type = request.args.get('type', request.args.get('format', 'video'))
-
     if format_type == 'audio':
         # WAVファイルをダウンロード
         if audio_path and os.path.exists(audio_path):
@@ -2001,7 +2459,7 @@ def separate_speakers():
     os.makedirs(speaker_dir, exist_ok=True)
 
     # ステータス初期化
-    processing_status[task_id] = {
+    task_store.create(task_id, {
         'status': 'separating',
         'progress': 0,
         'step': '話者分離を開始中...',
@@ -2009,50 +2467,44 @@ def separate_speakers():
         'input': input_path,
         'speaker_dir': speaker_dir,
         'original_filename': filename
-    }
+    })
 
-    def add_log(task_id, message):
-        processing_status[task_id]['logs'].append(message)
+    # バックグラウンド実行（話者分離は重いレーン）
+    try:
+        enqueue_task(task_id, separate_task, (task_id, input_path, speaker_dir), lane='heavy', priority=2)
+    except QueueFullError as e:
+        remove_quietly(input_path)
+        return jsonify({'error': str(e)}), 503
 
-    def separate_task(task_id, input_path, speaker_dir):
-        try:
-            def progress_callback(step, message):
-                add_log(task_id, message)
-                processing_status[task_id]['step'] = message
+    return jsonify({'task_id': task_id})
 
-            result = separate_speakers_to_files(
-                input_path,
-                speaker_dir,
-                progress_callback
-            )
 
-            processing_status[task_id]['status'] = 'separated'
-            processing_status[task_id]['speakers'] = result['speakers']
-            processing_status[task_id]['step'] = '話者分離完了'
+def separate_task(task_id, input_path, speaker_dir):
+    """バックグラウンドで話者分離を実行"""
+    try:
+        def progress_callback(step, message):
+            append_log(task_id, message)
+            update_task(task_id, step=message)
 
-        except Exception as e:
-            processing_status[task_id]['status'] = 'error'
-            processing_status[task_id]['error'] = str(e)
-            processing_status[task_id]['traceback'] = traceback.format_exc()
-
-    # バックグラウンド実行
-    thread = threading.Thread(
-        target=separate_task,
-        args=(task_id, input_path, speaker_dir),
-        daemon=True
-    )
-    thread.start()
+        result = separate_speakers_to_files(
+            input_path,
+            speaker_dir,
+            progress_callback
+        )
 
-    return jsonify({'task_id': task_id})
+        update_task(task_id, status='separated', speakers=result['speakers'], step='話者分離完了')
+
+    except Exception as e:
+        update_task(task_id, status='error', error=str(e), traceback=traceback.format_exc())
 
 
 @app.route('/speaker_audio/<task_id>/<int:speaker_id>')
 def speaker_audio(task_id, speaker_id):
     """分離された話者の音声ファイルを返す"""
-    if task_id not in processing_status:
+    if task_id not in task_store:
         return jsonify({'error': 'タスクが見つかりません'}), 404
 
-    task = processing_status[task_id]
+    task = task_store[task_id]
     speaker_dir = task.get('speaker_dir')
 
     if not speaker_dir:
@@ -2073,10 +2525,10 @@ def process_selected_speakers_api():
     male_speaker_ids = data.get('male_speaker_ids', [])
     pitch = float(data.get('pitch', -3.0))
 
-    if not task_id or task_id not in processing_status:
+    if not task_id or task_id not in task_store:
         return jsonify({'error': 'タスクが見つかりません'}), 400
 
-    task = processing_status[task_id]
+    task = task_store[task_id]
     input_path = task.get('input')
     speaker_dir = task.get('speaker_dir')
     original_filename = task.get('original_filename', 'output.mp4')
@@ -2089,45 +2541,41 @@ def process_selected_speakers_api():
     output_filename = f"{name}_{task_id[:8]}_processed.mp4"
     output_path = os.path.join(OUTPUT_FOLDER, output_filename)
 
-    processing_status[task_id]['status'] = 'processing'
-    processing_status[task_id]['output'] = output_path
-    processing_status[task_id]['step'] = '処理を開始中...'
+    # 状態はジョブを入れる前に書く（すぐ終わったジョブの結果を上書きしないように）
+    previous = {key: task.get(key) for key in ('status', 'output', 'step')}
+    task_store.update(task_id, {'status': 'processing', 'output': output_path, 'step': '処理を開始中...'})
 
-    def add_log(task_id, message):
-        processing_status[task_id]['logs'].append(message)
+    # バックグラウンド実行（分離済みの話者をピッチシフトするだけなので軽いレーン）
+    try:
+        position = enqueue_task(task_id, process_selected_speakers_task,
+                                (task_id, input_path, output_path, speaker_dir, male_speaker_ids, pitch),
+                                lane='light', restore=previous)
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 503
 
-    def process_task(task_id, input_path, output_path, speaker_dir, male_speaker_ids, pitch):
-        try:
-            def progress_callback(step, message):
-                add_log(task_id, message)
-                processing_status[task_id]['step'] = message
-
-            process_with_selected_speakers(
-                input_path,
-                output_path,
-                speaker_dir,
-                male_speaker_ids,
-                pitch,
-                progress_callback
-            )
-
-            processing_status[task_id]['status'] = 'complete'
-            processing_status[task_id]['step'] = '処理完了'
+    return jsonify({'status': 'processing', 'queue_position': position})
 
-        except Exception as e:
-            processing_status[task_id]['status'] = 'error'
-            processing_status[task_id]['error'] = str(e)
-            processing_status[task_id]['traceback'] = traceback.format_exc()
 
-    # バックグラウンド実行
-    thread = threading.Thread(
-        target=process_task,
-        args=(task_id, input_path, output_path, speaker_dir, male_speaker_ids, pitch),
-        daemon=True
-    )
-    thread.start()
+def process_selected_speakers_task(task_id, input_path, output_path, speaker_dir, male_speaker_ids, pitch):
+    """選択された話者をピッチシフトして動画を出力"""
+    try:
+        def progress_callback(step, message):
+            append_log(task_id, message)
+            update_task(task_id, step=message)
+
+        process_with_selected_speakers(
+            input_path,
+            output_path,
+            speaker_dir,
+            male_speaker_ids,
+            pitch,
+            progress_callback
+        )
 
-    return jsonify({'status': 'processing'})
+        update_task(task_id, status='complete', step='処理完了')
+
+    except Exception as e:
+        update_task(task_id, status='error', error=str(e), traceback=traceback.format_exc())
 
 
 EDITOR_TEMPLATE = '''
@@ -3118,4 +3566,8 @@ if __name__ == '__main__':
     print(f"Output folder: {OUTPUT_FOLDER}")
     print("\nPress Ctrl+C to stop")
     print("="*50 + "\n")
+    if USE_MODEL_SERVER:
+        # ジョブのワーカープロセスより先に起動する（接続先を環境変数で引き継ぐため）
+        model_server.start()
+    threading.Thread(target=warm_up_region_preview, daemon=True).start()
     app.run(host='0.0.0.0', port=5003, debug=False)